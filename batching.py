@@ -0,0 +1,114 @@
+# Length-aware batching for encoder.QuartzNet.
+#
+# The featurizer pads every utterance of a batch to the longest one. Passing
+# the per-utterance lengths to QuartzNet.forward masks that padding after
+# every block so it no longer leaks into the valid frames, but the padded
+# frames are still convolved. transcribe_batch() additionally sorts the
+# batch by length and splits it into sub-batches whose members have similar
+# lengths, each cropped to its own longest utterance, so a mixed-length
+# batch costs close to the sum of its true lengths.
+
+import torch
+
+
+def count_macs(model, length):
+  """Multiply-accumulates of one `length`-frame utterance through an
+  encoder.QuartzNet (encoder, residual and decoder convs)."""
+  encoder = model.encoder
+  channels = encoder.feat_in
+  macs = 0
+  for s in encoder.spec:
+    block_in = channels
+    padding = s.dilation * (s.kernel - 1) // 2
+    extent = s.dilation * (s.kernel - 1) + 1
+    for _ in range(s.repeat):
+      length = (length + 2 * padding - extent) // s.stride + 1
+      if s.kernel > 1:
+        macs += channels * s.kernel * length
+      macs += channels * s.filters * length
+      channels = s.filters
+    if s.residual:
+      macs += block_in * s.filters * length
+  return macs + channels * model.decoder.out_channels * length
+
+
+def length_buckets(lengths, max_padding=0.1, batch_size=None):
+  """Groups utterance indices into sub-batches of similar length.
+
+  Utterances are taken longest first; one joins the current sub-batch while
+  the padded frame count stays within (1 + max_padding) times the frames
+  actually present.
+
+  Returns:
+      List of index lists, longest sub-batch first.
+  """
+  order = sorted(range(len(lengths)), key=lambda i: -int(lengths[i]))
+  groups = []
+  group, longest, total = [], 0, 0
+  for i in order:
+    length = int(lengths[i])
+    full = batch_size is not None and len(group) == batch_size
+    if group and (full or (len(group) + 1) * longest >
+                  (1 + max_padding) * (total + length)):
+      groups.append(group)
+      group, longest, total = [], 0, 0
+    if not group:
+      longest = length
+    group.append(i)
+    total += length
+  if group:
+    groups.append(group)
+  return groups
+
+
+def flop_report(model, lengths, groups=None):
+  """Compares the compute of a padded batch with its useful compute.
+
+  Returns:
+      dict with 'useful', 'padded' and (if `groups` are given) 'bucketed'
+      MACs, plus 'padded_ratio' / 'bucketed_ratio' relative to 'useful'.
+  """
+  lengths = [int(l) for l in lengths]
+  report = {'useful': sum(count_macs(model, l) for l in lengths),
+            'padded': len(lengths) * count_macs(model, max(lengths))}
+  report['padded_ratio'] = report['padded'] / report['useful']
+  if groups is not None:
+    report['bucketed'] = sum(
+        len(g) * count_macs(model, max(lengths[i] for i in g)) for g in groups)
+    report['bucketed_ratio'] = report['bucketed'] / report['useful']
+  return report
+
+
+@torch.no_grad()
+def transcribe_batch(model, features, lengths, max_padding=0.1,
+                     batch_size=None):
+  """Log-probs of a padded batch, run in length-sorted cropped sub-batches.
+
+  Args:
+      model: encoder.QuartzNet (plain, fused or scripted).
+      features (Tensor): [B, 64, T] padded spectrograms.
+      lengths (Tensor): [B] valid frames per utterance.
+      max_padding (float): Padding overhead allowed within a sub-batch.
+      batch_size (int): Optional cap on the sub-batch size.
+
+  Returns:
+      ([B, T', 29] model outputs ([B, T'] ids with output='ids'), [B]
+      output lengths). Frames at or beyond an utterance's output length
+      are unspecified.
+  """
+  lengths = torch.as_tensor(lengths, dtype=torch.long)
+  encoder = model.encoder
+  out_lengths = encoder.output_lengths(lengths)
+  out_frames = int(encoder.output_lengths(
+      torch.tensor([features.shape[-1]]))[0])
+  out = None
+  for group in length_buckets(lengths.tolist(), max_padding, batch_size):
+    index = torch.tensor(group)
+    sub_lengths = lengths[index]
+    x = features[index, :, :int(sub_lengths.max())]
+    y = model(x, sub_lengths)
+    if out is None:
+      # [B, T', 29] for the log-prob heads, [B, T'] for output='ids'
+      out = y.new_zeros((features.shape[0], out_frames) + y.shape[2:])
+    out[index, :y.shape[1]] = y
+  return out, out_lengths
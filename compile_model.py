@@ -1,3 +1,6 @@
+import argparse
+import time
+
 import numpy as np
 import torch
 from utils.common import post_process_predictions, post_process_transcripts, word_error_rate, to_numpy
@@ -5,6 +8,9 @@ from utils.audio_preprocessing import AudioToMelSpectrogramPreprocessor
 from utils.data_layer import AudioToTextDataLayer
 torch.set_printoptions(8)
 from model import Model
+from encoder import QuartzNet
+from engine import TvmEngine
+from utils.segment import AudioSegment
 vocab = [" ", "a", "b", "c", "d", "e", "f", "g", "h", "i", "j", "k", "l", "m",
     "n", "o", "p", "q", "r", "s", "t", "u", "v", "w", "x", "y", "z", "'"]
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")    
@@ -30,11 +36,8 @@ def evaluate(model, val_data):
       processed_signal = preprocessor.get_features(audio_signal_e1, a_sig_length_e1)
 
       # Inference and accumulate time. Input shape: [Batch_size, 64, Timesteps]
-      prob = model(processed_signal)
-      ologits = torch.log(prob)
-      alogits = np.asarray(ologits)
-      logits = torch.from_numpy(alogits[0])
-      predictions_e1 = logits.argmax(dim=-1, keepdim=False)
+      # Greedy [B, T] ids straight from the graph (Model(output='ids'))
+      predictions_e1 = model(processed_signal)
       transcript_e1 = torch.from_numpy(np.asarray(test_batch[2])) 
       transcript_len_e1 = torch.from_numpy(np.asarray(test_batch[1])) 
 
@@ -55,20 +58,91 @@ def accuracy(predictions, transcripts, transcripts_len):
   wer = word_error_rate(hypotheses=greedy_hypotheses, references=references)
   return 1 - wer
 
-print("Loading torch model")
-model = Model()
-model = model.eval()
+WAVS = ['116-288045-0000.wav', '116-288045-0001.wav']
+
+
+def parse_bucket(text):
+  """'8x1024' -> (8, 1024)"""
+  batch, frames = text.lower().split('x')
+  return int(batch), int(frames)
+
+
+def wav_features(paths):
+  """[1, 64, T] features of every wav, with its duration in seconds."""
+  preprocessor = AudioToMelSpectrogramPreprocessor(sample_rate=16000)
+  for path in paths:
+    samples = AudioSegment.from_file(path, target_sr=16000).samples
+    signal = torch.tensor(samples, dtype=torch.float).unsqueeze(0)
+    length = torch.tensor([signal.shape[1]])
+    yield preprocessor.get_features(signal, length), len(samples) / 16000
+
+
+def real_time_factor(run, features, repeat=3):
+  """Median wall seconds of run(features) per second of audio."""
+  total, audio = 0., 0.
+  for x, seconds in features:
+    run(x)
+    times = []
+    for _ in range(repeat):
+      t = time.perf_counter()
+      run(x)
+      times.append(time.perf_counter() - t)
+    total += sorted(times)[len(times) // 2]
+    audio += seconds
+  return total / audio
+
+
+def transcripts(run, features):
+  return [post_process_predictions([run(x).argmax(-1)], vocab)[0]
+          for x, _ in features]
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      description='Compile QuartzNet with TVM for a set of shape buckets.')
+  parser.add_argument('--buckets', nargs='+', type=parse_bucket,
+                      default=[(1, 256), (1, 1024), (1, 2048)],
+                      help='(batch)x(frames) shapes to compile, e.g. 1x1024')
+  parser.add_argument('--target', default='llvm',
+                      help='TVM target, e.g. "llvm -mcpu=skylake-avx512"')
+  parser.add_argument('--opt_level', type=int, default=3)
+  parser.add_argument('--data', default='sample.json',
+                      help='manifest for the WER check, empty to skip')
+  parser.add_argument('--wavs', nargs='+', default=WAVS,
+                      help='recordings the real-time factor is measured on')
+  args = parser.parse_args()
+
+  if args.data:
+    print("Loading torch model")
+    model = Model(output='ids')
+    model = model.eval()
 
-input_shape = [1, 64, 256]
-input_data = torch.randn(input_shape)
-scripted_model = torch.jit.trace(model, input_data).eval()
+    input_shape = [1, 64, 256]
+    input_data = torch.randn(input_shape)
+    scripted_model = torch.jit.trace(model, input_data).eval()
 
-#Load a data
-data = 'sample.json'
-acc, wer = evaluate(scripted_model, data)
+    acc, wer = evaluate(scripted_model, args.data)
+    print('wer: %2f'%wer)
 
-print('wer: %2f'%wer)
-import tvm
-from tvm import relay
+  features = list(wav_features(args.wavs))
+  frames = max(x.shape[-1] for x, _ in features)
+  buckets = list(args.buckets)
+  if not any(b[1] >= frames for b in buckets):
+    buckets.append((1, frames))
+  engine = TvmEngine(target=args.target, opt_level=args.opt_level,
+                     buckets=buckets)
+  for batch, frames in engine.policy.buckets:
+    t = time.perf_counter()
+    path = engine.build(batch, frames)
+    print('built %dx%d in %.0f s: %s' % (
+        batch, frames, time.perf_counter() - t, path))
 
-#Load a test sample
\ No newline at end of file
+  eager = QuartzNet.from_variables().eval()
+  with torch.no_grad():
+    eager_rtf = real_time_factor(eager, features)
+    eager_text = transcripts(eager, features)
+  tvm_rtf = real_time_factor(engine.run, features)
+  tvm_text = transcripts(engine.run, features)
+  print('eager RTF %.4f, tvm RTF %.4f (%.2fx)' % (
+      eager_rtf, tvm_rtf, eager_rtf / tvm_rtf))
+  print('transcripts match: %s' % (eager_text == tvm_text))
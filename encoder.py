@@ -0,0 +1,267 @@
+# QuartzNet assembled from a block spec.
+#
+# model.py is the literal onnx-pytorch translation of the exported graph:
+# every conv is a hand-numbered n_Conv_* attribute and forward() is unrolled.
+# QuartzNetEncoder builds the same network from a (filters, repeat, kernel,
+# stride, dilation, residual) spec, and variable_names() maps its parameters
+# onto the exported variables/ so QuartzNet.from_variables() reproduces
+# model.Model bit-exactly.
+
+import collections
+from typing import Optional
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from utils.weights import load_variables, skip_init
+
+BlockSpec = collections.namedtuple(
+    'BlockSpec', ['filters', 'repeat', 'kernel', 'stride', 'dilation', 'residual'])
+
+# QuartzNet 15x5: prologue C1, five groups of three 5-repeat residual blocks
+# B1..B5, then the epilogue C2 (dilated) and C3 (pointwise only).
+QUARTZNET_15x5 = (
+    [BlockSpec(256, 1, 33, 2, 1, False)] +
+    [BlockSpec(256, 5, 33, 1, 1, True)] * 3 +
+    [BlockSpec(256, 5, 39, 1, 1, True)] * 3 +
+    [BlockSpec(512, 5, 51, 1, 1, True)] * 3 +
+    [BlockSpec(512, 5, 63, 1, 1, True)] * 3 +
+    [BlockSpec(512, 5, 75, 1, 1, True)] * 3 +
+    [BlockSpec(512, 1, 87, 1, 2, False),
+     BlockSpec(1024, 1, 1, 1, 1, False)])
+
+FEAT_IN = 64
+NUM_CLASSES = 29
+
+# Output heads: 'log_softmax' [B, T', 29] log-probs (one fused op instead of
+# softmax then log), 'logits' the raw [B, T', 29] decoder output, 'ids' the
+# [B, T'] greedy class ids taken straight from the decoder output (argmax is
+# unchanged by the softmax, so no exp/log or transpose runs at all) and
+# 'softmax' [B, T', 29] probabilities, as the Vitis flow expects.
+OUTPUTS = ('log_softmax', 'logits', 'ids', 'softmax')
+
+
+def check_output(output):
+  if output not in OUTPUTS:
+    raise ValueError(f"Unknown output {output}, expected one of {OUTPUTS}.")
+  return output
+
+
+def output_head(x: torch.Tensor, output: str = 'log_softmax') -> torch.Tensor:
+  """Turns [B, 29, T'] decoder output into the model output (see
+  OUTPUTS)."""
+  if output == 'ids':
+    return x.argmax(dim=1)
+  x = x.permute(0, 2, 1)
+  if output == 'log_softmax':
+    return F.log_softmax(x, dim=2)
+  if output == 'softmax':
+    return F.softmax(x, dim=2)
+  return x
+
+
+def mask_padding(x: torch.Tensor, lengths: torch.Tensor) -> torch.Tensor:
+  """Zeroes the frames of a [B, C, T] tensor at or beyond `lengths`."""
+  frames = torch.arange(x.shape[-1], device=x.device)
+  return x.masked_fill((frames >= lengths.unsqueeze(1)).unsqueeze(1), 0.)
+
+
+class SeparableConv(nn.Module):
+  """Depthwise conv followed by a 1x1 conv with bias.
+
+  Kernel size 1 drops the depthwise part (C3 is a plain pointwise conv).
+  """
+  def __init__(self, in_channels, out_channels, kernel, stride=1, dilation=1):
+    super(SeparableConv, self).__init__()
+    self.stride = stride
+    self.padding = dilation * (kernel - 1) // 2
+    self.extent = dilation * (kernel - 1) + 1
+    if kernel > 1:
+      self.depthwise = nn.Conv1d(
+          in_channels, in_channels, kernel, stride=stride,
+          padding=dilation * (kernel - 1) // 2, dilation=dilation,
+          groups=in_channels, bias=False)
+    else:
+      self.depthwise = nn.Identity()
+    self.pointwise = nn.Conv1d(in_channels, out_channels, 1, bias=True)
+
+  def output_lengths(self, lengths: torch.Tensor) -> torch.Tensor:
+    if self.stride == 1 and self.extent == 2 * self.padding + 1:
+      return lengths
+    return torch.div(lengths + 2 * self.padding - self.extent, self.stride,
+                     rounding_mode='floor') + 1
+
+  def forward(self, x):
+    return self.pointwise(self.depthwise(x))
+
+
+class QuartzNetBlock(nn.Module):
+  """`repeat` separable convs with ReLU in between and an optional 1x1
+  residual connection added before the last ReLU.
+
+  Given per-utterance `lengths` (at the block's input rate), padded frames
+  are zeroed after every ReLU so that the next depthwise conv sees zeros
+  there, exactly like an utterance run on its own.
+  """
+  def __init__(self, in_channels, spec):
+    super(QuartzNetBlock, self).__init__()
+    self.convs = nn.ModuleList()
+    channels = in_channels
+    for _ in range(spec.repeat):
+      self.convs.append(SeparableConv(channels, spec.filters, spec.kernel,
+                                      spec.stride, spec.dilation))
+      channels = spec.filters
+    if spec.residual:
+      self.residual = nn.Conv1d(in_channels, spec.filters, 1, bias=True)
+    else:
+      self.residual = None
+
+  def output_lengths(self, lengths: torch.Tensor) -> torch.Tensor:
+    for conv in self.convs:
+      lengths = conv.output_lengths(lengths)
+    return lengths
+
+  def forward(self, x, lengths: Optional[torch.Tensor] = None):
+    out = x
+    last = len(self.convs) - 1
+    for i, conv in enumerate(self.convs):
+      out = conv(out)
+      if lengths is not None:
+        lengths = conv.output_lengths(lengths)
+      if i != last:
+        out = F.relu(out)
+        if lengths is not None:
+          out = mask_padding(out, lengths)
+    if self.residual is not None:
+      out = torch.add(out, self.residual(x))
+    out = F.relu(out)
+    if lengths is not None:
+      out = mask_padding(out, lengths)
+    return out
+
+
+class QuartzNetEncoder(nn.Module):
+  __jit_unused_properties__ = ['stride']
+
+  def __init__(self, spec=QUARTZNET_15x5, feat_in=FEAT_IN):
+    super(QuartzNetEncoder, self).__init__()
+    self.spec = [BlockSpec(*s) for s in spec]
+    self.blocks = nn.ModuleList()
+    channels = feat_in
+    for s in self.spec:
+      self.blocks.append(QuartzNetBlock(channels, s))
+      channels = s.filters
+    self.feat_in = feat_in
+    self.out_channels = channels
+
+  @property
+  def stride(self):
+    """Input frames per output frame."""
+    stride = 1
+    for s in self.spec:
+      stride *= s.stride
+    return stride
+
+  def receptive_field(self):
+    """Input frames an output frame depends on, on each side."""
+    frames, scale = 0, 1
+    for s in self.spec:
+      frames += s.repeat * s.dilation * (s.kernel - 1) // 2 * scale
+      scale *= s.stride
+    return frames
+
+  @torch.jit.export
+  def output_lengths(self, lengths: torch.Tensor) -> torch.Tensor:
+    for block in self.blocks:
+      lengths = block.output_lengths(lengths)
+    return lengths
+
+  def forward(self, x, lengths: Optional[torch.Tensor] = None):
+    if lengths is None:
+      for block in self.blocks:
+        x = block(x)
+      return x
+    x = mask_padding(x, lengths)
+    for block in self.blocks:
+      x = block(x, lengths)
+      lengths = block.output_lengths(lengths)
+    return x
+
+
+class QuartzNet(nn.Module):
+  """Encoder, 1x1 CTC decoder and output head.
+
+  Takes [B, 64, T] features like model.Model and returns [B, T', 29]
+  log-probs (or whatever `output` head is chosen, see OUTPUTS). With
+  per-utterance `lengths` the padding of shorter utterances is masked
+  after every block, so their valid output frames
+  (encoder.output_lengths(lengths)) match running them alone.
+  """
+  def __init__(self, spec=QUARTZNET_15x5, feat_in=FEAT_IN,
+               num_classes=NUM_CLASSES, output='log_softmax'):
+    super(QuartzNet, self).__init__()
+    self.encoder = QuartzNetEncoder(spec, feat_in)
+    self.decoder = nn.Conv1d(self.encoder.out_channels, num_classes, 1,
+                             bias=True)
+    self.output = check_output(output)
+
+  @classmethod
+  def from_variables(cls, weights=None, spec=QUARTZNET_15x5,
+                     output='log_softmax'):
+    """Builds the network and binds the exported variables to it.
+
+    Args:
+        weights: Anything utils.weights.load_variables accepts.
+        spec: Block spec, must match the exported network.
+        output: Output head, one of OUTPUTS.
+    """
+    with skip_init(nn.Conv1d):
+      model = cls(spec, output=output)
+    model.bind_variables(load_variables(weights))
+    return model
+
+  def bind_variables(self, variables):
+    """Points every parameter at its exported variable without copying."""
+    for param_name, var_name in variable_names(self):
+      if var_name not in variables:
+        raise KeyError(f"Exported variable {var_name} for {param_name} "
+                       f"not found.")
+      param = self.get_parameter(param_name)
+      value = variables[var_name]
+      if param.shape != value.shape:
+        raise ValueError(
+            f"{param_name} has shape {tuple(param.shape)} but {var_name} "
+            f"has shape {tuple(value.shape)}; the spec does not match the "
+            f"exported network.")
+      param.data = value
+
+  def forward(self, audio_signal, lengths: Optional[torch.Tensor] = None):
+    x = self.decoder(self.encoder(audio_signal, lengths))
+    return output_head(x, self.output)
+
+
+def variable_names(model):
+  """Yields (parameter name, exported variable name) pairs for a QuartzNet.
+
+  The exporter named depthwise weights after their NeMo module path
+  (encoder.<block>.mconv.<5 * repeat>.conv.weight) and the BN-folded
+  pointwise convs t_1000, t_1001, t_1003, ... in graph order, where each
+  residual 1x1 conv comes right after the last pointwise conv of its block.
+  """
+  counter = 1000
+  for b, block in enumerate(model.encoder.blocks):
+    prefix = f'encoder.blocks.{b}'
+    for r, conv in enumerate(block.convs):
+      if isinstance(conv.depthwise, nn.Conv1d):
+        yield (f'{prefix}.convs.{r}.depthwise.weight',
+               f'encoder_encoder_{b}_mconv_{5 * r}_conv_weight')
+      yield f'{prefix}.convs.{r}.pointwise.weight', f't_{counter}'
+      yield f'{prefix}.convs.{r}.pointwise.bias', f't_{counter + 1}'
+      counter += 3
+    if block.residual is not None:
+      yield f'{prefix}.residual.weight', f't_{counter}'
+      yield f'{prefix}.residual.bias', f't_{counter + 1}'
+      counter += 3
+  yield 'decoder.weight', 'decoder_decoder_layers_0_weight'
+  yield 'decoder.bias', 'decoder_decoder_layers_0_bias'
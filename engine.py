@@ -0,0 +1,451 @@
+# One inference interface over the eager, TorchScript, ONNX Runtime and TVM
+# backends.
+#
+# Every engine is built from the same encoder.QuartzNet (and so from the same
+# exported variables) and exposes run(features, lengths) returning [B, T', 29]
+# log-probs as a torch tensor. Compiled artifacts (scripted or traced
+# modules, ONNX graph, TVM libraries) live in an ArtifactCache directory
+# under a name derived from the backend, its options, the input shape where
+# the artifact is shape-specialized and a digest of the weights, so a
+# restart loads them instead of compiling again and changed weights never
+# pick up a stale artifact.
+#
+# Shape-specialized backends (TorchScript traces, TVM) serve a fixed set of
+# (batch, frames) buckets: an input is zero-padded up to the nearest bucket
+# and the lengths input masks the padding, so outputs do not depend on the
+# bucket. Each bucket is compiled the first time it is needed and kept
+# loaded, so steady-state serving never recompiles or retraces.
+#
+# A deployment picks its backend with create_engine(config), where config is
+# a backend name, a dict such as {"backend": "onnxruntime",
+# "intra_op_threads": 4} or the path of a JSON file holding one.
+
+import hashlib
+import json
+import os
+import warnings
+
+import torch
+import torch.nn.functional as F
+
+import onnx_sessions
+from encoder import FEAT_IN, QuartzNet
+from fusion import fuse
+from precision import to_precision
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
+
+# Features arrive padded to a multiple of 16 frames (FilterbankFeatures
+# pad_to); the buckets cover 2.5 s to 41 s at batch 1 and 8.
+DEFAULT_BUCKETS = tuple((batch, frames) for batch in (1, 8)
+                        for frames in (256, 512, 1024, 2048, 4096))
+FRAME_STEP = 1024
+
+
+def weights_digest(model):
+  """Hex digest of a model's parameters (names, shapes and values)."""
+  digest = hashlib.sha1()
+  for name, tensor in sorted(model.state_dict().items()):
+    digest.update(name.encode())
+    digest.update(str(tuple(tensor.shape)).encode())
+    digest.update(tensor.detach().contiguous().numpy().tobytes())
+  return digest.hexdigest()
+
+
+class BucketPolicy(object):
+  """Maps input shapes onto a fixed set of (batch, frames) buckets.
+
+  An input goes to the bucket with the fewest elements that holds it.
+  Inputs larger than every bucket keep their batch size and are padded to
+  a multiple of `frame_step` frames, which still bounds the number of
+  distinct shapes.
+  """
+  def __init__(self, buckets=DEFAULT_BUCKETS, frame_step=FRAME_STEP):
+    self.buckets = sorted(set(tuple(b) for b in buckets))
+    self.frame_step = frame_step
+
+  def bucket(self, batch, frames):
+    fitting = [b for b in self.buckets if b[0] >= batch and b[1] >= frames]
+    if not fitting:
+      return batch, -(-frames // self.frame_step) * self.frame_step
+    return min(fitting, key=lambda b: (b[0] * b[1], b))
+
+  def pad(self, features, lengths):
+    """Zero-pads a batch and its lengths to its bucket.
+
+    Returns:
+        (features, lengths, (batch, frames) bucket). Padded rows have
+        length 0.
+    """
+    batch, _, frames = features.shape
+    bucket = self.bucket(batch, frames)
+    if bucket != (batch, frames):
+      features = F.pad(features, (0, bucket[1] - frames, 0, 0,
+                                  0, bucket[0] - batch))
+      lengths = F.pad(lengths, (0, bucket[0] - batch))
+    return features, lengths, bucket
+
+
+class ArtifactCache(object):
+  """Directory of compiled artifacts with least-recently-used eviction.
+
+  Artifacts are the files directly inside `root`. A hit refreshes the
+  file's modification time, which is the recency eviction goes by once
+  the cache holds more than `max_bytes` or `max_entries`.
+  """
+  def __init__(self, root=CACHE_DIR, max_bytes=None, max_entries=None):
+    self.root = root
+    self.max_bytes = max_bytes
+    self.max_entries = max_entries
+    self.hits = 0
+    self.misses = 0
+
+  def path(self, name):
+    return os.path.join(self.root, name)
+
+  def get(self, name, build):
+    """Path of artifact `name`, calling build(path) to create it first if
+    it is not cached."""
+    path = self.path(name)
+    if os.path.exists(path):
+      os.utime(path)
+      self.hits += 1
+      return path
+    os.makedirs(self.root, exist_ok=True)
+    # Build next to the final path and rename, so that a concurrent or
+    # interrupted build never leaves a truncated artifact behind.
+    tmp = os.path.join(self.root, '.%d-%s' % (os.getpid(), name))
+    try:
+      build(tmp)
+      os.replace(tmp, path)
+    finally:
+      if os.path.exists(tmp):
+        os.remove(tmp)
+    self.misses += 1
+    self.evict(keep=path)
+    return path
+
+  def discard(self, name):
+    path = self.path(name)
+    if os.path.exists(path):
+      os.remove(path)
+
+  def entries(self):
+    """(mtime, bytes, path) of every artifact, oldest first."""
+    if not os.path.isdir(self.root):
+      return []
+    entries = []
+    for name in os.listdir(self.root):
+      path = self.path(name)
+      if not name.startswith('.') and os.path.isfile(path):
+        stat = os.stat(path)
+        entries.append((stat.st_mtime, stat.st_size, path))
+    return sorted(entries)
+
+  def evict(self, keep=None):
+    """Removes least recently used artifacts until the limits hold."""
+    entries = [e for e in self.entries() if e[2] != keep]
+    kept = 1 if keep is not None else 0
+    size = sum(e[1] for e in entries) + \
+        (os.path.getsize(keep) if keep is not None else 0)
+    while entries and (
+        (self.max_entries is not None and
+         len(entries) + kept > self.max_entries) or
+        (self.max_bytes is not None and size > self.max_bytes)):
+      _, nbytes, path = entries.pop(0)
+      os.remove(path)
+      size -= nbytes
+
+
+class InferenceEngine(object):
+  """Base class of the backends.
+
+  Args:
+      weights: Anything utils.weights.load_variables accepts.
+      model: An already built encoder.QuartzNet to use instead of weights.
+      cache_dir (str): Where compiled artifacts are kept.
+      max_cache_bytes (int): Size limit of the artifact cache.
+      max_cache_entries (int): Artifact count limit of the cache.
+  """
+  backend = None
+
+  def __init__(self, weights=None, model=None, cache_dir=CACHE_DIR,
+               max_cache_bytes=None, max_cache_entries=None):
+    if model is None:
+      model = QuartzNet.from_variables(weights)
+    self.model = model.eval()
+    self.cache = ArtifactCache(cache_dir, max_cache_bytes, max_cache_entries)
+    self.digest = weights_digest(self.model)
+
+  def artifact_name(self, suffix, *key):
+    """Cache name of an artifact of this backend, options, output head and
+    weights."""
+    return '-'.join([self.backend] + [str(k) for k in key] +
+                    [self.model.output, self.digest[:16]]) + suffix
+
+  def output_lengths(self, lengths):
+    return self.model.encoder.output_lengths(torch.as_tensor(lengths))
+
+  def _lengths(self, features, lengths):
+    if lengths is None:
+      return torch.full((features.shape[0],), features.shape[-1],
+                        dtype=torch.long)
+    return torch.as_tensor(lengths, dtype=torch.long)
+
+  def run(self, features, lengths=None):
+    """Log-probs of a [B, 64, T] batch; `lengths` masks the padding of
+    shorter utterances (see encoder.QuartzNet)."""
+    raise NotImplementedError
+
+
+class EagerEngine(InferenceEngine):
+  """encoder.QuartzNet in PyTorch eager mode, optionally fused and in
+  reduced precision ('bf16' or 'fp16', see precision.to_precision)."""
+  backend = 'eager'
+
+  def __init__(self, weights=None, model=None, cache_dir=CACHE_DIR,
+               fused=False, precision='fp32', **cache_limits):
+    super(EagerEngine, self).__init__(weights, model, cache_dir,
+                                      **cache_limits)
+    if fused:
+      fuse(self.model)
+    self.model = to_precision(self.model, precision)
+
+  @torch.no_grad()
+  def run(self, features, lengths=None):
+    if lengths is not None:
+      lengths = torch.as_tensor(lengths, dtype=torch.long)
+    return self.model(features, lengths)
+
+
+class TorchScriptEngine(InferenceEngine):
+  """Scripted encoder.QuartzNet; the scripted module is cached."""
+  backend = 'torchscript'
+
+  def __init__(self, weights=None, model=None, cache_dir=CACHE_DIR,
+               fused=True, **cache_limits):
+    super(TorchScriptEngine, self).__init__(weights, model, cache_dir,
+                                            **cache_limits)
+    self.fused = fused
+    self.path = self.cache.get(
+        self.artifact_name('.pt', 'fused' if fused else 'eager'), self.save)
+    self.module = torch.jit.load(self.path).eval()
+
+  def save(self, path):
+    model = fuse(self.model) if self.fused else self.model
+    torch.jit.save(torch.jit.script(model), path)
+
+  @torch.no_grad()
+  def run(self, features, lengths=None):
+    if lengths is not None:
+      lengths = torch.as_tensor(lengths, dtype=torch.long)
+    return self.module(features, lengths)
+
+
+class OnnxRuntimeEngine(InferenceEngine):
+  """ONNX export of encoder.QuartzNet with dynamic batch and time axes.
+
+  The export and the graph ONNX Runtime optimizes it into are both cached;
+  the session comes from onnx_sessions' process-wide pool and runs through
+  IOBindings with pre-allocated outputs.
+  """
+  backend = 'onnxruntime'
+  opset = onnx_sessions.DEFAULT_OPSET
+
+  def __init__(self, weights=None, model=None, cache_dir=CACHE_DIR,
+               intra_op_threads=0, inter_op_threads=0, **cache_limits):
+    import onnxruntime
+    super(OnnxRuntimeEngine, self).__init__(weights, model, cache_dir,
+                                            **cache_limits)
+    name = self.artifact_name('.onnx', 'opset%d' % self.opset)
+    exported = self.cache.get(
+        name, lambda path: onnx_sessions.export_onnx(self.model, path,
+                                                     self.opset))
+    self.path = self.cache.get(
+        name[:-len('.onnx')] + '-optimized.onnx',
+        lambda path: onnx_sessions.optimize_onnx(exported, path))
+    self.session = onnx_sessions.get_session(
+        self.path, intra_op_threads, inter_op_threads)
+
+  def run(self, features, lengths=None):
+    lengths = self._lengths(features, lengths)
+    logprobs, = self.session.run({'audio_signal': features.numpy(),
+                                  'lengths': lengths.numpy()})
+    return torch.from_numpy(logprobs)
+
+
+class BucketedEngine(InferenceEngine):
+  """Base class of backends compiled for static input shapes.
+
+  Subclasses provide artifact_key(), compile(), load() and forward(); this
+  class pads every input to its BucketPolicy bucket, compiles each bucket
+  lazily through the artifact cache, keeps the loaded modules and crops
+  the outputs back to the input's shape.
+
+  Args:
+      buckets: (batch, frames) pairs to serve.
+      frame_step (int): Frame rounding of inputs larger than every bucket.
+  """
+  def __init__(self, weights=None, model=None, cache_dir=CACHE_DIR,
+               buckets=DEFAULT_BUCKETS, frame_step=FRAME_STEP,
+               **cache_limits):
+    super(BucketedEngine, self).__init__(weights, model, cache_dir,
+                                         **cache_limits)
+    self.policy = BucketPolicy(buckets, frame_step)
+    self.modules = {}
+
+  def artifact_key(self, batch, frames):
+    """Cache name of the artifact of one bucket."""
+    raise NotImplementedError
+
+  def compile(self, batch, frames, path):
+    """Compiles the model for one bucket into `path`."""
+    raise NotImplementedError
+
+  def load(self, path):
+    raise NotImplementedError
+
+  def forward(self, module, features, lengths):
+    raise NotImplementedError
+
+  def build(self, batch, frames):
+    """Compiles one bucket unless cached; returns the artifact path."""
+    return self.cache.get(self.artifact_key(batch, frames),
+                          lambda path: self.compile(batch, frames, path))
+
+  def module(self, batch, frames):
+    key = (batch, frames)
+    if key not in self.modules:
+      self.modules[key] = self.load(self.build(batch, frames))
+    return self.modules[key]
+
+  def warmup(self, buckets=None):
+    """Compiles and loads buckets ahead of serving (all by default)."""
+    for batch, frames in buckets or self.policy.buckets:
+      self.module(batch, frames)
+
+  def run(self, features, lengths=None):
+    lengths = self._lengths(features, lengths)
+    batch, _, frames = features.shape
+    features, lengths, bucket = self.policy.pad(features, lengths)
+    logprobs = self.forward(self.module(*bucket), features, lengths)
+    out_frames = int(self.output_lengths([frames])[0])
+    return logprobs[:batch, :out_frames]
+
+  def _trace(self, model, batch, frames):
+    features = torch.zeros(batch, FEAT_IN, frames)
+    lengths = torch.full((batch,), frames, dtype=torch.long)
+    with torch.no_grad(), warnings.catch_warnings():
+      warnings.simplefilter('ignore', torch.jit.TracerWarning)
+      return torch.jit.trace(model, (features, lengths)).eval()
+
+
+class TracedEngine(BucketedEngine):
+  """encoder.QuartzNet traced with TorchScript once per bucket (the tile
+  loops of the fused path are unrolled for the bucket's length)."""
+  backend = 'traced'
+
+  def __init__(self, weights=None, model=None, cache_dir=CACHE_DIR,
+               fused=True, **options):
+    super(TracedEngine, self).__init__(weights, model, cache_dir, **options)
+    if fused:
+      fuse(self.model)
+    self.fused = fused
+
+  def artifact_key(self, batch, frames):
+    return self.artifact_name('.pt', 'fused' if self.fused else 'eager',
+                              '%dx%d' % (batch, frames))
+
+  def compile(self, batch, frames, path):
+    torch.jit.save(self._trace(self.model, batch, frames), path)
+
+  def load(self, path):
+    return torch.jit.load(path).eval()
+
+  @torch.no_grad()
+  def forward(self, module, features, lengths):
+    return module(features, lengths)
+
+
+class TvmEngine(BucketedEngine):
+  """encoder.QuartzNet compiled by TVM Relay for each shape bucket and run
+  with the graph executor.
+
+  Args:
+      target (str): TVM target, e.g. 'llvm -mcpu=skylake-avx512'.
+      opt_level (int): Relay optimization level.
+  """
+  backend = 'tvm'
+
+  def __init__(self, weights=None, model=None, cache_dir=CACHE_DIR,
+               target='llvm', opt_level=3, **options):
+    import tvm
+    super(TvmEngine, self).__init__(weights, model, cache_dir, **options)
+    self.target = target
+    self.opt_level = opt_level
+    self.device = tvm.device(str(tvm.target.Target(target).kind), 0)
+
+  def _target_tag(self):
+    return self.target.replace(' ', '').replace('=', '')
+
+  def relay_module(self, batch, frames):
+    """Relay module and params of the model for one input shape."""
+    from tvm import relay
+    return relay.frontend.from_pytorch(
+        self._trace(self.model, batch, frames),
+        [('audio_signal', ((batch, FEAT_IN, frames), 'float32')),
+         ('lengths', ((batch,), 'int64'))])
+
+  def artifact_key(self, batch, frames):
+    return self.artifact_name('.so', self._target_tag(),
+                              'O%d' % self.opt_level,
+                              '%dx%d' % (batch, frames))
+
+  def compile(self, batch, frames, path):
+    import tvm
+    from tvm import relay
+    mod, params = self.relay_module(batch, frames)
+    with tvm.transform.PassContext(opt_level=self.opt_level):
+      lib = relay.build(mod, target=self.target, params=params)
+    lib.export_library(path)
+
+  def load(self, path):
+    import tvm
+    from tvm.contrib import graph_executor
+    lib = tvm.runtime.load_module(path)
+    return graph_executor.GraphModule(lib['default'](self.device))
+
+  def forward(self, module, features, lengths):
+    module.set_input('audio_signal', features.numpy())
+    module.set_input('lengths', lengths.numpy())
+    module.run()
+    return torch.from_numpy(module.get_output(0).numpy())
+
+
+ENGINES = {engine.backend: engine for engine in
+           (EagerEngine, TorchScriptEngine, OnnxRuntimeEngine, TracedEngine,
+            TvmEngine)}
+
+
+def create_engine(config=None, **overrides):
+  """Builds the engine a deployment config asks for.
+
+  Args:
+      config: Backend name, dict with a 'backend' key plus engine options,
+          path of a JSON file holding such a dict, or None for eager.
+      overrides: Engine options taking precedence over the config.
+  """
+  if config is None:
+    config = {}
+  elif isinstance(config, str):
+    if config.endswith('.json'):
+      with open(config) as f:
+        config = json.load(f)
+    else:
+      config = {'backend': config}
+  options = dict(config, **overrides)
+  backend = options.pop('backend', 'eager')
+  if backend not in ENGINES:
+    raise ValueError(f"Unknown backend {backend}, expected one of "
+                     f"{sorted(ENGINES)}.")
+  return ENGINES[backend](**options)
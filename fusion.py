@@ -0,0 +1,158 @@
+# Fused depthwise -> pointwise -> bias -> ReLU [-> residual add] execution
+# for encoder.QuartzNet.
+#
+# Eager QuartzNet runs every sub-block as two convs plus a ReLU (plus a
+# residual conv and an add), each writing a full [B, C, T] tensor. The fused
+# path walks the output in time tiles instead: for each tile it runs the
+# depthwise conv on just the input window the tile needs, does the 1x1 conv
+# as a GEMM, accumulates the residual 1x1 GEMM into the same buffer, adds
+# the (pre-summed) biases and applies ReLU in place before writing the tile
+# into the output. The only full-size tensor a sub-block produces is its
+# output; all intermediates are tile-sized and stay in cache.
+#
+# The depthwise window is zero-padded explicitly rather than through the
+# conv's padding argument, which also sidesteps the much slower padded
+# depthwise kernel of the CPU backend.
+
+from typing import Optional
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from encoder import QuartzNetBlock, mask_padding
+
+DEFAULT_TILE = 256
+
+
+def _window(x: torch.Tensor, start: int, stop: int) -> torch.Tensor:
+  """Returns x[..., start:stop] with zeros wherever the range leaves x."""
+  length = x.shape[-1]
+  lo = max(start, 0)
+  hi = min(stop, length)
+  w = x[:, :, lo:hi]
+  if start < 0 or stop > length:
+    w = F.pad(w, (lo - start, stop - hi))
+  return w
+
+
+class FusedSeparableConv(nn.Module):
+  """Tiled execution of one encoder.SeparableConv, its ReLU and optionally
+  the residual branch of the block. Shares parameters with the eager
+  modules it wraps."""
+  def __init__(self, conv, residual=None, tile=DEFAULT_TILE):
+    super(FusedSeparableConv, self).__init__()
+    if isinstance(conv.depthwise, nn.Conv1d):
+      dw = conv.depthwise
+      self.depthwise_weight = dw.weight
+      self.stride = dw.stride[0]
+      self.dilation = dw.dilation[0]
+      self.padding = dw.padding[0]
+      self.extent = self.dilation * (dw.kernel_size[0] - 1) + 1
+      self.groups = dw.groups
+    else:
+      self.depthwise_weight = None
+      self.stride, self.dilation, self.padding, self.extent = 1, 1, 0, 1
+      self.groups = 1
+    self.pointwise_weight = conv.pointwise.weight
+    self.pointwise_bias = conv.pointwise.bias
+    if residual is not None:
+      self.residual_weight = residual.weight
+      self.residual_bias = residual.bias
+    else:
+      self.residual_weight = None
+      self.residual_bias = None
+    self.tile = tile
+
+  def output_lengths(self, lengths: torch.Tensor) -> torch.Tensor:
+    if self.stride == 1 and self.extent == 2 * self.padding + 1:
+      return lengths
+    return torch.div(lengths + 2 * self.padding - self.extent, self.stride,
+                     rounding_mode='floor') + 1
+
+  def forward(self, x: torch.Tensor,
+              block_input: Optional[torch.Tensor] = None) -> torch.Tensor:
+    batch, _, length = x.shape
+    out_length = (length + 2 * self.padding - self.extent) // self.stride + 1
+    weight = self.pointwise_weight.squeeze(-1)
+    bias = self.pointwise_bias
+    depthwise_weight = self.depthwise_weight
+    residual_weight: Optional[torch.Tensor] = None
+    residual_bias = self.residual_bias
+    if self.residual_weight is not None and residual_bias is not None \
+        and block_input is not None:
+      residual_weight = self.residual_weight.squeeze(-1).expand(
+          batch, -1, -1)
+      bias = bias + residual_bias
+    bias = bias.unsqueeze(-1)
+
+    out: Optional[torch.Tensor] = None
+    if out_length > self.tile:
+      out = x.new_empty(batch, weight.shape[0], out_length)
+    for t0 in range(0, out_length, self.tile):
+      t1 = min(t0 + self.tile, out_length)
+      if depthwise_weight is not None:
+        start = t0 * self.stride - self.padding
+        stop = (t1 - 1) * self.stride - self.padding + self.extent
+        d = F.conv1d(_window(x, start, stop), depthwise_weight,
+                     stride=self.stride, dilation=self.dilation,
+                     groups=self.groups)
+      else:
+        d = x[:, :, t0:t1]
+      o = torch.matmul(weight, d)
+      if residual_weight is not None and block_input is not None:
+        o.baddbmm_(residual_weight, block_input[:, :, t0:t1])
+      o.add_(bias).relu_()
+      if out is None:
+        return o
+      out[:, :, t0:t1] = o
+    assert out is not None
+    return out
+
+
+class FusedQuartzNetBlock(nn.Module):
+  def __init__(self, block, tile=DEFAULT_TILE):
+    super(FusedQuartzNetBlock, self).__init__()
+    self.convs = nn.ModuleList()
+    last = len(block.convs) - 1
+    for i, conv in enumerate(block.convs):
+      residual = block.residual if i == last else None
+      self.convs.append(FusedSeparableConv(conv, residual, tile))
+    self.residual = block.residual is not None
+
+  def output_lengths(self, lengths: torch.Tensor) -> torch.Tensor:
+    for conv in self.convs:
+      lengths = conv.output_lengths(lengths)
+    return lengths
+
+  def forward(self, x, lengths: Optional[torch.Tensor] = None):
+    out = x
+    last = len(self.convs) - 1
+    for i, conv in enumerate(self.convs):
+      if i == last and self.residual:
+        out = conv(out, x)
+      else:
+        out = conv(out)
+      if lengths is not None:
+        lengths = conv.output_lengths(lengths)
+        out = mask_padding(out, lengths)
+    return out
+
+
+def fuse(model, tile=DEFAULT_TILE):
+  """Switches every block of an encoder.QuartzNet to the fused path.
+
+  The model is modified in place (parameters are shared, nothing is
+  copied) and returned. Results match eager execution up to float
+  summation order.
+
+  Args:
+      model: encoder.QuartzNet or encoder.QuartzNetEncoder.
+      tile (int): Output frames computed per step. Larger tiles mean fewer
+          Python iterations, smaller ones keep intermediates in cache.
+  """
+  encoder = getattr(model, 'encoder', model)
+  for i, block in enumerate(encoder.blocks):
+    if isinstance(block, QuartzNetBlock):
+      encoder.blocks[i] = FusedQuartzNetBlock(block, tile)
+  return model
@@ -0,0 +1,167 @@
+# Long-form inference over overlapping windows.
+#
+# Running the encoder over an hour of features at once needs activations
+# proportional to the whole recording. transcribe_long() instead cuts the
+# spectrogram into windows of `window` frames, extends every window by
+# `context` frames on both sides, runs the extended windows in batches and
+# keeps only the log-probs of each window's centre before stitching them
+# back together. With context >= the encoder's receptive field (the
+# default) the centre frames never see the artificial window edges and the
+# result equals full-sequence inference; a shorter context trades accuracy
+# for compute.
+#
+# long_features() computes the spectrogram itself chunk by chunk with
+# utils.features.StreamingFeatures, so the STFT of the whole recording is
+# never held at once; only the [1, 64, T] log-mel frames are (about 92 MB
+# per hour in fp32), normalized in place with two passes over chunks.
+
+import collections
+import itertools
+
+import torch
+
+from utils.features import CONSTANT, StreamingFeatures
+
+
+def _spans(length, window, context, stride):
+  """Maps each extended input span to the window centres it serves.
+
+  Every span has length window + 2 * context (or one frame more, so that it
+  still starts on the stride grid when it is pushed against the end of the
+  input). Spans are clamped into [0, length) rather than padded, because
+  padded frames would be computed instead of treated as zeros and leak into
+  the real ones.
+  """
+  span = window + 2 * context
+  spans = collections.OrderedDict()
+  for c0 in range(0, length, window):
+    start = max(0, min(c0 - context, length - span))
+    start -= start % stride
+    stop = length if length - (start + span) < stride else start + span
+    spans.setdefault((start, stop), []).append((c0, min(c0 + window, length)))
+  return spans
+
+
+def _normalize_inplace(x, normalize_type, chunk):
+  """normalize_batch() over all frames of a [1, C, T] tensor, two passes
+  over `chunk` frames at a time instead of T-sized temporaries."""
+  if normalize_type not in ("per_feature", "all_features"):
+    return x
+  dims = (2,) if normalize_type == "per_feature" else (1, 2)
+  count = x.shape[-1] * (1 if normalize_type == "per_feature" else x.shape[1])
+  total = 0.
+  for i in range(0, x.shape[-1], chunk):
+    total = total + x[:, :, i:i + chunk].sum(dims, keepdim=True)
+  mean = total / count
+  m2 = 0.
+  for i in range(0, x.shape[-1], chunk):
+    m2 = m2 + (x[:, :, i:i + chunk] - mean).pow(2).sum(dims, keepdim=True)
+  std = torch.sqrt(m2 / (count - 1)) + CONSTANT
+  for i in range(0, x.shape[-1], chunk):
+    x[:, :, i:i + chunk].sub_(mean).div_(std)
+  return x
+
+
+@torch.no_grad()
+def long_features(preprocessor, signal, chunk=30 * 16000):
+  """Features of a long recording, computed `chunk` samples at a time.
+
+  Args:
+      preprocessor: AudioToMelSpectrogramPreprocessor (or its
+          FilterbankFeatures).
+      signal (Tensor): [1, N] samples of one recording.
+      chunk (int): Samples featurized per step (30 s at 16 kHz).
+
+  Returns:
+      [1, 64, T] features equal to preprocessor.get_features(signal, [N])
+      up to float summation order: same frames, normalization over the
+      whole recording, padding to a multiple of 16 frames (pad_to outside
+      eval mode). Memory is that of the output plus one chunk's STFT.
+  """
+  if signal.shape[0] != 1:
+    raise ValueError(f"long_features expects a single recording, got a "
+                     f"batch of {signal.shape[0]}.")
+  featurizer = getattr(preprocessor, 'featurizer', preprocessor)
+  stream = StreamingFeatures(featurizer, normalization=None)
+  # The centred STFT gives N // hop + 1 frames, of which the first
+  # ceil(N / hop) are valid (the stream emits those) and the rest padding.
+  frames = signal.shape[-1] // featurizer.hop_length + 1
+  pad_to = featurizer.pad_to if featurizer.training else 16
+  width = frames
+  if isinstance(pad_to, int) and pad_to > 0:
+    width = -(-frames // pad_to) * pad_to
+  out = signal.new_full((1, featurizer.nfilt * featurizer.frame_splicing,
+                         width), featurizer.pad_value)
+  done = 0
+  parts = (stream.step(signal[:, i:i + chunk])
+           for i in range(0, signal.shape[-1], chunk))
+  for x in itertools.chain(parts, [None]):
+    if x is None:
+      x = stream.flush()
+    out[:, :, done:done + x.shape[-1]] = x
+    done += x.shape[-1]
+  _normalize_inplace(out[:, :, :done], featurizer.normalize,
+                     max(chunk // featurizer.hop_length, 1))
+  return out
+
+
+@torch.no_grad()
+def transcribe_long(model, features, window=6000, context=None, batch_size=4):
+  """Log-probs of a long recording computed window by window.
+
+  Args:
+      model: encoder.QuartzNet (or any model with the same output, in which
+          case `context` must be given).
+      features (Tensor): [1, 64, T] spectrogram of one recording.
+      window (int): Centre frames kept per window (100 frames per second).
+      context (int): Frames of context added on each side. Defaults to the
+          encoder's receptive field, which makes the result exact.
+      batch_size (int): Windows run together in one forward pass.
+
+  Returns:
+      [1, ceil(T / stride), 29] log-probs, as model(features) would.
+
+  Encoder memory is bounded by batch_size windows, but `features` and the
+  output still grow linearly with the recording. Compute them with
+  long_features() rather than preprocessor.get_features(), whose STFT of
+  the whole recording is far larger (~740 MB per hour with the conv
+  engine).
+  """
+  if features.shape[0] != 1:
+    raise ValueError(f"transcribe_long expects a single recording, got a "
+                     f"batch of {features.shape[0]}.")
+  encoder = getattr(model, 'encoder', None)
+  stride = encoder.stride if encoder is not None else 2
+  if context is None:
+    if encoder is None:
+      raise ValueError("context must be given for models without an "
+                       "encoder.QuartzNetEncoder.")
+    context = encoder.receptive_field()
+  # Keep windows and context on the stride grid so every window's outputs
+  # line up with the full-sequence outputs.
+  context = -(-context // stride) * stride
+  window = max(stride, window // stride * stride)
+
+  length = features.shape[-1]
+  if length <= window + 2 * context:
+    return model(features)
+
+  spans = _spans(length, window, context, stride)
+  by_length = collections.defaultdict(list)
+  for start, stop in spans:
+    by_length[stop - start].append((start, stop))
+
+  out = None
+  for span_length, group in by_length.items():
+    for b in range(0, len(group), batch_size):
+      batch = group[b:b + batch_size]
+      x = torch.cat([features[:, :, start:stop] for start, stop in batch])
+      y = model(x)
+      if out is None:
+        out = y.new_empty(1, -(-length // stride), y.shape[-1])
+      for (start, stop), logprobs in zip(batch, y):
+        for c0, c1 in spans[(start, stop)]:
+          o0, o1 = c0 // stride, -(-c1 // stride)
+          s0 = start // stride
+          out[0, o0:o1] = logprobs[o0 - s0:o1 - s0]
+  return out
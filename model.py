@@ -8,16 +8,26 @@ import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+
+from encoder import check_output, output_head
+from utils.weights import load_variables, skip_init
+
 class Model(nn.Module):
-  def __init__(self):
+  def __init__(self, weights=None, output='log_softmax'):
     super(Model, self).__init__()
+    # Output head, see encoder.OUTPUTS
+    self.output = check_output(output)
     self._vars = nn.ParameterDict()
     self._regularizer_params = []
-    for b in glob.glob(
-        os.path.join(os.path.dirname(__file__), "variables", "*.npy")):
-      v = torch.from_numpy(np.load(b))
+    # Packed archive (zero-copy mmap) when available, variables/*.npy otherwise
+    for name, v in load_variables(weights).items():
       requires_grad = v.dtype.is_floating_point or v.dtype.is_complex
-      self._vars[os.path.basename(b)[:-4]] = nn.Parameter(v, requires_grad=requires_grad)
+      self._vars[name] = nn.Parameter(v, requires_grad=requires_grad)
+    # Weights are rebound to the loaded variables, skip the random init
+    with skip_init(nn.Conv1d):
+      self._build_layers()
+
+  def _build_layers(self):
     self.n_Conv_0 = nn.Conv1d(**{'groups': 64, 'dilation': [1], 'out_channels': 64, 'padding': [16], 'kernel_size': (33,), 'stride': [2], 'in_channels': 64, 'bias': False})
     self.n_Conv_0.weight.data = self._vars["encoder_encoder_0_mconv_0_conv_weight"]
     self.n_Conv_1 = nn.Conv1d(**{'groups': 1, 'dilation': [1], 'out_channels': 256, 'padding': [0], 'kernel_size': (1,), 'stride': [1], 'in_channels': 64, 'bias': True})
@@ -721,9 +731,7 @@ class Model(nn.Module):
     t_1275 = self.n_Conv_261(t_992)
     t_995 = F.relu(t_1275)
     t_996 = self.n_Conv_263(t_995)
-    t_997 = t_996.permute(*[0, 2, 1])
-    probs = F.softmax(t_997, **{'dim': 2})
-    return torch.log(probs)
+    return output_head(t_996, self.output)
 
   def compatible_auto_pad(self, input, kernel_spatial_shape, nn_mod, auto_pad=None, **kwargs):
     input_spatial_shape = input.shape[2:]
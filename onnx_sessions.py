@@ -0,0 +1,207 @@
+# ONNX export and pooled ONNX Runtime sessions.
+#
+# export_onnx() writes model.Model or encoder.QuartzNet to ONNX with dynamic
+# batch and time axes, optimize_onnx() lets ONNX Runtime apply its graph
+# optimizations once and serializes the optimized graph, so sessions load it
+# without redoing them.
+#
+# Creating an InferenceSession parses and optimizes the whole graph, and
+# session.run() allocates fresh output arrays on every call. SessionPool
+# hands out one PooledSession per (model file, thread settings) for the life
+# of the process; a PooledSession keeps an IOBinding with pre-allocated
+# output buffers for each input shape it has seen, so repeated shapes run
+# without allocating outputs.
+
+import collections
+import inspect
+import os
+import statistics
+import threading
+import time
+
+import numpy as np
+import torch
+
+DEFAULT_OPSET = 17
+OPTIMIZATION_LEVELS = ('disable', 'basic', 'extended', 'all')
+
+
+def export_onnx(model, path, opset=DEFAULT_OPSET):
+  """Exports a QuartzNet to ONNX with dynamic batch and time axes.
+
+  Inputs are audio_signal [batch, 64, time] and, for models whose forward
+  takes `lengths` (encoder.QuartzNet), lengths [batch]; the output is
+  logprobs [batch, frames, 29].
+  """
+  features = torch.zeros(2, 64, 256)
+  args, input_names = (features,), ['audio_signal']
+  dynamic_axes = {'audio_signal': {0: 'batch', 2: 'time'},
+                  'logprobs': {0: 'batch', 1: 'frames'}}
+  if 'lengths' in inspect.signature(model.forward).parameters:
+    args += (torch.tensor([256, 128]),)
+    input_names.append('lengths')
+    dynamic_axes['lengths'] = {0: 'batch'}
+  with torch.no_grad():
+    torch.onnx.export(model.eval(), args, path, input_names=input_names,
+                      output_names=['logprobs'], dynamic_axes=dynamic_axes,
+                      opset_version=opset, dynamo=False)
+  return path
+
+
+def _session_options(intra_op_threads=0, inter_op_threads=0,
+                     optimization='all'):
+  import onnxruntime
+  levels = onnxruntime.GraphOptimizationLevel
+  options = onnxruntime.SessionOptions()
+  options.graph_optimization_level = {
+      'disable': levels.ORT_DISABLE_ALL,
+      'basic': levels.ORT_ENABLE_BASIC,
+      'extended': levels.ORT_ENABLE_EXTENDED,
+      'all': levels.ORT_ENABLE_ALL}[optimization]
+  options.intra_op_num_threads = intra_op_threads
+  options.inter_op_num_threads = inter_op_threads
+  if inter_op_threads > 1:
+    options.execution_mode = onnxruntime.ExecutionMode.ORT_PARALLEL
+  return options
+
+
+def create_session(path, intra_op_threads=0, inter_op_threads=0,
+                   optimization='all'):
+  """A plain onnxruntime.InferenceSession on the CPU."""
+  import onnxruntime
+  if optimization not in OPTIMIZATION_LEVELS:
+    raise ValueError(f"Unknown optimization level {optimization}, expected "
+                     f"one of {OPTIMIZATION_LEVELS}.")
+  return onnxruntime.InferenceSession(
+      path, _session_options(intra_op_threads, inter_op_threads,
+                             optimization),
+      providers=['CPUExecutionProvider'])
+
+
+def optimize_onnx(path, optimized_path=None, optimization='extended'):
+  """Serializes the graph ONNX Runtime optimizes `path` into.
+
+  'extended' (the default) keeps the result portable; 'all' adds layout
+  transformations specific to the CPU it was produced on.
+  """
+  import onnxruntime
+  if optimized_path is None:
+    optimized_path = os.path.splitext(path)[0] + '.opt.onnx'
+  options = _session_options(optimization=optimization)
+  options.optimized_model_filepath = optimized_path
+  onnxruntime.InferenceSession(path, options,
+                               providers=['CPUExecutionProvider'])
+  return optimized_path
+
+
+class PooledSession(object):
+  """An InferenceSession run through per-shape IOBindings.
+
+  The first call with a new set of input shapes runs normally to learn the
+  output shapes; later calls with the same shapes bind the inputs in place
+  and write into the output buffers allocated then. At most `max_bindings`
+  shape sets are kept, least recently used first out.
+  """
+  def __init__(self, session, max_bindings=8):
+    self.session = session
+    self.input_names = [i.name for i in session.get_inputs()]
+    self.output_names = [o.name for o in session.get_outputs()]
+    self.max_bindings = max_bindings
+    self.bindings = collections.OrderedDict()
+    self.lock = threading.Lock()
+
+  def run(self, feeds, copy=True):
+    """Runs the session on a {name: ndarray} dict.
+
+    Returns:
+        List of output arrays. With copy=False they are the bound buffers
+        themselves and are overwritten by the next call with the same
+        shapes.
+    """
+    feeds = {name: np.ascontiguousarray(feeds[name])
+             for name in self.input_names}
+    signature = tuple((name, feeds[name].shape, feeds[name].dtype.str)
+                      for name in self.input_names)
+    with self.lock:
+      entry = self.bindings.get(signature)
+      if entry is None:
+        outputs = self.session.run(self.output_names, feeds)
+        binding = self.session.io_binding()
+        buffers = [np.empty_like(o) for o in outputs]
+        for name, buffer in zip(self.output_names, buffers):
+          binding.bind_output(name, 'cpu', 0, buffer.dtype.type,
+                              buffer.shape, buffer.ctypes.data)
+        self.bindings[signature] = (binding, buffers)
+        if len(self.bindings) > self.max_bindings:
+          self.bindings.popitem(last=False)
+        return outputs
+      self.bindings.move_to_end(signature)
+      binding, buffers = entry
+      for name in self.input_names:
+        binding.bind_cpu_input(name, feeds[name])
+      self.session.run_with_iobinding(binding)
+      return [b.copy() for b in buffers] if copy else list(buffers)
+
+
+class SessionPool(object):
+  """Process-wide PooledSessions keyed by model file and settings.
+
+  A model file that changes on disk (new modification time) gets a new
+  session.
+  """
+  def __init__(self):
+    self.sessions = {}
+    self.lock = threading.Lock()
+
+  def get(self, path, intra_op_threads=0, inter_op_threads=0,
+          optimization='all'):
+    path = os.path.realpath(path)
+    key = (path, os.path.getmtime(path), intra_op_threads, inter_op_threads,
+           optimization)
+    with self.lock:
+      if key not in self.sessions:
+        self.sessions[key] = PooledSession(create_session(
+            path, intra_op_threads, inter_op_threads, optimization))
+      return self.sessions[key]
+
+  def clear(self):
+    with self.lock:
+      self.sessions.clear()
+
+
+SESSIONS = SessionPool()
+
+
+def get_session(path, intra_op_threads=0, inter_op_threads=0,
+                optimization='all'):
+  """PooledSession from the process-wide pool."""
+  return SESSIONS.get(path, intra_op_threads, inter_op_threads, optimization)
+
+
+def tune_threads(path, feeds, candidates=None, repeat=5):
+  """Measures the session latency of (intra_op, inter_op) thread counts.
+
+  Args:
+      path (str): ONNX model.
+      feeds (dict): Representative inputs.
+      candidates: (intra_op, inter_op) pairs. Defaults to powers of two up
+          to the CPU count, with 1 and 2 inter-op threads.
+
+  Returns:
+      (best pair, {pair: median latency in seconds}).
+  """
+  if candidates is None:
+    cpus = os.cpu_count() or 1
+    intra = sorted({min(2 ** i, cpus) for i in range(cpus.bit_length() + 1)})
+    candidates = [(i, j) for i in intra for j in (1, 2) if i * j <= cpus]
+  latencies = {}
+  for intra_op, inter_op in candidates:
+    session = PooledSession(create_session(path, intra_op, inter_op))
+    session.run(feeds)
+    times = []
+    for _ in range(repeat):
+      t = time.perf_counter()
+      session.run(feeds, copy=False)
+      times.append(time.perf_counter() - t)
+    latencies[(intra_op, inter_op)] = statistics.median(times)
+  return min(latencies, key=latencies.get), latencies
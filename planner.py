@@ -0,0 +1,108 @@
+# Activation memory planning for the QuartzNet graphs.
+#
+# The generated model.Model.forward binds every intermediate to a local
+# (t_640, t_999, ...) so all of them stay alive until the function returns;
+# peak memory is the sum of all activations instead of the working set.
+# plan_memory() traces a model with torch.fx and regenerates forward() so
+# that
+#   - every intermediate is released right after its last consumer runs
+#     (fx code generation emits `x = None` after the last use), which lets
+#     the allocator hand the buffer to the next layer, and
+#   - ReLU, residual adds and a final log (for heads that take the log of
+#     a softmax) run in place whenever the overwritten operand has no
+#     other consumer and already has the result's shape.
+#
+# Works for model.Model and encoder.QuartzNet alike; the weights are shared
+# with the traced model, not copied.
+
+import inspect
+import operator
+
+import torch
+import torch.fx as fx
+import torch.nn.functional as F
+from torch.fx.passes.shape_prop import ShapeProp
+
+_RELU = (F.relu, torch.relu)
+_ADD = (torch.add, operator.add)
+_INPLACE_UNARY = {torch.log: torch.log_, torch.relu: torch.relu_}
+
+
+def _is_activation(node):
+  """True for values produced by the graph (not inputs or weights)."""
+  return isinstance(node, fx.Node) and \
+      node.op in ('call_module', 'call_function', 'call_method')
+
+
+def _reusable(node, consumer):
+  """True if `consumer` may overwrite the value of `node`."""
+  return _is_activation(node) and list(node.users) == [consumer]
+
+
+def _same_shape(a, b):
+  ma, mb = a.meta.get('tensor_meta'), b.meta.get('tensor_meta')
+  return ma is not None and mb is not None and ma.shape == mb.shape
+
+
+def _make_inplace(graph):
+  """Rewrites eligible out-of-place ops to their in-place variants.
+
+  Returns:
+      (int) number of rewritten nodes.
+  """
+  rewritten = 0
+  for node in list(graph.nodes):
+    if node.op != 'call_function':
+      continue
+    if node.target in _RELU and node.args and \
+        _reusable(node.args[0], node) and not node.kwargs.get('inplace'):
+      node.target = F.relu
+      node.kwargs = {'inplace': True}
+      node.args = node.args[:1]
+      rewritten += 1
+    elif node.target in _INPLACE_UNARY and len(node.args) == 1 and \
+        not node.kwargs and _reusable(node.args[0], node):
+      node.target = _INPLACE_UNARY[node.target]
+      rewritten += 1
+    elif node.target in _ADD and len(node.args) == 2 and not node.kwargs:
+      a, b = node.args
+      # Addition is commutative (bit-exact in IEEE arithmetic), so either
+      # operand can receive the result.
+      for dst, src in ((a, b), (b, a)):
+        if _reusable(dst, node) and _same_shape(dst, node):
+          node.op = 'call_method'
+          node.target = 'add_'
+          node.args = (dst, src)
+          rewritten += 1
+          break
+  return rewritten
+
+
+def plan_memory(model, example_input=None, inplace=True):
+  """Returns a memory-planned copy of `model`'s forward.
+
+  Args:
+      model: model.Model or encoder.QuartzNet (any fx-traceable module).
+      example_input: Input used to propagate shapes for the in-place add
+          check. Defaults to a short [1, 64, 32] spectrogram.
+      inplace (bool): Also rewrite ReLU / add / log to run in place.
+
+  Returns:
+      torch.fx.GraphModule sharing its parameters with `model`. Outputs are
+      bit-identical to the original.
+  """
+  # Optional arguments such as QuartzNet's `lengths` are traced as None;
+  # the planned forward takes the features only.
+  parameters = inspect.signature(model.forward).parameters
+  concrete_args = {name: None for name, p in parameters.items()
+                   if p.default is None}
+  gm = fx.symbolic_trace(model, concrete_args=concrete_args or None)
+  if inplace:
+    if example_input is None:
+      example_input = torch.zeros(1, 64, 32)
+    with torch.no_grad():
+      ShapeProp(gm).propagate(example_input)
+    _make_inplace(gm.graph)
+  gm.graph.lint()
+  gm.recompile()
+  return gm
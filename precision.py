@@ -0,0 +1,119 @@
+# Reduced-precision (bf16 / fp16) CPU inference for encoder.QuartzNet.
+#
+# to_precision() casts the encoder and decoder weights once, in place, and
+# wraps the model so that features are cast on the way in and the decoder
+# output is cast back to fp32 before the output head (encoder.output_head),
+# whose log-softmax would lose most of its range in bf16. Features
+# themselves are still computed in fp32 by FilterbankFeatures. The wrapper
+# keeps the encoder / decoder attributes and the (features, lengths)
+# signature of QuartzNet, so it can be fused, scripted or served by
+# engine.EagerEngine(precision=...).
+#
+# Whether this is faster depends on the CPU: with AVX512-BF16 or AMX the
+# oneDNN bf16 convs beat fp32, without them PyTorch emulates bf16 and is
+# slower. fp16 convs are only fast on CPUs with AVX512-FP16. supported()
+# says whether a precision runs at all; tools/bench_precision.py measures
+# the speedup and accuracy_check() compares greedy transcripts and WER
+# against fp32 before a precision is trusted.
+
+import functools
+from typing import Optional
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from encoder import output_head
+from utils.evaluation import evaluate
+
+PRECISIONS = {'fp32': torch.float32,
+              'bf16': torch.bfloat16,
+              'fp16': torch.float16}
+
+
+@functools.lru_cache(maxsize=None)
+def supported(precision):
+  """True if depthwise and pointwise Conv1d run in `precision` on the
+  CPU."""
+  dtype = PRECISIONS[precision]
+  try:
+    x = torch.ones(1, 4, 16, dtype=dtype)
+    F.conv1d(x, torch.ones(4, 1, 3, dtype=dtype), padding=1, groups=4)
+    F.conv1d(x, torch.ones(8, 4, 1, dtype=dtype), torch.ones(8, dtype=dtype))
+  except RuntimeError:
+    return False
+  return True
+
+
+class ReducedPrecision(nn.Module):
+  """QuartzNet whose encoder and decoder run in `dtype` while the output
+  head stays in fp32. Takes and returns fp32 tensors."""
+  def __init__(self, model, dtype):
+    super(ReducedPrecision, self).__init__()
+    self.encoder = model.encoder
+    self.decoder = model.decoder
+    self.dtype = dtype
+    self.output = model.output
+
+  def forward(self, audio_signal, lengths: Optional[torch.Tensor] = None):
+    x = self.decoder(self.encoder(audio_signal.to(self.dtype), lengths))
+    return output_head(x.float(), self.output)
+
+
+def to_precision(model, precision='bf16'):
+  """Casts an encoder.QuartzNet (plain or fused) to `precision`.
+
+  The parameters are converted in place, once, so the original fp32
+  model must not be used afterwards; build a second one (weights are
+  memory-mapped, so this is cheap) to compare against.
+
+  Returns:
+      `model` itself for 'fp32', a ReducedPrecision wrapper otherwise.
+  """
+  if precision not in PRECISIONS:
+    raise ValueError(f"Unknown precision {precision}, expected one of "
+                     f"{sorted(PRECISIONS)}.")
+  if precision == 'fp32':
+    return model
+  if not supported(precision):
+    raise ValueError(f"{precision} convolutions are not supported by this "
+                     f"PyTorch build on the CPU.")
+  dtype = PRECISIONS[precision]
+  model.encoder.to(dtype)
+  model.decoder.to(dtype)
+  return ReducedPrecision(model, dtype).eval()
+
+
+@torch.no_grad()
+def accuracy_check(reference, model, batches, max_wer_increase=0.005):
+  """Compares `model` against the fp32 `reference` on feature batches.
+
+  Args:
+      reference: fp32 encoder.QuartzNet.
+      model: Reduced-precision model (to_precision()).
+      batches: feature_batches() / cached_feature_batches() output.
+      max_wer_increase (float): Largest acceptable absolute WER increase.
+
+  Returns:
+      dict with 'wer_fp32', 'wer', 'delta_wer', 'changed' (number of
+      utterances whose greedy transcript differs), 'utterances',
+      'max_diff' (largest log-prob difference over valid frames) and
+      'passed'.
+  """
+  expected = evaluate(reference, None, pass_lengths=True, batches=batches,
+                      keep_outputs=True)
+  result = evaluate(model, None, pass_lengths=True, batches=batches,
+                    keep_outputs=True)
+  changed = sum(a != b for a, b in zip(expected['hypotheses'],
+                                       result['hypotheses']))
+  max_diff = max([float((p - q).abs().max()) for p, q in
+                  zip(expected['outputs'], result['outputs']) if p.numel()],
+                 default=0.)
+  delta = result['wer'] - expected['wer']
+  return {'wer_fp32': expected['wer'],
+          'wer': result['wer'],
+          'delta_wer': delta,
+          'changed': changed,
+          'utterances': len(result['hypotheses']),
+          'max_diff': max_diff,
+          'passed': delta <= max_wer_increase}
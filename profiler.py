@@ -0,0 +1,201 @@
+# Per-layer profiling of model.Model and encoder.QuartzNet.
+#
+# LayerProfiler attaches forward pre/post hooks to every Conv1d (the
+# n_Conv_* of model.Model) while it is active and removes them on exit, so
+# a model that is not being profiled runs without any hook at all. ReLUs
+# and residual adds are functional calls with no module to hook; the time
+# between the end of one conv and the start of the next is recorded as the
+# '<conv>+relu/add' group that follows it, and the time after the last
+# conv as the output head.
+#
+# Every conv event records wall time, MACs (from its parameters and output
+# shape), output bytes and the peak memory of the process so far (CUDA
+# allocator peak on GPU, peak RSS on CPU). Events are aggregated per layer
+# or per QuartzNet block into a sorted table, and written as a Chrome trace
+# (chrome://tracing, Perfetto) with one span per event.
+
+import collections
+import json
+import resource
+import sys
+import time
+
+import torch
+import torch.nn as nn
+
+from encoder import QuartzNet
+from utils.weights import skip_init
+
+
+def _peak_bytes(device):
+  if device.type == 'cuda':
+    return torch.cuda.max_memory_allocated(device)
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+  return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def conv_macs(conv, output):
+  """Multiply-accumulates of one Conv1d call producing `output`."""
+  return output.numel() * conv.in_channels // conv.groups * \
+      conv.kernel_size[0]
+
+
+def conv_blocks(model):
+  """Maps the Conv1d module names of `model` to the QuartzNet block they
+  belong to ('encoder.blocks.<i>' or 'decoder').
+
+  model.Model holds the convs of QuartzNet 15x5 in the same order, so its
+  n_Conv_* are matched to an uninitialised QuartzNet by position.
+  """
+  convs = [(name, m) for name, m in model.named_modules()
+           if isinstance(m, nn.Conv1d)]
+  if hasattr(model, 'encoder'):
+    reference = convs
+  else:
+    with skip_init(nn.Conv1d):
+      reference = [(name, m) for name, m in QuartzNet().named_modules()
+                   if isinstance(m, nn.Conv1d)]
+    if len(reference) != len(convs):
+      raise ValueError(f"{type(model).__name__} has {len(convs)} convs, "
+                       f"QuartzNet 15x5 has {len(reference)}.")
+  blocks = {}
+  for (name, _), (ref_name, _) in zip(convs, reference):
+    parts = ref_name.split('.')
+    blocks[name] = '.'.join(parts[:3]) if parts[0] == 'encoder' \
+        else parts[0]
+  return blocks
+
+
+class LayerProfiler(object):
+  """Context manager recording per-layer events of every forward of
+  `model` run inside it.
+
+      with LayerProfiler(model) as profiler:
+        model(features)
+      print(profiler.table())
+      profiler.chrome_trace('trace.json')
+  """
+  def __init__(self, model):
+    self.model = model
+    self.blocks = conv_blocks(model)
+    self.device = next(model.parameters()).device
+    self.events = []
+    self.handles = []
+    self._starts = {}
+    self._last = None
+
+  def _now(self):
+    if self.device.type == 'cuda':
+      torch.cuda.synchronize(self.device)
+    return time.perf_counter()
+
+  def _record(self, name, kind, start, end, macs=0, out_bytes=0):
+    self.events.append({'name': name,
+                        'kind': kind,
+                        'block': self.blocks.get(name.split('+')[0], ''),
+                        'start': start,
+                        'end': end,
+                        'macs': macs,
+                        'out_bytes': out_bytes,
+                        'peak_bytes': _peak_bytes(self.device)})
+
+  def _model_pre(self, module, inputs):
+    self._last = (None, self._now())
+
+  def _model_post(self, module, inputs, output):
+    end = self._now()
+    name, start = self._last
+    if name is not None:
+      self._record('output head', 'head', start, end)
+    self._last = None
+
+  def _conv_pre(self, name):
+    def hook(module, inputs):
+      now = self._now()
+      if self._last is not None and self._last[0] is not None:
+        prev, start = self._last
+        self._record(prev + '+relu/add', 'relu/add', start, now)
+      self._starts[name] = now
+    return hook
+
+  def _conv_post(self, name):
+    def hook(module, inputs, output):
+      end = self._now()
+      self._record(name, 'conv', self._starts.pop(name), end,
+                   conv_macs(module, output),
+                   output.numel() * output.element_size())
+      self._last = (name, end)
+    return hook
+
+  def __enter__(self):
+    self.handles.append(
+        self.model.register_forward_pre_hook(self._model_pre))
+    self.handles.append(
+        self.model.register_forward_hook(self._model_post))
+    for name, module in self.model.named_modules():
+      if isinstance(module, nn.Conv1d):
+        self.handles.append(
+            module.register_forward_pre_hook(self._conv_pre(name)))
+        self.handles.append(
+            module.register_forward_hook(self._conv_post(name)))
+    return self
+
+  def __exit__(self, *exc):
+    for handle in self.handles:
+      handle.remove()
+    self.handles = []
+    return False
+
+  def summary(self, by='layer'):
+    """Aggregated events, slowest first.
+
+    Args:
+        by: 'layer' (one row per conv and relu/add group) or 'block'.
+
+    Returns:
+        List of dicts with 'name', 'calls', 'seconds', 'macs',
+        'out_bytes' and 'peak_bytes' (the largest seen).
+    """
+    rows = collections.OrderedDict()
+    for e in self.events:
+      key = e['name'] if by == 'layer' else (e['block'] or e['name'])
+      row = rows.setdefault(key, {'name': key, 'calls': 0, 'seconds': 0.,
+                                  'macs': 0, 'out_bytes': 0,
+                                  'peak_bytes': 0})
+      row['calls'] += 1
+      row['seconds'] += e['end'] - e['start']
+      row['macs'] += e['macs']
+      row['out_bytes'] += e['out_bytes']
+      row['peak_bytes'] = max(row['peak_bytes'], e['peak_bytes'])
+    return sorted(rows.values(), key=lambda r: r['seconds'], reverse=True)
+
+  def table(self, by='layer', top=None):
+    """summary() as a text table with each row's share of the time."""
+    rows = self.summary(by)
+    total = sum(r['seconds'] for r in rows) or 1.
+    lines = ['%-36s %6s %10s %6s %10s %9s %10s %10s' % (
+        by, 'calls', 'ms', '%', 'GMAC', 'GMAC/s', 'out MB', 'peak MB')]
+    for r in rows[:top]:
+      lines.append('%-36s %6d %10.2f %6.1f %10.3f %9.1f %10.1f %10.1f' % (
+          r['name'], r['calls'], r['seconds'] * 1e3,
+          100. * r['seconds'] / total, r['macs'] / 1e9,
+          r['macs'] / 1e9 / r['seconds'] if r['seconds'] else 0.,
+          r['out_bytes'] / 2 ** 20, r['peak_bytes'] / 2 ** 20))
+    return '\n'.join(lines)
+
+  def chrome_trace(self, path):
+    """Writes the events as Chrome trace JSON, one complete ('X') event
+    each, on a single thread; returns `path`."""
+    origin = min((e['start'] for e in self.events), default=0.)
+    events = [{'name': e['name'], 'cat': e['kind'], 'ph': 'X',
+               'ts': (e['start'] - origin) * 1e6,
+               'dur': (e['end'] - e['start']) * 1e6,
+               'pid': 0, 'tid': 0,
+               'args': {'block': e['block'], 'macs': e['macs'],
+                        'out_bytes': e['out_bytes'],
+                        'peak_bytes': e['peak_bytes']}}
+              for e in self.events]
+    with open(path, 'w') as f:
+      json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+    return path
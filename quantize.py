@@ -0,0 +1,260 @@
+# CPU int8 post-training quantization of encoder.QuartzNet.
+#
+# quartznet.quantization() goes through pytorch_nndct and produces an xmodel
+# for the Vitis DPU. This module quantizes the same network for CPU
+# inference with PyTorch's FX graph mode static quantization instead:
+# every depthwise, pointwise, residual and decoder conv runs in int8 with
+# per-channel weight scales, activations are quantized per tensor with
+# ranges observed on a calibration manifest, and ReLUs / residual adds are
+# fused into the convs. The output head (log-softmax) stays in float.
+#
+# The quantized engine matters: fbgemm/x86 run int8 depthwise convs with
+# 33-87 taps through a very slow generic path, while onednn has direct
+# kernels, so onednn is used whenever it is available.
+#
+# Quantized models take features only; padded batches are not masked, so
+# run one utterance (or equal-length utterances) per call.
+#
+# Not every conv tolerates int8 equally. sensitivity() quantizes one conv
+# (or one block) at a time on top of a single calibration and measures the
+# WER and output KL change; mixed_precision_config() turns the ranking into
+# a JSON config that keeps the most sensitive units in float, which
+# quantize(config=...) and tools/quantize_int8.py --config accept. The
+# Vitis flow (quartznet.quantization) does not apply it: pytorch_nndct
+# quantizes the whole graph, and the config only covers this FX flow.
+
+import copy
+import itertools
+import json
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+from utils.evaluation import evaluate, feature_batches
+
+ENGINE = 'onednn' if 'onednn' in torch.backends.quantized.supported_engines \
+    else 'x86'
+
+
+class FeaturesOnly(nn.Module):
+  """Calls the wrapped model without lengths, so tracing sees a single
+  input and drops the masking branches."""
+  def __init__(self, model):
+    super(FeaturesOnly, self).__init__()
+    self.model = model
+
+  def forward(self, x):
+    return self.model(x)
+
+
+def conv_layers(model):
+  """Module names of the convs of a QuartzNet, in graph order."""
+  return [name for name, module in model.named_modules()
+          if isinstance(module, nn.Conv1d)]
+
+
+def block_names(model):
+  """Module names of the blocks of a QuartzNet and its decoder."""
+  return [f'encoder.blocks.{i}' for i in range(len(model.encoder.blocks))
+          ] + ['decoder']
+
+
+def export_names(model, weights=None):
+  """Maps conv module names of a QuartzNet to the n_Conv_* attribute
+  names of model.Model (the ONNX export), which holds the same convs in
+  the same order."""
+  from model import Model
+  exported = [(name, module)
+              for name, module in Model(weights).named_children()
+              if isinstance(module, nn.Conv1d)]
+  names = {}
+  for layer, (name, module) in zip(conv_layers(model), exported):
+    if model.get_submodule(layer).weight.shape != module.weight.shape:
+      raise ValueError(f"{layer} and {name} have different shapes; the "
+                       f"model does not match model.Model.")
+    names[layer] = name
+  return names
+
+
+def resolve_names(model, names, weights=None):
+  """Translates n_Conv_* names into QuartzNet module names; module names
+  pass through unchanged."""
+  names = list(names)
+  if not any(name.startswith('n_Conv_') for name in names):
+    return names
+  modules = {v: k for k, v in export_names(model, weights).items()}
+  return [modules[name] if name.startswith('n_Conv_') else name
+          for name in names]
+
+
+def qconfig_mapping(engine=ENGINE, float_modules=()):
+  """Default static int8 mapping of `engine`, with the output head
+  (softmax, log-softmax, log) in float.
+
+  Args:
+      float_modules: QuartzNet module names (e.g.
+          'encoder.blocks.3.convs.1.depthwise' or 'encoder.blocks.3')
+          left in float.
+  """
+  mapping = get_default_qconfig_mapping(engine)
+  for op in (F.softmax, F.log_softmax, torch.log):
+    mapping.set_object_type(op, None)
+  for name in float_modules:
+    mapping.set_module_name('model.' + name, None)
+  return mapping
+
+
+def load_config(path):
+  """Reads a mixed-precision config written by mixed_precision_config()."""
+  with open(path) as f:
+    return json.load(f)
+
+
+def prepare(model, example_input, engine=ENGINE, float_modules=()):
+  """Returns an observed copy of `model` ready for calibration."""
+  torch.backends.quantized.engine = engine
+  model = FeaturesOnly(copy.deepcopy(model)).eval()
+  return prepare_fx(model, qconfig_mapping(engine, float_modules),
+                    (example_input,))
+
+
+@torch.no_grad()
+def calibrate(observed, manifest=None, batch_size=32, subset_len=None,
+              batches=None):
+  """Runs calibration data through an observed model.
+
+  Args:
+      manifest, batch_size, subset_len: Calibration manifest, read with
+          utils.evaluation.feature_batches().
+      batches: Iterable of feature tensors (or feature_batches() tuples)
+          to use instead of a manifest.
+
+  Returns:
+      Number of utterances seen.
+  """
+  if batches is None:
+    batches = feature_batches(manifest, batch_size, subset_len)
+  seen = 0
+  for batch in batches:
+    features = batch[0] if isinstance(batch, (tuple, list)) else batch
+    observed(features)
+    seen += features.shape[0]
+  return seen
+
+
+def convert(observed):
+  """Converts a calibrated model into its int8 GraphModule."""
+  return convert_fx(observed).eval()
+
+
+def quantize(model, manifest=None, batch_size=32, subset_len=None,
+             batches=None, engine=ENGINE, float_modules=(), config=None):
+  """prepare(), calibrate() and convert() in one call.
+
+  Args:
+      config: Mixed-precision config (dict or JSON path) whose engine and
+          float_modules are used, on top of `float_modules`.
+  """
+  if config is not None:
+    if isinstance(config, str):
+      config = load_config(config)
+    engine = config.get('engine', engine)
+    float_modules = list(float_modules) + config['float_modules']
+  float_modules = resolve_names(model, float_modules)
+  if batches is None:
+    batches = feature_batches(manifest, batch_size, subset_len)
+  batches = iter(batches)
+  first = next(batches)
+  example = first[0] if isinstance(first, (tuple, list)) else first
+  observed = prepare(model, example, engine, float_modules)
+  calibrate(observed, batches=itertools.chain([first], batches))
+  return convert(observed)
+
+
+def kl_divergence(reference, outputs):
+  """Mean per-frame KL(reference || outputs) between two lists of
+  [frames, classes] log-prob tensors."""
+  total, frames = 0., 0
+  for p, q in zip(reference, outputs):
+    total += float((p.exp() * (p - q)).sum())
+    frames += p.shape[0]
+  return total / max(frames, 1)
+
+
+@torch.no_grad()
+def sensitivity(model, batches, units=None, engine=ENGINE,
+                calibration=None):
+  """Quantizes one unit at a time and measures the damage.
+
+  The model is prepared and calibrated once with every layer observed;
+  each unit is then converted on its own (everything else stays float),
+  which gives the same scales as calibrating it alone, since observers
+  only ever see float activations.
+
+  Args:
+      model: Float encoder.QuartzNet.
+      batches: feature_batches() output to evaluate on, ideally one
+          utterance per batch (quantized models are not length-masked).
+      units: Module names to quantize one at a time, conv_layers(model)
+          by default; block_names(model) gives per-block sensitivity.
+      calibration: Batches to calibrate on, `batches` by default.
+
+  Returns:
+      List of {'name', 'wer', 'delta_wer', 'kl'} dicts, most sensitive
+      (largest WER increase, then largest KL) first.
+  """
+  if units is None:
+    units = conv_layers(model)
+  if calibration is None:
+    calibration = batches
+  reference = evaluate(model, None, batches=batches, keep_outputs=True)
+  example = calibration[0][0] if isinstance(calibration[0], (tuple, list)) \
+      else calibration[0]
+  observed = prepare(model, example, engine)
+  calibrate(observed, batches=calibration)
+  qconfig = get_default_qconfig_mapping(engine).global_qconfig
+  results = []
+  for name in units:
+    # Later module_name entries win over the regex that turns everything
+    # else off.
+    mapping = qconfig_mapping(engine).set_module_name_regex('.*', None)
+    mapping.set_module_name('model.' + name, qconfig)
+    quantized = convert_fx(copy.deepcopy(observed), qconfig_mapping=mapping)
+    result = evaluate(quantized.eval(), None, batches=batches,
+                      keep_outputs=True)
+    results.append({'name': name,
+                    'wer': result['wer'],
+                    'delta_wer': result['wer'] - reference['wer'],
+                    'kl': kl_divergence(reference['outputs'],
+                                        result['outputs'])})
+  return sorted(results, key=lambda r: (r['delta_wer'], r['kl']),
+                reverse=True)
+
+
+def mixed_precision_config(ranking, top_k, engine=ENGINE, names=None):
+  """Config keeping the `top_k` most sensitive units of a sensitivity()
+  ranking in float.
+
+  Args:
+      names: Optional {module name: n_Conv_* name} (export_names()) to
+          record next to each ranked unit.
+  """
+  ranking = [dict(r, export_name=names[r['name']])
+             if names and r['name'] in names else dict(r) for r in ranking]
+  return {'engine': engine,
+          'float_modules': [r['name'] for r in ranking[:top_k]],
+          'ranking': ranking}
+
+
+def save_quantized(quantized, path):
+  """Saves an int8 model as TorchScript, which loads without rebuilding,
+  re-tracing or re-calibrating the float model."""
+  torch.jit.save(torch.jit.script(quantized), path)
+
+
+def load_quantized(path, engine=ENGINE):
+  torch.backends.quantized.engine = engine
+  return torch.jit.load(path).eval()
@@ -4,7 +4,6 @@ import glob
 import os
 import math
 
-import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -12,8 +11,10 @@ import torch.nn.functional as F
 import argparse
 from pytorch_nndct.apis import torch_quantizer, dump_xmodel
 from utils.common import post_process_predictions, post_process_transcripts, word_error_rate, to_numpy
-from utils.audio_preprocessing import AudioToMelSpectrogramPreprocessor
-from utils.data_layer import AudioToTextDataLayer
+from encoder import check_output, output_head
+from utils.evaluation import evaluate as evaluate_batches
+from utils.feature_cache import cached_feature_batches
+from utils.weights import load_variables, skip_init
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
@@ -32,7 +33,7 @@ parser.add_argument(
     '--subset_len',
     default=None,
     type=int,
-    help='subset_len to evaluate model, using the whole validation dataset if it is not set')
+    help='number of utterances to calibrate / evaluate on, sampled evenly over the duration range of the manifest; the whole dataset if it is not set')
 parser.add_argument(
     '--batch_size',
     default=32,
@@ -56,15 +57,21 @@ vocab = [" ", "a", "b", "c", "d", "e", "f", "g", "h", "i", "j", "k", "l", "m",
     "n", "o", "p", "q", "r", "s", "t", "u", "v", "w", "x", "y", "z", "'"]
 
 class Model(nn.Module):
-  def __init__(self):
+  def __init__(self, weights=None, output='softmax'):
     super(Model, self).__init__()
+    # Output head, see encoder.OUTPUTS; the DPU flow takes probabilities
+    self.output = check_output(output)
     self._vars = nn.ParameterDict()
     self._regularizer_params = []
-    for b in glob.glob(
-        os.path.join(os.path.dirname(__file__), "variables", "*.npy")):
-      v = torch.from_numpy(np.load(b))
+    # Packed archive (zero-copy mmap) when available, variables/*.npy otherwise
+    for name, v in load_variables(weights).items():
       requires_grad = v.dtype.is_floating_point or v.dtype.is_complex
-      self._vars[os.path.basename(b)[:-4]] = nn.Parameter(v, requires_grad=requires_grad)
+      self._vars[name] = nn.Parameter(v, requires_grad=requires_grad)
+    # Weights are rebound to the loaded variables, skip the random init
+    with skip_init(nn.Conv1d):
+      self._build_layers()
+
+  def _build_layers(self):
     self.n_Conv_0 = nn.Conv1d(**{'groups': 64, 'dilation': [1], 'out_channels': 64, 'padding': [16], 'kernel_size': (33,), 'stride': [2], 'in_channels': 64, 'bias': False})
     self.n_Conv_0.weight.data = self._vars["encoder_encoder_0_mconv_0_conv_weight"]
     self.n_Conv_1 = nn.Conv1d(**{'groups': 1, 'dilation': [1], 'out_channels': 256, 'padding': [0], 'kernel_size': (1,), 'stride': [1], 'in_channels': 64, 'bias': True})
@@ -768,9 +775,7 @@ class Model(nn.Module):
     t_1275 = self.n_Conv_261(t_992)
     t_995 = F.relu(t_1275)
     t_996 = self.n_Conv_263(t_995)
-    t_997 = t_996.permute(*[0, 2, 1])
-    logprobs = F.softmax(t_997, **{'dim': 2})
-    return logprobs
+    return output_head(t_996, self.output)
 
   def compatible_auto_pad(self, input, kernel_spatial_shape, nn_mod, auto_pad=None, **kwargs):
     input_spatial_shape = input.shape[2:]
@@ -801,46 +806,31 @@ def accuracy(predictions, transcripts, transcripts_len):
   return 1 - wer
 
 @torch.no_grad()
-def evaluate(model, val_data):
+def evaluate(model, val_data, subset_len=None, batch_size=32):
+  """Returns (1 - WER, WER) of `model` on manifest `val_data`.
+
+  Features come from the memory-mapped cache of utils.feature_cache, so
+  only the first run over a manifest (or a new --subset_len subset of it)
+  decodes WAVs; repeated calib / fast_finetune / test runs only run the
+  model.
+  """
   model.eval()
   model = model.to(device)
-  data_layer = AudioToTextDataLayer(
-      manifest_filepath=val_data,
-      sample_rate=16000,
-      labels=vocab,
-      batch_size=32,
-      shuffle=False,
-      drop_last=True)
-  preprocessor = AudioToMelSpectrogramPreprocessor(sample_rate=16000) 
-  predictions = []
-  transcripts = []
-  transcripts_len = []
-  for i, test_batch in enumerate(data_layer.data_iterator):
-      # Get audio [1, n], audio length n, transcript and transcript length
-      audio_signal_e1, a_sig_length_e1, transcript_e1, transcript_len_e1 = test_batch
-
-      # Get 64d MFCC features and accumulate time
-      processed_signal = preprocessor.get_features(audio_signal_e1, a_sig_length_e1)
-
-      # Inference and accumulate time. Input shape: [Batch_size, 64, Timesteps]
-      prob = model(processed_signal)
-      ologits = torch.log(prob)
-      alogits = np.asarray(ologits)
-      logits = torch.from_numpy(alogits[0])
-      predictions_e1 = logits.argmax(dim=-1, keepdim=False)
-      transcript_e1 = torch.from_numpy(np.asarray(test_batch[2])) 
-      transcript_len_e1 = torch.from_numpy(np.asarray(test_batch[1])) 
-
-      # Save results
-      predictions.append(predictions_e1)
-      transcripts.append(transcript_e1)
-      transcripts_len.append(transcript_len_e1)
-  acc = accuracy(predictions, transcripts, transcripts_len)
-  return acc, 1 - acc
+  batches = cached_feature_batches(val_data, batch_size, subset_len)
+  result = evaluate_batches(lambda x: model(x.to(device)).cpu(), None,
+                            batches=batches)
+  return 1 - result['wer'], result['wer']
 
 def quantization(title='optimize',
                  model_name='', 
                  file_path=''): 
+  """Vitis DPU quantization of Model with pytorch_nndct.
+
+  The whole graph is quantized to int8 for the DPU. Mixed-precision
+  configs (quantize.mixed_precision_config, tools/quant_sensitivity.py)
+  are not applied here; they only drive the CPU FX flow of
+  quantize.quantize().
+  """
 
   data_dir = args.data_dir
   quant_mode = args.quant_mode
@@ -875,7 +865,7 @@ def quantization(title='optimize',
   if finetune == True:
 
       if quant_mode == 'calib':
-        quantizer.fast_finetune(evaluate, (quant_model, data_dir))
+        quantizer.fast_finetune(evaluate, (quant_model, data_dir, subset_len))
       elif quant_mode == 'test':
         quantizer.load_ft_param()
    
@@ -883,7 +873,7 @@ def quantization(title='optimize',
   # add modules float model accuracy here
 
   #register_modification_hooks(model_gen, train=False)
-  acc, wer = evaluate(quant_model, data_dir)
+  acc, wer = evaluate(quant_model, data_dir, subset_len, batch_size)
 
   # logging accuracy
   print('wer: %g' % (wer))
@@ -901,7 +891,8 @@ if __name__ == '__main__':
   deploy = args.deploy
   quantizer = torch_quantizer(quant_mode, model, (input))
   quant_model = quantizer.quant_model
-  acc, wer = evaluate(quant_model, args.data_dir)
+  acc, wer = evaluate(quant_model, args.data_dir, args.subset_len,
+                      args.batch_size)
   if quant_mode == 'calib':
     quantizer.export_quant_config()
   if deploy:
@@ -0,0 +1,171 @@
+# Magnitude pruning and sparse execution of the 1x1 convs of
+# encoder.QuartzNet.
+#
+# The pointwise convs of every sub-block, the residual 1x1 convs and the
+# decoder hold almost all of the weights and FLOPs of QuartzNet. prune()
+# zeroes the lowest-magnitude weights of each of them (single weights, or
+# (rows, cols) blocks scored by their L2 norm) down to a target sparsity.
+# sparsify() then swaps each pruned conv for a SparsePointwise that keeps
+# the weight as a CSR matrix and runs it through torch.sparse.mm, which
+# only pays off at high sparsity (roughly 80% and up with MKL), so
+# tools/bench_sparsity.py sweeps WER and latency over sparsity levels.
+#
+# sparse_variables() writes the pruned convs into the exported variable
+# dict as <name>.csr_values / .csr_crow_indices / .csr_col_indices /
+# .csr_shape instead of the dense <name>, which utils.weights packs like
+# any other tensors; load_sparse() builds the sparse model back from such
+# an archive. model.Model and QuartzNet.from_variables() need the dense
+# weights and do not read these archives.
+#
+# The fused path (fusion.fuse) reads the dense pointwise weights directly
+# and cannot run sparse convs.
+
+import torch
+import torch.nn as nn
+
+from encoder import QUARTZNET_15x5, QuartzNet, variable_names
+from utils.weights import load_variables, skip_init
+
+
+class SparsePointwise(nn.Module):
+  """1x1 Conv1d with a CSR [out, in] weight and a dense bias."""
+  def __init__(self, weight, bias):
+    super(SparsePointwise, self).__init__()
+    self.weight = weight
+    self.bias = nn.Parameter(bias, requires_grad=False)
+
+  @property
+  def sparsity(self):
+    return 1. - self.weight.values().numel() / self.weight.shape.numel()
+
+  def forward(self, x):
+    batch, channels, frames = x.shape
+    if batch == 1:
+      out = torch.sparse.mm(self.weight, x[0]).unsqueeze(0)
+    else:
+      # One [in, B * T] product instead of B small ones.
+      out = torch.sparse.mm(
+          self.weight, x.transpose(0, 1).reshape(channels, -1))
+      out = out.reshape(-1, batch, frames).transpose(0, 1)
+    return out + self.bias.unsqueeze(-1)
+
+
+def pointwise_layers(model, decoder=True):
+  """Module names of the 1x1 convs of a QuartzNet: pointwise and residual
+  convs in graph order, then the decoder."""
+  names = []
+  for b, block in enumerate(model.encoder.blocks):
+    prefix = f'encoder.blocks.{b}'
+    names += [f'{prefix}.convs.{r}.pointwise'
+              for r in range(len(block.convs))]
+    if block.residual is not None:
+      names.append(f'{prefix}.residual')
+  if decoder:
+    names.append('decoder')
+  return names
+
+
+def prune(model, sparsity, block=(1, 1), layers=None):
+  """Zeroes the smallest weights of every 1x1 conv, in place.
+
+  Args:
+      model: encoder.QuartzNet (not fused, not yet sparsified).
+      sparsity (float): Fraction of weights (or blocks) zeroed per layer.
+      block: (rows, cols) of the pruning blocks; (1, 1) prunes single
+          weights. Must divide the weight shape of every layer.
+      layers: Module names to prune, pointwise_layers(model) by default.
+
+  Returns:
+      `model`.
+  """
+  if not 0. <= sparsity < 1.:
+    raise ValueError(f"sparsity must be in [0, 1), got {sparsity}.")
+  rows, cols = block
+  for name in layers or pointwise_layers(model):
+    conv = model.get_submodule(name)
+    out_channels, in_channels, _ = conv.weight.shape
+    if out_channels % rows or in_channels % cols:
+      raise ValueError(f"{name} has a {out_channels}x{in_channels} weight, "
+                       f"which {rows}x{cols} blocks do not divide.")
+    weight = conv.weight.detach()[..., 0]
+    norms = weight.reshape(out_channels // rows, rows,
+                           in_channels // cols, cols).pow(2).sum((1, 3))
+    pruned = int(round(sparsity * norms.numel()))
+    mask = torch.ones(norms.numel(), dtype=weight.dtype)
+    mask[norms.flatten().argsort()[:pruned]] = 0.
+    mask = mask.reshape(norms.shape).repeat_interleave(rows, 0) \
+        .repeat_interleave(cols, 1)
+    # A new tensor: the old one may be a read-only view of the archive.
+    conv.weight.data = (weight * mask).unsqueeze(-1)
+  return model
+
+
+def _replace(model, name, module):
+  parent, _, attr = name.rpartition('.')
+  setattr(model.get_submodule(parent) if parent else model, attr, module)
+
+
+def sparsify(model, layers=None):
+  """Swaps the 1x1 convs of a (pruned) QuartzNet for SparsePointwise
+  modules, in place, and returns `model`."""
+  for name in layers or pointwise_layers(model):
+    conv = model.get_submodule(name)
+    if not isinstance(conv, nn.Conv1d):
+      raise ValueError(f"{name} is a {type(conv).__name__}, not a Conv1d; "
+                       f"sparsify() needs an unfused, dense model.")
+    _replace(model, name, SparsePointwise(
+        conv.weight.detach()[..., 0].to_sparse_csr(), conv.bias.detach()))
+  return model
+
+
+def sparse_variables(model):
+  """Exported variables of a sparsified QuartzNet, with every
+  SparsePointwise weight stored as its CSR components."""
+  variables = {}
+  for param_name, var_name in variable_names(model):
+    module_name, attr = param_name.rsplit('.', 1)
+    module = model.get_submodule(module_name)
+    if isinstance(module, SparsePointwise) and attr == 'weight':
+      weight = module.weight
+      variables[var_name + '.csr_values'] = weight.values()
+      variables[var_name + '.csr_crow_indices'] = weight.crow_indices()
+      variables[var_name + '.csr_col_indices'] = weight.col_indices()
+      variables[var_name + '.csr_shape'] = torch.tensor(
+          list(weight.shape) + [1], dtype=torch.int64)
+    else:
+      variables[var_name] = getattr(module, attr).detach()
+  return variables
+
+
+def load_sparse(weights=None, spec=QUARTZNET_15x5):
+  """Builds a QuartzNet from variables written by sparse_variables().
+
+  Convs whose weight is stored in CSR form become SparsePointwise
+  modules; every other parameter is bound to its variable without
+  copying, as in QuartzNet.from_variables().
+  """
+  variables = load_variables(weights)
+  with skip_init(nn.Conv1d):
+    model = QuartzNet(spec)
+  for param_name, var_name in variable_names(model):
+    module_name, attr = param_name.rsplit('.', 1)
+    if var_name + '.csr_values' in variables:
+      shape = variables[var_name + '.csr_shape'].tolist()
+      weight = torch.sparse_csr_tensor(
+          variables[var_name + '.csr_crow_indices'],
+          variables[var_name + '.csr_col_indices'],
+          variables[var_name + '.csr_values'], tuple(shape[:2]))
+      _replace(model, module_name, SparsePointwise(
+          weight, model.get_submodule(module_name).bias.detach()))
+      continue
+    if var_name not in variables:
+      raise KeyError(f"Exported variable {var_name} for {param_name} "
+                     f"not found.")
+    param = model.get_parameter(param_name)
+    if param.shape != variables[var_name].shape:
+      raise ValueError(
+          f"{param_name} has shape {tuple(param.shape)} but {var_name} "
+          f"has shape {tuple(variables[var_name].shape)}; the spec does "
+          f"not match the exported network.")
+    param.data = variables[var_name]
+  return model.eval()
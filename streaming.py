@@ -0,0 +1,181 @@
+# Chunked (streaming) inference for encoder.QuartzNet.
+#
+# Offline inference needs the whole [B, 64, T] spectrogram. StreamingQuartzNet
+# instead accepts feature chunks and keeps, for every depthwise conv, a cache
+# of the input frames it still needs: the left context of the next output
+# frame (padding = dilation * (kernel - 1) / 2 frames, including the stride 2
+# prologue conv) plus whatever has not been consumed yet. Pointwise convs,
+# ReLU and the decoder are frame-local and need no state; residual branches
+# queue the 1x1 residual of the block input until the main path catches up.
+#
+# With lookahead=None each conv waits for its full right context and the
+# streamed log-probs equal the offline ones (up to float summation order).
+# QuartzNet 15x5 reaches about 40 s into the future that way, so a bounded
+# lookahead caps the right context of every conv; frames beyond it are
+# treated as zeros, trading accuracy for latency.
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from encoder import output_head
+
+
+def _pointwise(conv, x):
+  """1x1 conv that also accepts zero-length chunks."""
+  if x.shape[-1] == 0:
+    return x.new_empty(x.shape[0], conv.out_channels, 0)
+  return conv(x)
+
+
+class _ConvStream(object):
+  """Incremental state of one depthwise conv."""
+  def __init__(self, conv, lookahead=None):
+    self.weight = conv.weight
+    self.stride = conv.stride[0]
+    self.dilation = conv.dilation[0]
+    self.padding = conv.padding[0]
+    self.groups = conv.groups
+    self.extent = self.dilation * (conv.kernel_size[0] - 1) + 1
+    self.right = self.extent - 1 - self.padding
+    if lookahead is not None:
+      self.right = min(self.right, lookahead)
+    self.reset()
+
+  def reset(self):
+    self.cache = None
+    self.cache_start = 0  # absolute index of cache[..., 0]
+    self.received = 0
+    self.emitted = 0
+
+  @property
+  def cache_frames(self):
+    return 0 if self.cache is None else self.cache.shape[-1]
+
+  def step(self, x, final=False):
+    if self.cache is None:
+      self.cache = x
+    elif x.shape[-1]:
+      self.cache = torch.cat((self.cache, x), dim=-1)
+    self.received += x.shape[-1]
+
+    if final:
+      last = (self.received + 2 * self.padding - self.extent) \
+          // self.stride + 1
+    else:
+      last = (self.received - 1 - self.right) // self.stride + 1
+    if last <= self.emitted:
+      return self.cache[:, :, :0]
+
+    # Absolute input range [start, stop) covering outputs emitted..last-1;
+    # anything outside [0, received) is zero padding.
+    start = self.emitted * self.stride - self.padding
+    stop = (last - 1) * self.stride - self.padding + self.extent
+    lo = max(start, self.cache_start)
+    hi = min(stop, self.received)
+    window = self.cache[:, :, lo - self.cache_start:hi - self.cache_start]
+    window = F.pad(window, (lo - start, stop - hi))
+    y = F.conv1d(window, self.weight, stride=self.stride,
+                 dilation=self.dilation, groups=self.groups)
+
+    self.emitted = last
+    keep = max(last * self.stride - self.padding, self.cache_start)
+    self.cache = self.cache[:, :, keep - self.cache_start:]
+    self.cache_start = keep
+    return y
+
+
+class _BlockStream(object):
+  def __init__(self, block, lookahead=None):
+    self.convs = []
+    for conv in block.convs:
+      dw = conv.depthwise
+      stream = _ConvStream(dw, lookahead) if isinstance(dw, nn.Conv1d) \
+          else None
+      self.convs.append((stream, conv.pointwise))
+    self.residual = block.residual
+    self.reset()
+
+  def reset(self):
+    for stream, _ in self.convs:
+      if stream is not None:
+        stream.reset()
+    self.pending = None
+
+  def step(self, x, final=False):
+    if self.residual is not None:
+      r = _pointwise(self.residual, x)
+      self.pending = r if self.pending is None \
+          else torch.cat((self.pending, r), dim=-1)
+    out = x
+    last = len(self.convs) - 1
+    for i, (stream, pointwise) in enumerate(self.convs):
+      if stream is not None:
+        out = stream.step(out, final)
+      out = _pointwise(pointwise, out)
+      if i != last:
+        out = F.relu(out)
+    if self.residual is not None:
+      n = out.shape[-1]
+      out = out + self.pending[:, :, :n]
+      self.pending = self.pending[:, :, n:]
+    return F.relu(out)
+
+
+class StreamingQuartzNet(object):
+  """Stateful chunk-by-chunk inference over an encoder.QuartzNet.
+
+  Args:
+      model: encoder.QuartzNet (weights are shared, not copied).
+      lookahead (int or None): Right context every depthwise conv waits
+          for, in its own frames. None waits for the full receptive field
+          and reproduces offline outputs.
+
+  Feed [B, 64, n] feature chunks to step() and call flush() at the end of
+  the stream; both return [B, n', 29] log-probs for the frames finalized
+  by that call.
+  """
+  def __init__(self, model, lookahead=None):
+    self.model = model
+    self.lookahead = lookahead
+    self.blocks = [_BlockStream(b, lookahead) for b in model.encoder.blocks]
+
+  def reset(self):
+    for block in self.blocks:
+      block.reset()
+
+  @property
+  def lookahead_frames(self):
+    """Algorithmic look-ahead in input feature frames."""
+    frames, scale = 0, 1
+    for block in self.blocks:
+      for stream, _ in block.convs:
+        if stream is not None:
+          frames += stream.right * scale
+          scale *= stream.stride
+    return frames
+
+  @property
+  def cache_frames(self):
+    """Frames currently held in all depthwise caches."""
+    return sum(stream.cache_frames for block in self.blocks
+               for stream, _ in block.convs if stream is not None)
+
+  def _run(self, x, final):
+    for block in self.blocks:
+      x = block.step(x, final)
+    x = _pointwise(self.model.decoder, x)
+    return output_head(x, self.model.output)
+
+  @torch.no_grad()
+  def step(self, features):
+    return self._run(features, final=False)
+
+  @torch.no_grad()
+  def flush(self):
+    """Ends the stream and returns the remaining frames; reset() before
+    starting a new one."""
+    cache = self.blocks[0].convs[0][0].cache
+    if cache is None:
+      raise RuntimeError("flush() called before any step().")
+    return self._run(cache[:, :, :0], final=True)
@@ -1,7 +1,7 @@
 import numpy as np
 import onnx
-import onnxruntime
 import torch
+from onnx_sessions import get_session
 from utils.common import post_process_predictions, post_process_transcripts, word_error_rate, to_numpy
 from utils.audio_preprocessing import AudioToMelSpectrogramPreprocessor
 from utils.data_layer import AudioToTextDataLayer
@@ -32,10 +32,8 @@ def test(model, val_data):
     processed_signal = preprocessor.get_features(audio_signal_e1, a_sig_length_e1)
 
     # Inference and accumulate time. Input shape: [Batch_size, 64, Timesteps]
-    ologits = model(processed_signal)
-    alogits = np.asarray(ologits)
-    logits = torch.from_numpy(alogits[0])
-    predictions_e1 = logits.argmax(dim=-1, keepdim=False)
+    # Greedy ids straight from the graph (Model(output='ids'))
+    predictions_e1 = model(processed_signal)[0]
     transcript_e1 = torch.from_numpy(np.asarray(test_batch[2])) 
     transcript_len_e1 = torch.from_numpy(np.asarray(test_batch[1])) 
 
@@ -47,7 +45,7 @@ def test(model, val_data):
   return greedy_hypotheses
 
 def ref(model_path, val_data):
-  session = onnxruntime.InferenceSession(model_path)
+  session = get_session(model_path)
   data_layer = AudioToTextDataLayer(
       manifest_filepath=val_data,
       sample_rate=16000,
@@ -66,8 +64,8 @@ def ref(model_path, val_data):
     # Get 64d MFCC features and accumulate time
     processed_signal = preprocessor.get_features(audio_signal_e1, a_sig_length_e1)
     # Inference and accumulate time. Input shape: [Batch_size, 64, Timesteps]
-    inputs = {session.get_inputs()[0].name: to_numpy(processed_signal),}
-    ologits = session.run(None, inputs)
+    inputs = {session.input_names[0]: to_numpy(processed_signal),}
+    ologits = session.run(inputs)
     alogits = np.asarray(ologits)
     logits = torch.from_numpy(alogits[0])
     predictions_e1 = logits.argmax(dim=-1, keepdim=False)
@@ -83,7 +81,7 @@ def ref(model_path, val_data):
 
 if __name__ == '__main__':
   data = '../Adaptiv/Quartznet/val/test_sample.json'
-  torch_model = Model()
+  torch_model = Model(output='ids')
   torch_outputs = test(torch_model, data)
 
   onnx_model = "../Adaptiv/Quartznet/onnx_quartznet.onnx"
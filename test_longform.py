@@ -0,0 +1,65 @@
+# Parity of long-form featurization and transcription against the
+# full-sequence path on the bundled wavs:
+#
+#     python -m pytest -q test_longform.py
+
+import numpy as np
+import torch
+
+from encoder import QuartzNet
+from longform import _spans, long_features, transcribe_long
+from utils.audio_preprocessing import AudioToMelSpectrogramPreprocessor
+from utils.segment import AudioSegment
+
+WAVS = ['116-288045-0000.wav', '116-288045-0001.wav']
+WINDOW = 1000
+
+
+def _recording(min_samples=0):
+  """The bundled wavs concatenated, repeated to at least min_samples."""
+  samples = np.concatenate(
+      [AudioSegment.from_file(p, target_sr=16000).samples for p in WAVS])
+  repeat = max(1, -(-min_samples // len(samples)))
+  return torch.tensor(np.tile(samples, repeat),
+                      dtype=torch.float).unsqueeze(0)
+
+
+def test_long_features_match_get_features():
+  preprocessor = AudioToMelSpectrogramPreprocessor(sample_rate=16000)
+  signal = _recording()
+  expected = preprocessor.get_features(signal,
+                                       torch.tensor([signal.shape[1]]))
+  # A chunk that is not a multiple of the hop exercises the STFT overlap.
+  chunked = long_features(preprocessor, signal, chunk=16000 * 7 + 123)
+  assert chunked.shape == expected.shape
+  assert torch.allclose(chunked, expected, atol=1e-4)
+
+
+def test_long_features_on_a_hop_multiple():
+  # N % hop == 0 and N / hop a multiple of 16: offline has one frame more
+  # than ceil(N / hop), which pads to 16 more frames.
+  preprocessor = AudioToMelSpectrogramPreprocessor(sample_rate=16000)
+  hop = preprocessor.featurizer.hop_length
+  signal = _recording()
+  signal = signal[:, :signal.shape[1] // (16 * hop) * 16 * hop]
+  expected = preprocessor.get_features(signal,
+                                       torch.tensor([signal.shape[1]]))
+  chunked = long_features(preprocessor, signal, chunk=16000 * 7 + 123)
+  assert chunked.shape == expected.shape
+  assert torch.allclose(chunked, expected, atol=1e-4)
+
+
+def test_transcribe_long_matches_full_sequence():
+  model = QuartzNet.from_variables().eval()
+  context = model.encoder.receptive_field()
+  preprocessor = AudioToMelSpectrogramPreprocessor(sample_rate=16000)
+  hop = preprocessor.featurizer.hop_length
+  signal = _recording((2 * WINDOW + 2 * context) * hop)
+  features = long_features(preprocessor, signal)
+  assert len(_spans(features.shape[-1], WINDOW, context,
+                    model.encoder.stride)) > 1
+  with torch.no_grad():
+    full = model(features)
+  stitched = transcribe_long(model, features, WINDOW)
+  assert stitched.shape == full.shape
+  assert torch.allclose(stitched, full, atol=1e-3)
@@ -3,9 +3,8 @@ path = "../Adaptiv/Quartznet/onnx_quartznet.onnx"
 # code_gen.gen(path, "./")
 
 import numpy as np
-import onnx
-import onnxruntime
 import torch
+from onnx_sessions import get_session
 torch.set_printoptions(8)
 
 from model import Model
@@ -16,12 +15,9 @@ inp = np.random.randn(32, 64, 256).astype(np.float32)
 with torch.no_grad():
   torch_outputs = model(torch.from_numpy(inp))
 
-onnx_model = onnx.load(path)
-sess_options = onnxruntime.SessionOptions()
-session = onnxruntime.InferenceSession(onnx_model.SerializeToString(),
-                                       sess_options)
-inputs = {session.get_inputs()[0].name: inp}
-ort_outputs = session.run(None, inputs)
+session = get_session(path)
+inputs = {session.input_names[0]: inp}
+ort_outputs = session.run(inputs)
 print("torch")
 print(torch_outputs.detach().numpy())
 print("onnx")
@@ -0,0 +1,98 @@
+# Shared-memory weight segments (utils.weights.publish_shared /
+# attach_shared / release_shared) against the packed archive:
+#
+#     python -m pytest -q test_shared_weights.py
+#
+# Skipped where /dev/shm is unavailable.
+
+import multiprocessing as mp
+import os
+
+import pytest
+import torch
+
+from utils.weights import (attach_shared, load_variables, publish_shared,
+                           release_shared, shared_path)
+
+pytestmark = pytest.mark.skipif(not os.path.isdir('/dev/shm'),
+                                reason='/dev/shm is unavailable')
+WORKERS = 2
+
+
+@pytest.fixture
+def segment():
+  name = 'quartznet-test-%d' % os.getpid()
+  publish_shared(name)
+  try:
+    yield name
+  finally:
+    release_shared(name)
+  assert not os.path.exists(shared_path(name))
+
+
+def test_shared_weights_match_archive(segment):
+  expected = load_variables()
+  shared = attach_shared(segment)
+  assert sorted(shared) == sorted(expected)
+  for name, tensor in expected.items():
+    assert shared[name].dtype == tensor.dtype, name
+    assert torch.equal(shared[name], tensor), name
+
+
+def test_model_over_shared_weights(segment):
+  from model import Model
+  features = torch.randn(1, 64, 128)
+  with torch.no_grad():
+    expected = Model().eval()(features)
+    shared = Model(attach_shared(segment)).eval()(features)
+  assert torch.equal(shared, expected)
+
+
+def _mapping_kb(pid, path):
+  """Sums the smaps counters of every mapping of `path` in `pid`."""
+  totals = {}
+  current = False
+  with open('/proc/%d/smaps' % pid) as f:
+    for line in f:
+      parts = line.split()
+      if '-' in parts[0] and len(parts) >= 5:
+        current = len(parts) >= 6 and parts[5] == path
+      elif current and parts[0].endswith(':') and len(parts) == 3:
+        key = parts[0][:-1]
+        totals[key] = totals.get(key, 0) + int(parts[1])
+  return totals
+
+
+def _worker(segment, ready, done):
+  from model import Model
+  model = Model(attach_shared(segment)).eval()
+  with torch.no_grad():
+    model(torch.randn(1, 64, 128))
+  ready.put(os.getpid())
+  done.wait()
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/smaps'),
+                    reason='needs /proc/<pid>/smaps')
+def test_replicas_share_the_segment(segment):
+  size_kb = os.path.getsize(shared_path(segment)) // 1024
+  ctx = mp.get_context('spawn')
+  ready, done = ctx.Queue(), ctx.Event()
+  procs = [ctx.Process(target=_worker, args=(segment, ready, done))
+           for _ in range(WORKERS)]
+  try:
+    for p in procs:
+      p.start()
+    pids = [ready.get(timeout=300) for _ in procs]
+    stats = [_mapping_kb(pid, shared_path(segment)) for pid in pids]
+  finally:
+    done.set()
+    for p in procs:
+      p.join()
+  for s in stats:
+    private = s.get('Private_Clean', 0) + s.get('Private_Dirty', 0)
+    # Each worker maps (nearly) the whole segment, without a private copy
+    # of any page, and pays only its 1/N share of it.
+    assert s['Rss'] >= 0.9 * size_kb, s
+    assert private == 0, s
+    assert s['Pss'] <= 1.1 * size_kb / WORKERS, s
@@ -0,0 +1,63 @@
+"""Padded vs length-aware batches of mixed-length utterances.
+
+    python -m tools.bench_batching [--batch 16] [--seconds 2 16]
+        [--max_padding 0.1]
+
+Draws random utterance lengths, builds a zero-padded batch of random
+features and times QuartzNet on it three ways: padded (no lengths, the
+padding is convolved and leaks into shorter utterances), masked (lengths
+passed, padding zeroed after every block) and bucketed
+(batching.transcribe_batch). Prints the padded-vs-useful MAC ratios and
+the largest difference of each way against running every utterance alone.
+"""
+import argparse
+
+import torch
+
+from batching import flop_report, length_buckets, transcribe_batch
+from encoder import QuartzNet
+from tools.timing import median_ms
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch', type=int, default=16)
+    parser.add_argument('--seconds', nargs=2, type=float, default=[2, 16])
+    parser.add_argument('--max_padding', type=float, default=0.1)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    torch.manual_seed(args.seed)
+    lo, hi = (int(s * 100) for s in args.seconds)
+    lengths = torch.randint(lo, hi + 1, (args.batch,))
+    features = torch.zeros(args.batch, 64, int(lengths.max()))
+    for i, length in enumerate(lengths.tolist()):
+        features[i, :, :length] = torch.randn(64, length)
+
+    model = QuartzNet.from_variables().eval()
+    out_lengths = model.encoder.output_lengths(lengths)
+    with torch.no_grad():
+        alone = [model(features[i:i + 1, :, :l])[0]
+                 for i, l in enumerate(lengths.tolist())]
+        runs = {
+            'padded': lambda: model(features),
+            'masked': lambda: model(features, lengths),
+            'bucketed': lambda: transcribe_batch(
+                model, features, lengths, args.max_padding)[0],
+        }
+
+        groups = length_buckets(lengths.tolist(), args.max_padding)
+        report = flop_report(model, lengths, groups)
+        print('lengths %s' % sorted(lengths.tolist()))
+        print('%d sub-batches, useful %.1f GMAC, padded %.2fx, '
+              'bucketed %.2fx' % (len(groups), report['useful'] / 1e9,
+                                  report['padded_ratio'],
+                                  report['bucketed_ratio']))
+        print('%10s %10s %10s' % ('mode', 'ms', 'max diff'))
+        for name, fn in runs.items():
+            y = fn()
+            diff = max((y[i, :l] - a).abs().max().item() for i, (l, a)
+                       in enumerate(zip(out_lengths.tolist(), alone)))
+            print('%10s %10.1f %10.2e' % (name, median_ms(fn, args.repeat),
+                                          diff))
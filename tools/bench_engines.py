@@ -0,0 +1,76 @@
+"""Parity and throughput of every engine.InferenceEngine backend.
+
+    python -m tools.bench_engines [--backends eager torchscript onnxruntime
+        tvm] [--batch 1 8] [--frames 1024]
+
+For each backend prints the time to create the engine (compiling, or
+loading cached artifacts on a second run), the largest log-prob difference
+and the greedy-label agreement against eager on a padded batch with
+per-utterance lengths, and the median latency and real-time factor
+(wall seconds per audio second, 100 frames per second), then how many
+artifacts the backend compiled and loaded from its cache. Backends whose
+packages are not installed are reported and skipped.
+"""
+import argparse
+import time
+
+import torch
+
+from encoder import QuartzNet
+from engine import ENGINES, EagerEngine, create_engine
+from tools.timing import median_ms
+
+FRAMES_PER_SECOND = 100
+
+
+def latency_ms(engine, features, lengths, repeat):
+    return median_ms(lambda: engine.run(features, lengths), repeat)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backends', nargs='+', default=list(ENGINES))
+    parser.add_argument('--batch', nargs='+', type=int, default=[1, 8])
+    parser.add_argument('--frames', nargs='+', type=int, default=[1024])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=None)
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    model = QuartzNet.from_variables()
+    reference = EagerEngine(model=QuartzNet.from_variables())
+    print('%12s %5s %6s %9s %10s %8s %10s %8s' % (
+        'backend', 'batch', 'frames', 'create s', 'max diff', 'labels',
+        'ms', 'RTF'))
+    for backend in args.backends:
+        try:
+            t = time.perf_counter()
+            engine = create_engine(backend, model=model)
+            created = time.perf_counter() - t
+        except ImportError as e:
+            print('%12s skipped: %s' % (backend, e))
+            continue
+        model = QuartzNet.from_variables()  # fused backends modify theirs
+        for batch in args.batch:
+            for frames in args.frames:
+                torch.manual_seed(0)
+                features = torch.randn(batch, 64, frames)
+                lengths = torch.linspace(frames, frames // 2, batch).long()
+                out_lengths = reference.output_lengths(lengths)
+                expected = reference.run(features, lengths)
+                y = engine.run(features, lengths)
+                diff, same, total = 0., 0, 0
+                for i, n in enumerate(out_lengths.tolist()):
+                    diff = max(diff, (y[i, :n] - expected[i, :n]).abs()
+                               .max().item())
+                    same += (y[i, :n].argmax(-1) ==
+                             expected[i, :n].argmax(-1)).sum().item()
+                    total += n
+                ms = latency_ms(engine, features, lengths, args.repeat)
+                audio = lengths.sum().item() / FRAMES_PER_SECOND
+                print('%12s %5d %6d %9.2f %10.2e %7.2f%% %10.1f %8.4f' % (
+                    backend, batch, frames, created, diff,
+                    100. * same / total, ms, ms / 1000 / audio))
+        print('%12s cache: %d compiled, %d loaded' % (
+            backend, engine.cache.misses, engine.cache.hits))
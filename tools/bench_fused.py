@@ -0,0 +1,56 @@
+"""Eager vs fused (fusion.fuse) QuartzNet on CPU.
+
+    python -m tools.bench_fused [--batch 1 4 16] [--frames 256 1024 4096]
+
+For every (batch, frames) point prints the median latency of eager
+encoder.QuartzNet, of the fused path and of the fused path under
+TorchScript, plus the largest log-prob difference against eager.
+"""
+import argparse
+import copy
+import warnings
+
+import torch
+
+from encoder import QuartzNet
+from fusion import DEFAULT_TILE, fuse
+from tools.timing import median_ms
+
+
+def latency_ms(model, x, repeat):
+    with torch.no_grad():
+        return median_ms(lambda: model(x), repeat)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch', nargs='+', type=int, default=[1, 4, 16])
+    parser.add_argument('--frames', nargs='+', type=int,
+                        default=[256, 1024, 4096])
+    parser.add_argument('--tile', type=int, default=DEFAULT_TILE)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=None)
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    eager = QuartzNet.from_variables().eval()
+    fused = fuse(copy.deepcopy(eager), args.tile).eval()
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        scripted = torch.jit.script(fused)
+
+    print('threads=%d tile=%d' % (torch.get_num_threads(), args.tile))
+    print('%5s %6s %10s %10s %10s %8s %10s' % (
+        'batch', 'frames', 'eager ms', 'fused ms', 'script ms', 'speedup',
+        'max diff'))
+    for batch in args.batch:
+        for frames in args.frames:
+            x = torch.randn(batch, 64, frames)
+            with torch.no_grad():
+                diff = (eager(x) - fused(x)).abs().max().item()
+            e = latency_ms(eager, x, args.repeat)
+            f = latency_ms(fused, x, args.repeat)
+            s = latency_ms(scripted, x, args.repeat)
+            print('%5d %6d %10.1f %10.1f %10.1f %7.2fx %10.2e' % (
+                batch, frames, e, f, s, e / min(f, s), diff))
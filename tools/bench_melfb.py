@@ -0,0 +1,52 @@
+"""Dense vs banded mel filterbank projection of FilterbankFeatures.
+
+    python -m tools.bench_melfb [--batch 1 32] [--frames 1600]
+
+Prints the band width of the default 64-filter bank, then for every
+batch size the median time of the dense torch.matmul and of
+utils.features.banded_projection on a random power spectrum, and the
+largest difference between them. Also times building a second
+preprocessor, which now reuses the cached filterbank.
+"""
+import argparse
+import time
+
+import torch
+
+from tools.timing import median_ms
+from utils.audio_preprocessing import AudioToMelSpectrogramPreprocessor
+from utils.features import banded_projection
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch', nargs='+', type=int, default=[1, 32])
+    parser.add_argument('--frames', type=int, default=1600)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    t = time.perf_counter()
+    featurizer = AudioToMelSpectrogramPreprocessor().featurizer
+    first = time.perf_counter() - t
+    t = time.perf_counter()
+    AudioToMelSpectrogramPreprocessor()
+    second = time.perf_counter() - t
+    print('preprocessor built in %.1f ms, again in %.1f ms (cached '
+          'filterbank)' % (first * 1e3, second * 1e3))
+
+    fb = featurizer.fb
+    index, weights = featurizer.fb_index, featurizer.fb_weights
+    print('%d filters x %d bins dense, %d bins banded (%.1f%% of the MACs)'
+          % (fb.shape[1], fb.shape[2], weights.shape[1],
+             100. * weights.shape[1] / fb.shape[2]))
+    print('%5s %10s %10s %8s %10s' % ('batch', 'dense ms', 'banded ms',
+                                      'speedup', 'max diff'))
+    for batch in args.batch:
+        x = torch.rand(batch, fb.shape[2], args.frames) ** 2
+        dense = torch.matmul(fb, x)
+        diff = (banded_projection(x, index, weights) - dense).abs().max()
+        d = median_ms(lambda: torch.matmul(fb, x), args.repeat)
+        b = median_ms(lambda: banded_projection(x, index, weights),
+                      args.repeat)
+        print('%5d %10.2f %10.2f %7.2fx %10.2e' % (batch, d, b, d / b,
+                                                    diff.item()))
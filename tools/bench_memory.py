@@ -0,0 +1,74 @@
+"""Peak activation memory of a forward pass per execution mode.
+
+Each (mode, duration) point runs in a fresh interpreter. The model first
+runs on a tiny input so weight pages and allocator pools are warm, then on
+a spectrogram of the requested duration (100 frames per second); the
+reported number is the growth of the peak RSS caused by that forward.
+
+    python -m tools.bench_memory [--seconds 10 60 300] [--modes ...]
+
+Modes: model (generated model.Model), model-planned, quartznet
+(encoder.QuartzNet), quartznet-planned, fused (fusion.fuse).
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+MODES = ['model', 'model-planned', 'quartznet', 'quartznet-planned', 'fused']
+
+
+def build(mode):
+    if mode.startswith('model'):
+        from model import Model
+        model = Model().eval()
+    else:
+        from encoder import QuartzNet
+        model = QuartzNet.from_variables().eval()
+    if mode.endswith('planned'):
+        from planner import plan_memory
+        model = plan_memory(model)
+    if mode == 'fused':
+        from fusion import fuse
+        model = fuse(model)
+    return model
+
+
+def child(mode, seconds):
+    import torch
+    model = build(mode)
+    x = torch.randn(1, 64, int(seconds * 100))
+    with torch.no_grad():
+        model(torch.randn(1, 64, 64))
+        base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        t = time.perf_counter()
+        model(x)
+        elapsed = time.perf_counter() - t
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({'peak_mb': (peak - base) / 1024, 'time_s': elapsed}))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', nargs='+', type=float,
+                        default=[10, 60, 300])
+    parser.add_argument('--modes', nargs='+', default=MODES, choices=MODES)
+    parser.add_argument('--child', nargs=2, default=None,
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child is not None:
+        child(args.child[0], float(args.child[1]))
+        sys.exit(0)
+
+    print('%-18s %8s %14s %10s' % ('mode', 'seconds', 'peak +RSS MB',
+                                   'time s'))
+    for seconds in args.seconds:
+        for mode in args.modes:
+            out = subprocess.check_output(
+                [sys.executable, '-m', 'tools.bench_memory',
+                 '--child', mode, str(seconds)])
+            r = json.loads(out.decode().strip().splitlines()[-1])
+            print('%-18s %8g %14.1f %10.2f' % (mode, seconds, r['peak_mb'],
+                                               r['time_s']))
@@ -0,0 +1,75 @@
+"""Looped vs vectorized utils.features.normalize_batch.
+
+    python -m tools.bench_normalize [--batch 1 32 128] [--frames 1600]
+
+For every batch size and normalize type prints the median time of the
+former per-utterance loop and of the masked implementation, the largest
+difference between them over the valid frames, and the largest
+difference of a torch.jit.trace of the new one run on other lengths
+than it was traced with.
+"""
+import argparse
+
+import torch
+
+from tools.timing import median_ms
+from utils.features import CONSTANT, normalize_batch
+
+
+def normalize_batch_loop(x, seq_len, normalize_type):
+    """The per-utterance loop normalize_batch replaced."""
+    if normalize_type == "per_feature":
+        x_mean = torch.zeros((seq_len.shape[0], x.shape[1]), dtype=x.dtype)
+        x_std = torch.zeros((seq_len.shape[0], x.shape[1]), dtype=x.dtype)
+        for i in range(x.shape[0]):
+            x_mean[i, :] = x[i, :, :seq_len[i]].mean(dim=1)
+            x_std[i, :] = x[i, :, :seq_len[i]].std(dim=1)
+        x_std += CONSTANT
+        return (x - x_mean.unsqueeze(2)) / x_std.unsqueeze(2)
+    x_mean = torch.zeros(seq_len.shape, dtype=x.dtype)
+    x_std = torch.zeros(seq_len.shape, dtype=x.dtype)
+    for i in range(x.shape[0]):
+        x_mean[i] = x[i, :, :seq_len[i].item()].mean()
+        x_std[i] = x[i, :, :seq_len[i].item()].std()
+    x_std += CONSTANT
+    return (x - x_mean.view(-1, 1, 1)) / x_std.view(-1, 1, 1)
+
+
+def valid_diff(a, b, seq_len):
+    return max((a[i, :, :n] - b[i, :, :n]).abs().max().item()
+               for i, n in enumerate(seq_len.tolist()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch', nargs='+', type=int, default=[1, 32, 128])
+    parser.add_argument('--frames', type=int, default=1600)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    print('%12s %5s %10s %10s %8s %10s %10s' % (
+        'type', 'batch', 'loop ms', 'masked ms', 'speedup', 'max diff',
+        'traced'))
+    for normalize_type in ('per_feature', 'all_features'):
+        for batch in args.batch:
+            torch.manual_seed(0)
+            # Log-mel-like values: large offset, small spread.
+            x = torch.randn(batch, 64, args.frames) * 3. - 10.
+            seq_len = torch.randint(args.frames // 4, args.frames + 1,
+                                    (batch,))
+            expected = normalize_batch_loop(x, seq_len, normalize_type)
+            diff = valid_diff(normalize_batch(x, seq_len, normalize_type),
+                              expected, seq_len)
+            traced = torch.jit.trace(
+                lambda x, n: normalize_batch(x, n, normalize_type),
+                (x, seq_len.flip(0)))
+            traced_diff = valid_diff(traced(x, seq_len), expected, seq_len)
+            loop = median_ms(
+                lambda: normalize_batch_loop(x, seq_len, normalize_type),
+                args.repeat)
+            masked = median_ms(
+                lambda: normalize_batch(x, seq_len, normalize_type),
+                args.repeat)
+            print('%12s %5d %10.2f %10.2f %7.1fx %10.2e %10.2e' % (
+                normalize_type, batch, loop, masked, loop / masked, diff,
+                traced_diff))
@@ -0,0 +1,86 @@
+"""Eager model.Model vs ONNX Runtime on the local export.
+
+    python -m tools.bench_onnx [--batch 1 8] [--frames 512 2048]
+        [--tune_threads]
+
+Exports model.Model to onnx/ (unless already there, see
+tools/export_model.py --source model) and compares, per (batch, frames):
+eager PyTorch, a plain InferenceSession on the raw export with
+session.run(), and a pooled session on the optimized export running
+through IOBinding. Prints session creation time, median latency,
+throughput in audio seconds per wall second (100 frames per second) and
+the largest difference against eager. --tune_threads first measures the
+(intra_op, inter_op) thread counts and uses the fastest.
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import torch
+
+from model import Model
+from onnx_sessions import create_session, get_session, tune_threads
+from tools.export_model import export_local
+from tools.timing import median_ms
+
+FRAMES_PER_SECOND = 100
+
+
+def timed(fn):
+    t = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - t
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch', nargs='+', type=int, default=[1, 8])
+    parser.add_argument('--frames', nargs='+', type=int, default=[512, 2048])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default=os.path.join('onnx', 'model.onnx'))
+    parser.add_argument('--tune_threads', action='store_true')
+    args = parser.parse_args()
+
+    raw = args.output
+    optimized = os.path.splitext(raw)[0] + '.opt.onnx'
+    if not os.path.exists(optimized):
+        os.makedirs(os.path.dirname(os.path.abspath(raw)), exist_ok=True)
+        export_local(raw, 'model')
+
+    model = Model().eval()
+    threads = (0, 0)
+    if args.tune_threads:
+        x = np.random.randn(args.batch[0], 64, args.frames[0])
+        threads, latencies = tune_threads(
+            optimized, {'audio_signal': x.astype(np.float32)})
+        for pair, seconds in sorted(latencies.items()):
+            print('intra_op %2d inter_op %d: %8.1f ms' % (
+                pair + (seconds * 1000,)))
+        print('using intra_op %d inter_op %d' % threads)
+
+    plain, plain_s = timed(lambda: create_session(raw, *threads))
+    pooled, pooled_s = timed(lambda: get_session(optimized, *threads))
+    print('session creation: raw %.2f s, optimized %.2f s' % (plain_s,
+                                                               pooled_s))
+    print('%5s %6s %16s %10s %10s %10s' % (
+        'batch', 'frames', 'runner', 'ms', 'audio s/s', 'max diff'))
+    for batch in args.batch:
+        for frames in args.frames:
+            x = torch.randn(batch, 64, frames)
+            feeds = {'audio_signal': x.numpy()}
+            with torch.no_grad():
+                expected = model(x).numpy()
+            runners = [
+                ('eager', lambda: model(x).numpy()),
+                ('ort run', lambda: plain.run(None, feeds)[0]),
+                ('ort pooled+bind', lambda: pooled.run(feeds)[0]),
+            ]
+            audio = batch * frames / FRAMES_PER_SECOND
+            for name, fn in runners:
+                with torch.no_grad():
+                    diff = np.abs(fn() - expected).max()
+                    seconds = median_ms(fn, args.repeat) / 1000
+                print('%5d %6d %16s %10.1f %10.1f %10.2e' % (
+                    batch, frames, name, seconds * 1000, audio / seconds,
+                    diff))
@@ -0,0 +1,73 @@
+"""fp32 vs reduced-precision (precision.to_precision) QuartzNet on CPU.
+
+    python -m tools.bench_precision [--precision bf16 fp16]
+        [--manifest test.json] [--subset_len 100]
+        [--batch 1 4 16] [--frames 512 2048]
+
+With --manifest, first runs precision.accuracy_check() for every
+precision and reports WER against fp32, the number of utterances whose
+greedy transcript changed and the largest log-prob difference; a
+precision whose WER rises by more than --max_wer_increase is marked
+FAIL. Then prints, for every (batch, frames) point, the median latency
+of fp32 and of each supported precision and its speedup.
+"""
+import argparse
+
+import torch
+
+from encoder import QuartzNet
+from precision import accuracy_check, supported, to_precision
+from tools.bench_fused import latency_ms
+from utils.feature_cache import cached_feature_batches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--precision', nargs='+', default=['bf16', 'fp16'],
+                        choices=['bf16', 'fp16'])
+    parser.add_argument('--manifest', default=None)
+    parser.add_argument('--subset_len', type=int, default=None)
+    parser.add_argument('--max_wer_increase', type=float, default=0.005)
+    parser.add_argument('--batch', nargs='+', type=int, default=[1, 4, 16])
+    parser.add_argument('--frames', nargs='+', type=int,
+                        default=[512, 2048])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=None)
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    reference = QuartzNet.from_variables().eval()
+    models = {}
+    for precision in args.precision:
+        if supported(precision):
+            models[precision] = to_precision(
+                QuartzNet.from_variables().eval(), precision)
+        else:
+            print('%s: not supported on this CPU / build' % precision)
+
+    if args.manifest:
+        batches = cached_feature_batches(args.manifest, 8, args.subset_len)
+        print('%6s %8s %8s %8s %10s %10s %6s' % (
+            'model', 'WER fp32', 'WER', 'dWER', 'changed', 'max diff',
+            'check'))
+        for precision, model in models.items():
+            r = accuracy_check(reference, model, batches,
+                               args.max_wer_increase)
+            print('%6s %8.4f %8.4f %+8.4f %4d / %-4d %10.2e %6s' % (
+                precision, r['wer_fp32'], r['wer'], r['delta_wer'],
+                r['changed'], r['utterances'], r['max_diff'],
+                'ok' if r['passed'] else 'FAIL'))
+
+    print('threads=%d' % torch.get_num_threads())
+    print('%5s %6s %10s' % ('batch', 'frames', 'fp32 ms') + ''.join(
+        ' %10s %8s' % (p + ' ms', 'speedup') for p in models))
+    for batch in args.batch:
+        for frames in args.frames:
+            x = torch.randn(batch, 64, frames)
+            base = latency_ms(reference, x, args.repeat)
+            line = '%5d %6d %10.1f' % (batch, frames, base)
+            for model in models.values():
+                t = latency_ms(model, x, args.repeat)
+                line += ' %10.1f %7.2fx' % (t, base / t)
+            print(line)
@@ -0,0 +1,191 @@
+"""End-to-end real-time factor of WAV -> features -> model -> transcript.
+
+    python -m tools.bench_rtf [--backends eager onnxruntime]
+        [--batch 1 8] [--seconds 5 20] [--threads 1 4] [--repeat 10]
+        [--output rtf.json] [--baseline rtf_before.json]
+
+Utterances of each --seconds length are synthesized by looping the
+bundled recordings and written as WAVs, so every run times all four
+stages separately: WAV decode (AudioSegment.from_file), featurization
+(AudioToMelSpectrogramPreprocessor.get_features), the model
+(engine.run) and greedy CTC decode (post_process_predictions).
+
+For every (backend, threads, batch, seconds) point it reports the
+real-time factor (median wall seconds per audio second), p50/p95/p99
+end-to-end latency, the median of every stage and the throughput in
+audio hours per CPU hour (process CPU time, so it accounts for all
+threads). --output saves the results as JSON; --baseline compares
+against such a file and prints the relative change of RTF and p50.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+
+import numpy as np
+import soundfile as sf
+import torch
+
+from engine import ENGINES, create_engine
+from utils.audio_preprocessing import AudioToMelSpectrogramPreprocessor
+from utils.common import post_process_predictions
+from utils.evaluation import VOCAB
+from utils.segment import AudioSegment
+
+SAMPLE_RATE = 16000
+STAGES = ('decode', 'features', 'model', 'ctc')
+WAVS = ['116-288045-0000.wav', '116-288045-0001.wav']
+
+
+def percentile(values, q):
+    """Nearest-rank percentile."""
+    values = sorted(values)
+    return values[max(0, math.ceil(q / 100. * len(values)) - 1)]
+
+
+def synthesize(wavs, seconds, count, directory):
+    """Writes `count` WAVs of `seconds` each, looping the samples of `wavs`
+    from a different start for every file; returns their paths."""
+    audio = np.concatenate([
+        AudioSegment.from_file(w, target_sr=SAMPLE_RATE).samples
+        for w in wavs])
+    n = int(seconds * SAMPLE_RATE)
+    paths = []
+    for i in range(count):
+        start = i * len(audio) // max(count, 1)
+        samples = np.take(audio, np.arange(start, start + n), mode='wrap')
+        path = os.path.join(directory, '%gs-%d.wav' % (seconds, i))
+        sf.write(path, samples, SAMPLE_RATE)
+        paths.append(path)
+    return paths
+
+
+def transcribe(engine, preprocessor, paths):
+    """Runs the pipeline on one batch; returns per-stage seconds."""
+    times = {}
+    t = time.perf_counter()
+    signals = [torch.from_numpy(AudioSegment.from_file(
+        p, target_sr=SAMPLE_RATE).samples).float() for p in paths]
+    times['decode'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    length = torch.tensor([len(s) for s in signals])
+    batch = torch.zeros(len(signals), int(length.max()))
+    for i, s in enumerate(signals):
+        batch[i, :len(s)] = s
+    features = preprocessor.get_features(batch, length)
+    lengths = preprocessor.get_seq_len(length.float())
+    times['features'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    out = engine.run(features, lengths)
+    times['model'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    predictions = out.argmax(dim=-1)
+    out_lengths = engine.output_lengths(lengths).tolist()
+    for i, n in enumerate(out_lengths):
+        post_process_predictions([predictions[i, :n].unsqueeze(0)], VOCAB)
+    times['ctc'] = time.perf_counter() - t
+    return times
+
+
+def measure(engine, preprocessor, paths, seconds, threads, repeat):
+    transcribe(engine, preprocessor, paths)
+    runs = []
+    cpu = time.process_time()
+    for _ in range(repeat):
+        runs.append(transcribe(engine, preprocessor, paths))
+    cpu = time.process_time() - cpu
+    totals = [sum(r.values()) for r in runs]
+    audio = seconds * len(paths)
+    return {'rtf': statistics.median(totals) / audio,
+            'p50_ms': percentile(totals, 50) * 1e3,
+            'p95_ms': percentile(totals, 95) * 1e3,
+            'p99_ms': percentile(totals, 99) * 1e3,
+            'stages_ms': {s: statistics.median(r[s] for r in runs) * 1e3
+                          for s in STAGES},
+            'audio_hours_per_cpu_hour': audio * repeat / cpu if cpu else 0.}
+
+
+def compare(results, baseline):
+    keys = ('backend', 'threads', 'batch', 'seconds')
+    before = {tuple(r[k] for k in keys): r for r in baseline['results']}
+    print('against baseline (%s):' % baseline['machine']['node'])
+    for r in results:
+        b = before.get(tuple(r[k] for k in keys))
+        if b is None:
+            continue
+        print('%12s %7d %5d %7g  RTF %+6.1f%%  p50 %+6.1f%%' % (
+            r['backend'], r['threads'], r['batch'], r['seconds'],
+            100. * (r['rtf'] / b['rtf'] - 1),
+            100. * (r['p50_ms'] / b['p50_ms'] - 1)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backends', nargs='+', default=['eager'],
+                        choices=sorted(ENGINES))
+    parser.add_argument('--batch', nargs='+', type=int, default=[1, 8])
+    parser.add_argument('--seconds', nargs='+', type=float,
+                        default=[5., 20.])
+    parser.add_argument('--threads', nargs='+', type=int,
+                        default=[torch.get_num_threads()])
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--wavs', nargs='+', default=WAVS)
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--baseline', default=None)
+    args = parser.parse_args()
+
+    preprocessor = AudioToMelSpectrogramPreprocessor(sample_rate=SAMPLE_RATE)
+    workdir = tempfile.mkdtemp(prefix='bench_rtf-')
+    inputs = {s: synthesize(args.wavs, s, max(args.batch), workdir)
+              for s in args.seconds}
+    results = []
+    print('%12s %7s %5s %7s %8s %9s %9s %9s' % (
+        'backend', 'threads', 'batch', 'seconds', 'RTF', 'p50 ms', 'p95 ms',
+        'p99 ms') + ''.join(' %9s' % (s + ' ms') for s in STAGES) +
+        ' %10s' % 'audio h/h')
+    for backend in args.backends:
+        for threads in args.threads:
+            torch.set_num_threads(threads)
+            options = {'intra_op_threads': threads} \
+                if backend == 'onnxruntime' else {}
+            try:
+                engine = create_engine(backend, **options)
+            except ImportError as e:
+                print('%12s skipped: %s' % (backend, e))
+                break
+            for batch in args.batch:
+                for seconds in args.seconds:
+                    r = measure(engine, preprocessor,
+                                inputs[seconds][:batch], seconds, threads,
+                                args.repeat)
+                    r.update(backend=backend, threads=threads, batch=batch,
+                             seconds=seconds)
+                    results.append(r)
+                    print('%12s %7d %5d %7g %8.4f %9.1f %9.1f %9.1f' % (
+                        backend, threads, batch, seconds, r['rtf'],
+                        r['p50_ms'], r['p95_ms'], r['p99_ms']) + ''.join(
+                            ' %9.1f' % r['stages_ms'][s] for s in STAGES) +
+                        ' %10.1f' % r['audio_hours_per_cpu_hour'])
+    shutil.rmtree(workdir)
+
+    report = {'machine': {'node': platform.node(),
+                          'processor': platform.processor(),
+                          'cpu_count': os.cpu_count(),
+                          'torch': torch.__version__},
+              'repeat': args.repeat,
+              'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print('wrote %s' % args.output)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
@@ -0,0 +1,55 @@
+"""WER vs sparsity vs latency of magnitude-pruned QuartzNet on CPU.
+
+    python -m tools.bench_sparsity --manifest test.json [--subset_len 100]
+        [--sparsity 0 0.5 0.7 0.8 0.9] [--block 1 1]
+        [--batch 1 8] [--frames 1024]
+
+For every sparsity level prunes a fresh model (sparsity.prune), reports
+its WER on --manifest, and the median latency of the pruned model run
+dense and sparse (sparsity.sparsify) at every (batch, frames) point, so
+the deployable point is the sparsest one whose WER is still acceptable
+and whose sparse latency beats dense.
+"""
+import argparse
+
+import torch
+
+from encoder import QuartzNet
+from sparsity import prune, sparsify
+from tools.bench_fused import latency_ms
+from utils.evaluation import evaluate
+from utils.feature_cache import cached_feature_batches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--manifest', required=True)
+    parser.add_argument('--subset_len', type=int, default=None)
+    parser.add_argument('--sparsity', nargs='+', type=float,
+                        default=[0., 0.5, 0.7, 0.8, 0.9])
+    parser.add_argument('--block', nargs=2, type=int, default=[1, 1])
+    parser.add_argument('--batch', nargs='+', type=int, default=[1, 8])
+    parser.add_argument('--frames', nargs='+', type=int, default=[1024])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=None)
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    batches = cached_feature_batches(args.manifest, 8, args.subset_len)
+    inputs = [torch.randn(batch, 64, frames)
+              for batch in args.batch for frames in args.frames]
+    print('threads=%d' % torch.get_num_threads())
+    print('%8s %8s' % ('sparsity', 'WER') + ''.join(
+        ' %16s %16s' % ('dense %dx%d ms' % x.shape[::2],
+                        'sparse %dx%d ms' % x.shape[::2]) for x in inputs))
+    for sparsity in args.sparsity:
+        model = prune(QuartzNet.from_variables().eval(), sparsity,
+                      tuple(args.block))
+        wer = evaluate(model, None, pass_lengths=True, batches=batches)['wer']
+        dense = [latency_ms(model, x, args.repeat) for x in inputs]
+        sparsify(model)
+        line = '%8.2f %8.4f' % (sparsity, wer)
+        for x, d in zip(inputs, dense):
+            line += ' %16.1f %16.1f' % (d, latency_ms(model, x, args.repeat))
+        print(line)
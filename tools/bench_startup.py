@@ -0,0 +1,80 @@
+"""Cold start and memory benchmark for Model weight loading.
+
+Every measurement runs in a fresh interpreter so import caches and the
+allocator state of one mode cannot leak into the other:
+
+    python -m tools.bench_startup [--repeat 5]
+
+Reports construction time, RSS and PSS after Model() and after a first
+forward pass, for variables/*.npy and for the packed variables.qnw.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from utils.weights import ARCHIVE_PATH, VARIABLES_DIR, pack_variables
+
+
+def memory_kb():
+    """Returns (rss, pss) of the current process in kB."""
+    fields = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ('Rss:', 'Pss:'):
+                fields[parts[0][:-1]] = int(parts[1])
+    return fields['Rss'], fields['Pss']
+
+
+def child(weights):
+    import torch
+    base = memory_kb()
+    t = time.perf_counter()
+    from model import Model
+    model = Model(weights).eval()
+    init_time = time.perf_counter() - t
+    built = memory_kb()
+    with torch.no_grad():
+        model(torch.zeros(1, 64, 256))
+    ran = memory_kb()
+    print(json.dumps({
+        'init_s': init_time,
+        'rss_init_mb': (built[0] - base[0]) / 1024,
+        'pss_init_mb': (built[1] - base[1]) / 1024,
+        'rss_forward_mb': (ran[0] - base[0]) / 1024,
+        'pss_forward_mb': (ran[1] - base[1]) / 1024,
+    }))
+
+
+def run(weights, repeat):
+    results = []
+    for _ in range(repeat):
+        out = subprocess.check_output(
+            [sys.executable, '-m', 'tools.bench_startup', '--child', weights])
+        results.append(json.loads(out.decode().strip().splitlines()[-1]))
+    return {k: statistics.median(r[k] for r in results) for k in results[0]}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', default=5, type=int)
+    parser.add_argument('--child', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child is not None:
+        child(args.child)
+        sys.exit(0)
+
+    if not os.path.exists(ARCHIVE_PATH):
+        pack_variables(VARIABLES_DIR, ARCHIVE_PATH)
+    print('%-8s %9s %13s %13s %13s %13s' % (
+        'weights', 'init ms', 'RSS init MB', 'PSS init MB',
+        'RSS fwd MB', 'PSS fwd MB'))
+    for name, weights in (('npy', VARIABLES_DIR), ('archive', ARCHIVE_PATH)):
+        r = run(weights, args.repeat)
+        print('%-8s %9.1f %13.1f %13.1f %13.1f %13.1f' % (
+            name, r['init_s'] * 1000, r['rss_init_mb'], r['pss_init_mb'],
+            r['rss_forward_mb'], r['pss_forward_mb']))
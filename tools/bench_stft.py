@@ -0,0 +1,51 @@
+"""STFT engines of FilterbankFeatures: conv basis, torch.stft and rfft.
+
+    python -m tools.bench_stft [--batch 1 32] [--seconds 5 20]
+
+For every batch size and utterance length prints the median time of the
+featurizer with each stft_engine, the largest difference of its features
+from the default conv engine, and the engine stft_engine="auto" picks
+there. Also prints the size of the conv basis the other engines do
+without.
+"""
+import argparse
+
+import torch
+
+from tools.timing import median_ms
+from utils.audio_preprocessing import AudioToMelSpectrogramPreprocessor
+from utils.features import STFT_ENGINES
+
+SAMPLE_RATE = 16000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch', nargs='+', type=int, default=[1, 32])
+    parser.add_argument('--seconds', nargs='+', type=float,
+                        default=[5., 20.])
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    featurizers = {engine: AudioToMelSpectrogramPreprocessor(
+        sample_rate=SAMPLE_RATE, stft_engine=engine).featurizer.eval()
+        for engine in STFT_ENGINES + ('auto',)}
+    basis = featurizers['conv'].stft_basis
+    print('conv basis: %s, %.1f MB' % (
+        list(basis.shape), basis.numel() * basis.element_size() / 2 ** 20))
+    print('%5s %7s' % ('batch', 'seconds') + ''.join(
+        ' %10s' % (e + ' ms') for e in STFT_ENGINES) + ''.join(
+        ' %10s' % (e + ' diff') for e in STFT_ENGINES[1:]) + ' %6s' % 'auto')
+    for batch in args.batch:
+        for seconds in args.seconds:
+            torch.manual_seed(0)
+            signal = torch.randn(batch, int(seconds * SAMPLE_RATE)) * 0.1
+            length = torch.full((batch,), signal.shape[1])
+            out = {e: f(signal, length) for e, f in featurizers.items()}
+            times = {e: median_ms(lambda: featurizers[e](signal, length),
+                                  args.repeat) for e in STFT_ENGINES}
+            print('%5d %7g' % (batch, seconds) + ''.join(
+                ' %10.2f' % times[e] for e in STFT_ENGINES) + ''.join(
+                ' %10.2e' % (out[e] - out['conv']).abs().max().item()
+                for e in STFT_ENGINES[1:]) + ' %6s' %
+                featurizers['auto'].stft_engine_for(signal))
@@ -0,0 +1,93 @@
+"""Streaming vs offline featurization of the bundled wavs.
+
+    python -m tools.bench_stream_features [--chunk-ms 20 80 320]
+        [--normalization none running window] [--stats-frames 400]
+
+The two bundled utterances (concatenated) are fed to
+utils.features.StreamingFeatures chunk by chunk. For every (chunk,
+normalization) pair prints p50/p95 time per chunk and the median of the
+first and last quarter of the stream (equal if the cost per chunk stays
+constant), the largest difference against the offline features (without
+normalization for "none"), the mean difference over the first second and
+the WER of QuartzNet on the streamed features against the offline
+transcript.
+"""
+import argparse
+import statistics
+import time
+
+import numpy as np
+import torch
+
+from encoder import QuartzNet
+from utils.audio_preprocessing import AudioToMelSpectrogramPreprocessor
+from utils.common import post_process_predictions, word_error_rate
+from utils.evaluation import VOCAB
+from utils.features import StreamingFeatures
+from utils.segment import AudioSegment
+
+SAMPLE_RATE = 16000
+WAVS = ['116-288045-0000.wav', '116-288045-0001.wav']
+
+
+def transcript(model, features):
+    with torch.no_grad():
+        logprobs = model(features)
+    return post_process_predictions([logprobs.argmax(-1)], VOCAB)[0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunk-ms', nargs='+', type=int,
+                        default=[20, 80, 320])
+    parser.add_argument('--normalization', nargs='+',
+                        default=['none', 'running', 'window'])
+    parser.add_argument('--stats-frames', type=int, default=400)
+    parser.add_argument('--wavs', nargs='+', default=WAVS)
+    args = parser.parse_args()
+
+    samples = np.concatenate([
+        AudioSegment.from_file(p, target_sr=SAMPLE_RATE).samples
+        for p in args.wavs])
+    signal = torch.tensor(samples, dtype=torch.float).unsqueeze(0)
+    length = torch.tensor([signal.shape[1]])
+    offline = {}
+    for normalize in ('per_feature', None):
+        featurizer = AudioToMelSpectrogramPreprocessor(
+            sample_rate=SAMPLE_RATE, normalize=normalize).featurizer.eval()
+        frames = int(featurizer.get_seq_len(length.float()))
+        offline[normalize] = (featurizer,
+                              featurizer(signal, length)[:, :, :frames])
+    model = QuartzNet.from_variables().eval()
+    reference = transcript(model, offline['per_feature'][1])
+    print('%d frames, offline: %s' % (frames, reference))
+
+    print('%8s %13s %8s %8s %9s %9s %10s %10s %6s' % (
+        'chunk ms', 'normalization', 'p50 ms', 'p95 ms', 'first ms',
+        'last ms', 'max diff', '1st s diff', 'WER'))
+    for chunk_ms in args.chunk_ms:
+        chunk = chunk_ms * SAMPLE_RATE // 1000
+        for normalization in args.normalization:
+            normalize = None if normalization == 'none' else 'per_feature'
+            featurizer, expected = offline[normalize]
+            stream = StreamingFeatures(
+                featurizer, None if normalization == 'none' else
+                normalization, args.stats_frames)
+            outs, times = [], []
+            for t in range(0, signal.shape[1], chunk):
+                start = time.perf_counter()
+                outs.append(stream.step(signal[:, t:t + chunk]))
+                times.append(time.perf_counter() - start)
+            outs.append(stream.flush())
+            streamed = torch.cat(outs, dim=-1)
+            diff = (streamed - expected).abs()
+            quarter = max(len(times) // 4, 1)
+            wer = word_error_rate(
+                [transcript(model, streamed)], [reference]) \
+                if normalize else float('nan')
+            print('%8d %13s %8.2f %8.2f %9.2f %9.2f %10.2e %10.2e %6.3f' % (
+                chunk_ms, normalization, statistics.median(times) * 1000,
+                np.percentile(times, 95) * 1000,
+                statistics.median(times[:quarter]) * 1000,
+                statistics.median(times[-quarter:]) * 1000,
+                diff.max().item(), diff[:, :, :100].mean().item(), wer))
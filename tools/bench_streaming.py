@@ -0,0 +1,75 @@
+"""Streaming vs offline QuartzNet on the bundled wavs.
+
+    python -m tools.bench_streaming [--chunk 16 32 64] [--lookahead full 0 4 16]
+
+Features of the two bundled utterances (concatenated) are fed to
+streaming.StreamingQuartzNet chunk by chunk. For every (chunk, lookahead)
+pair prints the algorithmic latency (chunk + look-ahead), p50/p95 compute
+time per chunk, the largest log-prob difference against offline inference
+and the WER of the streamed greedy transcript against the offline one.
+"""
+import argparse
+import statistics
+import time
+
+import numpy as np
+import torch
+
+from encoder import QuartzNet
+from streaming import StreamingQuartzNet
+from utils.audio_preprocessing import AudioToMelSpectrogramPreprocessor
+from utils.common import post_process_predictions, word_error_rate
+from utils.evaluation import VOCAB
+from utils.segment import AudioSegment
+
+WAVS = ['116-288045-0000.wav', '116-288045-0001.wav']
+FRAME_MS = 10
+
+
+def load_features(paths):
+    samples = np.concatenate([AudioSegment.from_file(p, target_sr=16000).samples
+                              for p in paths])
+    signal = torch.tensor(samples, dtype=torch.float).unsqueeze(0)
+    preprocessor = AudioToMelSpectrogramPreprocessor(sample_rate=16000)
+    return preprocessor.get_features(signal, torch.tensor([signal.shape[1]]))
+
+
+def transcript(logprobs):
+    return post_process_predictions([logprobs.argmax(-1)], VOCAB)[0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunk', nargs='+', type=int, default=[16, 32, 64],
+                        help='chunk sizes in feature frames (10 ms each)')
+    parser.add_argument('--lookahead', nargs='+', default=['full', '0', '4',
+                                                            '16'])
+    args = parser.parse_args()
+
+    model = QuartzNet.from_variables().eval()
+    features = load_features(WAVS)
+    with torch.no_grad():
+        offline = model(features)
+    reference = transcript(offline)
+    print('%d frames, offline: %s' % (features.shape[-1], reference))
+
+    print('%6s %9s %12s %8s %8s %10s %6s' % (
+        'chunk', 'lookahead', 'latency ms', 'p50 ms', 'p95 ms', 'max diff',
+        'WER'))
+    for chunk in args.chunk:
+        for la in args.lookahead:
+            stream = StreamingQuartzNet(model,
+                                        None if la == 'full' else int(la))
+            outs, times = [], []
+            for t in range(0, features.shape[-1], chunk):
+                start = time.perf_counter()
+                outs.append(stream.step(features[:, :, t:t + chunk]))
+                times.append(time.perf_counter() - start)
+            outs.append(stream.flush())
+            streamed = torch.cat(outs, dim=1)
+            diff = (streamed - offline).abs().max().item()
+            wer = word_error_rate([transcript(streamed)], [reference])
+            latency = (chunk + stream.lookahead_frames) * FRAME_MS
+            print('%6d %9s %12d %8.1f %8.1f %10.2e %6.3f' % (
+                chunk, la, latency, statistics.median(times) * 1000,
+                np.percentile(times, 95) * 1000, diff, wer))
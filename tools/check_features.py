@@ -0,0 +1,65 @@
+"""Torch vs NumPy log path of FilterbankFeatures on the bundled wavs.
+
+    python -m tools.check_features [--wavs a.wav b.wav] [--repeat 10]
+
+Prints which log implementation this machine picks by default, the
+largest difference between the "torch" and "numpy" featurizers, their
+median featurization time, and whether a torch.jit.trace of the torch
+path, traced on a shorter input, reproduces eager featurization of every
+utterance ("inf" if the shapes differ).
+"""
+import argparse
+
+import torch
+
+from tools.timing import median_ms
+from utils.audio_preprocessing import AudioToMelSpectrogramPreprocessor
+from utils.features import default_log_impl, torch_log_is_accurate
+from utils.segment import AudioSegment
+
+WAVS = ['116-288045-0000.wav', '116-288045-0001.wav']
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--wavs', nargs='+', default=WAVS)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    print('torch.log accurate: %s, default log_impl: %s' % (
+        torch_log_is_accurate(), default_log_impl()))
+    featurizers = {impl: AudioToMelSpectrogramPreprocessor(
+        sample_rate=16000, log_impl=impl).featurizer.eval()
+        for impl in ('torch', 'numpy')}
+    signals = []
+    for path in args.wavs:
+        samples = AudioSegment.from_file(path, target_sr=16000).samples
+        signals.append((path, torch.tensor(samples,
+                                           dtype=torch.float).unsqueeze(0)))
+    # Traced on a prefix whose frame count has another remainder mod 16
+    # than every full utterance, so shape logic baked into the trace (the
+    # pad_to padding) shows up as a mismatch on the others.
+    hop = featurizers['torch'].hop_length
+    frames = {s.shape[1] // hop for _, s in signals}
+    cut = min(frames) - 1
+    while cut % 16 in {f % 16 for f in frames}:
+        cut -= 1
+    example = signals[0][1][:, :cut * hop]
+    with torch.no_grad():
+        traced = torch.jit.trace(featurizers['torch'],
+                                 (example, torch.tensor([example.shape[1]])))
+    print('traced on %d samples' % example.shape[1])
+    print('%-24s %10s %10s %10s %10s' % (
+        'wav', 'max diff', 'torch ms', 'numpy ms', 'traced'))
+    for path, signal in signals:
+        length = torch.tensor([signal.shape[1]])
+        out = {impl: f(signal, length) for impl, f in featurizers.items()}
+        diff = (out['torch'] - out['numpy']).abs().max().item()
+        times = {impl: median_ms(lambda: f(signal, length), args.repeat)
+                 for impl, f in featurizers.items()}
+        with torch.no_grad():
+            replay = traced(signal, length)
+        traced_diff = (replay - out['torch']).abs().max().item() \
+            if replay.shape == out['torch'].shape else float('inf')
+        print('%-24s %10.2e %10.2f %10.2f %10.2e' % (
+            path, diff, times['torch'], times['numpy'], traced_diff))
@@ -0,0 +1,76 @@
+"""Parity of longform.transcribe_long against full-sequence inference.
+
+The bundled wavs are concatenated (--repeat times) into one recording and
+transcribed both in one forward pass and window by window:
+
+    python -m tools.check_longform [--repeat 8] [--window 2000]
+        [--context full 1000 400]
+
+With the full receptive field as context the stitched log-probs must match
+the full-sequence ones; shorter contexts report how far they drift. The
+pass/fail version of these checks is test_longform.py.
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from encoder import QuartzNet
+from longform import _spans, long_features, transcribe_long
+from utils.audio_preprocessing import AudioToMelSpectrogramPreprocessor
+from utils.common import post_process_predictions, word_error_rate
+from utils.evaluation import VOCAB
+from utils.segment import AudioSegment
+
+WAVS = ['116-288045-0000.wav', '116-288045-0001.wav']
+
+
+def transcript(logprobs):
+    return post_process_predictions([logprobs.argmax(-1)], VOCAB)[0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=8)
+    parser.add_argument('--window', type=int, default=2000)
+    parser.add_argument('--context', nargs='+', default=['full', '1000', '400'])
+    parser.add_argument('--batch_size', type=int, default=4)
+    parser.add_argument('--atol', type=float, default=1e-3)
+    args = parser.parse_args()
+
+    samples = np.concatenate(
+        [AudioSegment.from_file(p, target_sr=16000).samples for p in WAVS]
+        * args.repeat)
+    signal = torch.tensor(samples, dtype=torch.float).unsqueeze(0)
+    preprocessor = AudioToMelSpectrogramPreprocessor(sample_rate=16000)
+    features = preprocessor.get_features(signal, torch.tensor([signal.shape[1]]))
+    chunked = long_features(preprocessor, signal)
+    print('chunked featurization max diff: %.2e' % (
+        (chunked - features).abs().max().item()))
+
+    model = QuartzNet.from_variables().eval()
+    t = time.perf_counter()
+    with torch.no_grad():
+        full = model(features)
+    full_time = time.perf_counter() - t
+    reference = transcript(full)
+    length = features.shape[-1]
+    print('%.1f s of audio, %d frames, full sequence: %.2f s' % (
+        len(samples) / 16000, length, full_time))
+
+    print('%8s %8s %10s %10s %8s' % ('context', 'windows', 'max diff',
+                                     'WER', 'time s'))
+    for c in args.context:
+        context = model.encoder.receptive_field() if c == 'full' else int(c)
+        spans = _spans(length, args.window, context, model.encoder.stride)
+        t = time.perf_counter()
+        stitched = transcribe_long(model, features, args.window, context,
+                                   args.batch_size)
+        elapsed = time.perf_counter() - t
+        diff = (stitched - full).abs().max().item()
+        wer = word_error_rate([transcript(stitched)], [reference])
+        windows = len(spans) if length > args.window + 2 * context else 1
+        print('%8s %8d %10.2e %10.3f %8.2f' % (c, windows, diff, wer, elapsed))
+        if c == 'full':
+            assert diff <= args.atol, 'stitching with full context diverged'
@@ -1,3 +1,6 @@
+import argparse
+import os
+
 import numpy as np
 
 
@@ -8,9 +11,48 @@ def export_from_nemo(path, name):
     quartznet.trainning = False
     quartznet.export(path, onnx_opset_version=9)
 
+
+def export_local(path, source='model', opset=None, optimization='extended'):
+    """Exports the local model.Model (or encoder.QuartzNet, which adds a
+    lengths input) with dynamic batch/time axes, then serializes the graph
+    ONNX Runtime optimizes it into next to it.
+
+    Returns:
+        (exported path, optimized path)
+    """
+    from onnx_sessions import DEFAULT_OPSET, export_onnx, optimize_onnx
+    if source == 'model':
+        from model import Model
+        model = Model()
+    else:
+        from encoder import QuartzNet
+        model = QuartzNet.from_variables()
+    export_onnx(model, path, opset or DEFAULT_OPSET)
+    return path, optimize_onnx(path, optimization=optimization)
+
+
 if __name__ == "__main__":
-    path = '../onnx_quartznet.onnx'
-    name = 'QuartzNet15x5Base-En'    
-    print('Converting nemo {} model to {}'.format(path, name))
-    export_from_nemo(path, name)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--source', default='nemo',
+                        choices=['nemo', 'model', 'quartznet'],
+                        help='re-export from NeMo, or export the local '
+                        'model.Model / encoder.QuartzNet')
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--opset', type=int, default=None)
+    parser.add_argument('--optimization', default='extended',
+                        choices=['basic', 'extended', 'all'])
+    args = parser.parse_args()
+
+    if args.source == 'nemo':
+        path = args.output or '../onnx_quartznet.onnx'
+        name = 'QuartzNet15x5Base-En'
+        print('Converting nemo {} model to {}'.format(path, name))
+        export_from_nemo(path, name)
+    else:
+        path = args.output or os.path.join('onnx', args.source + '.onnx')
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        print('Exporting local {} to {}'.format(args.source, path))
+        path, optimized = export_local(path, args.source, args.opset,
+                                       args.optimization)
+        print('Optimized graph: {}'.format(optimized))
     print('Successfully exported.')
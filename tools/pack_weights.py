@@ -0,0 +1,33 @@
+"""Packs variables/*.npy into the single memory-mapped weight archive.
+
+Run from the repository root:
+
+    python -m tools.pack_weights [--src variables] [--out variables.qnw]
+
+Model() picks up variables.qnw automatically once it exists.
+"""
+import argparse
+
+import torch
+
+from utils.weights import (ARCHIVE_PATH, VARIABLES_DIR, load_archive,
+                           load_npy_dir, pack_variables)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--src', default=VARIABLES_DIR,
+                        help='directory holding the exported .npy variables')
+    parser.add_argument('--out', default=ARCHIVE_PATH,
+                        help='destination of the packed archive')
+    args = parser.parse_args()
+
+    index = pack_variables(args.src, args.out)
+    print('Packed {} tensors into {}'.format(len(index["tensors"]), args.out))
+
+    # Round trip check, the archive must reproduce the .npy files exactly
+    src = load_npy_dir(args.src)
+    packed = load_archive(args.out)
+    assert src.keys() == packed.keys()
+    for name, v in src.items():
+        assert v.dtype == packed[name].dtype and torch.equal(v, packed[name]), name
+    print('Verified.')
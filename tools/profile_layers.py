@@ -0,0 +1,57 @@
+"""Per-layer profile of model.Model or encoder.QuartzNet on CPU.
+
+    python -m tools.profile_layers [--model model|quartznet] [--batch 1]
+        [--frames 1024] [--repeat 3] [--by layer|block] [--top 30]
+        [--trace quartznet_trace.json]
+
+Runs one warm-up forward without hooks, then times --repeat forwards
+without hooks and --repeat forwards under profiler.LayerProfiler (mean
+per forward, so the two show the profiler overhead), and prints the time, MACs, output bytes and peak
+memory of every conv and relu/add group (or QuartzNet block), slowest
+first. --trace also writes a Chrome trace of the profiled forwards.
+"""
+import argparse
+import time
+
+import torch
+
+from encoder import QuartzNet
+from model import Model
+from profiler import LayerProfiler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', choices=['model', 'quartznet'],
+                        default='model')
+    parser.add_argument('--batch', type=int, default=1)
+    parser.add_argument('--frames', type=int, default=1024)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--by', choices=['layer', 'block'], default='layer')
+    parser.add_argument('--top', type=int, default=30)
+    parser.add_argument('--trace', default=None)
+    parser.add_argument('--threads', type=int, default=None)
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    model = Model() if args.model == 'model' else QuartzNet.from_variables()
+    model.eval()
+    x = torch.randn(args.batch, 64, args.frames)
+    with torch.no_grad():
+        model(x)
+        t = time.perf_counter()
+        for _ in range(args.repeat):
+            model(x)
+        plain = (time.perf_counter() - t) / args.repeat
+        with LayerProfiler(model) as profiler:
+            t = time.perf_counter()
+            for _ in range(args.repeat):
+                model(x)
+            profiled = (time.perf_counter() - t) / args.repeat
+
+    print('%s %dx%d: %.1f ms unprofiled, %.1f ms profiled' % (
+        args.model, args.batch, args.frames, plain * 1e3, profiled * 1e3))
+    print(profiler.table(args.by, args.top))
+    if args.trace:
+        print('wrote %s' % profiler.chrome_trace(args.trace))
@@ -0,0 +1,44 @@
+"""Prunes the 1x1 convs of QuartzNet and packs them into a sparse archive.
+
+    python -m tools.prune_weights --sparsity 0.8 [--block 1 1]
+        [--no-decoder] [--out variables-sparse80.qnw]
+
+Every pointwise, residual and (unless --no-decoder) decoder conv loses its
+--sparsity smallest weights (or --block blocks); the pruned convs are
+stored in CSR form (see sparsity.sparse_variables) and the archive is
+loaded with sparsity.load_sparse(). The round trip is checked against the
+pruned dense model.
+"""
+import argparse
+import os
+
+import torch
+
+from encoder import QuartzNet
+from sparsity import (load_sparse, pointwise_layers, prune, sparse_variables,
+                      sparsify)
+from utils.weights import pack_variables
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sparsity', type=float, required=True)
+    parser.add_argument('--block', nargs=2, type=int, default=[1, 1])
+    parser.add_argument('--no-decoder', dest='decoder', action='store_false',
+                        help='keep the decoder dense')
+    parser.add_argument('--out', default=None)
+    args = parser.parse_args()
+    out = args.out or 'variables-sparse%d.qnw' % round(100 * args.sparsity)
+
+    model = QuartzNet.from_variables().eval()
+    layers = pointwise_layers(model, args.decoder)
+    prune(model, args.sparsity, tuple(args.block), layers)
+    x = torch.randn(2, 64, 512)
+    with torch.no_grad():
+        expected = model(x)
+    pack_variables(sparse_variables(sparsify(model, layers)), out)
+    print('wrote %s (%.1f MB)' % (out, os.path.getsize(out) / 2 ** 20))
+
+    with torch.no_grad():
+        diff = (load_sparse(out)(x) - expected).abs().max().item()
+    print('max diff against the pruned dense model: %.2e' % diff)
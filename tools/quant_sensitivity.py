@@ -0,0 +1,75 @@
+"""Per-layer int8 sensitivity of encoder.QuartzNet and a mixed-precision
+config.
+
+    python -m tools.quant_sensitivity --manifest calib.json
+        [--granularity layer|block] [--subset_len 50] [--top_k 8]
+        [--output quantized/mixed_precision.json]
+
+Quantizes one conv (n_Conv_* of model.Model) or one block at a time, all
+else float, and ranks them by the WER increase and the mean per-frame KL
+divergence of the output log-probs against the float model on --manifest.
+Writes a config keeping the --top_k most sensitive units in float, which
+tools/quantize_int8.py --config and quantize.quantize(config=...) accept,
+and reports WER and model time of full int8, the mixed config and float.
+"""
+import argparse
+import json
+import os
+
+from encoder import QuartzNet
+from quantize import (ENGINE, block_names, conv_layers, export_names,
+                      mixed_precision_config, quantize, sensitivity)
+from utils.evaluation import evaluate
+from utils.feature_cache import cached_feature_batches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--manifest', required=True)
+    parser.add_argument('--calib_manifest', default=None,
+                        help='calibration manifest (default: --manifest)')
+    parser.add_argument('--subset_len', type=int, default=None)
+    parser.add_argument('--granularity', choices=['layer', 'block'],
+                        default='layer')
+    parser.add_argument('--top_k', type=int, default=8)
+    parser.add_argument('--engine', default=ENGINE)
+    parser.add_argument('--output',
+                        default=os.path.join('quantized',
+                                             'mixed_precision.json'))
+    args = parser.parse_args()
+
+    model = QuartzNet.from_variables().eval()
+    batches = cached_feature_batches(args.manifest, 1, args.subset_len)
+    calibration = batches
+    if args.calib_manifest:
+        calibration = cached_feature_batches(args.calib_manifest, 1,
+                                             args.subset_len)
+    units = conv_layers(model) if args.granularity == 'layer' \
+        else block_names(model)
+    names = export_names(model)
+    ranking = sensitivity(model, batches, units, args.engine, calibration)
+
+    print('%4s %-38s %-10s %8s %10s' % ('rank', 'module', 'export',
+                                        'dWER', 'KL'))
+    for i, r in enumerate(ranking):
+        print('%4d %-38s %-10s %8.4f %10.3e' % (
+            i + 1, r['name'], names.get(r['name'], ''), r['delta_wer'],
+            r['kl']))
+
+    config = mixed_precision_config(ranking, args.top_k, args.engine, names)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(config, f, indent=2)
+    print('wrote %s (float: %s)' % (args.output,
+                                    ', '.join(config['float_modules'])))
+
+    print('%6s %8s %10s' % ('model', 'WER', 'model s'))
+    runs = [('int8', dict(engine=args.engine)),
+            ('mixed', dict(config=config)),
+            ('float', None)]
+    for name, kwargs in runs:
+        run = model if kwargs is None else \
+            quantize(model, batches=calibration, **kwargs)
+        result = evaluate(run, None, batches=batches)
+        print('%6s %8.4f %10.2f' % (name, result['wer'],
+                                    result['model_seconds']))
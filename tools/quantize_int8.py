@@ -0,0 +1,70 @@
+"""Int8 post-training quantization of encoder.QuartzNet for the CPU.
+
+    python -m tools.quantize_int8 --manifest test.json
+        [--calib_manifest calib.json] [--subset_len 100]
+        [--config quantized/mixed_precision.json]
+        [--output quantized/quartznet_int8.pt]
+
+Calibrates on --calib_manifest (default: --manifest), saves the int8 model
+as TorchScript, reloads it, and reports load time, WER and time spent in
+the model for float and int8 on --manifest. Quantized models are not
+length-masked, so evaluation runs one utterance per batch for both.
+--config keeps the float modules of a mixed-precision config written by
+tools/quant_sensitivity.py in float.
+"""
+import argparse
+import os
+import time
+
+import torch
+
+from encoder import QuartzNet
+from quantize import ENGINE, load_quantized, quantize, save_quantized
+from utils.evaluation import evaluate
+from utils.feature_cache import cached_feature_batches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--manifest', required=True)
+    parser.add_argument('--calib_manifest', default=None)
+    parser.add_argument('--batch_size', type=int, default=32,
+                        help='calibration batch size')
+    parser.add_argument('--subset_len', type=int, default=None,
+                        help='calibration utterances')
+    parser.add_argument('--engine', default=ENGINE)
+    parser.add_argument('--config', default=None,
+                        help='mixed-precision config')
+    parser.add_argument('--output',
+                        default=os.path.join('quantized',
+                                             'quartznet_int8.pt'))
+    args = parser.parse_args()
+
+    model = QuartzNet.from_variables().eval()
+    t = time.perf_counter()
+    calibration = cached_feature_batches(args.calib_manifest or args.manifest,
+                                         args.batch_size, args.subset_len)
+    quantized = quantize(model, batches=calibration, engine=args.engine,
+                         config=args.config)
+    print('calibrated and converted in %.1f s (engine %s)' % (
+        time.perf_counter() - t, args.engine))
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    save_quantized(quantized, args.output)
+
+    t = time.perf_counter()
+    quantized = load_quantized(args.output, args.engine)
+    print('loaded %s (%.1f MB) in %.2f s' % (
+        args.output, os.path.getsize(args.output) / 2 ** 20,
+        time.perf_counter() - t))
+
+    batches = cached_feature_batches(args.manifest, batch_size=1)
+    with torch.no_grad():
+        results = [('float', evaluate(model, None, batches=batches)),
+                   ('int8', evaluate(quantized, None, batches=batches))]
+    print('%6s %8s %10s %8s' % ('model', 'WER', 'model s', 'RTF'))
+    for name, result in results:
+        print('%6s %8.4f %10.2f %8.4f' % (
+            name, result['wer'], result['model_seconds'],
+            result['model_seconds'] / result['audio_seconds']))
+    print('int8 speedup %.2fx' % (results[0][1]['model_seconds']
+                                  / results[1][1]['model_seconds']))
@@ -0,0 +1,15 @@
+"""Timing helper shared by the benchmarks in tools/."""
+import statistics
+import time
+
+
+def median_ms(fn, repeat):
+    """Median wall time of `repeat` calls of fn() in ms, after a warm-up
+    call."""
+    fn()
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t)
+    return statistics.median(times) * 1000
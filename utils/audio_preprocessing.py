@@ -220,14 +220,32 @@ class AudioToMelSpectrogramPreprocessor(AudioPreprocessor):
             a multiple of pad_to.
             Defaults to 16
         frame_splicing (int): Defaults to 1
-        stft_conv (bool): If True, uses pytorch_stft and convolutions. If
-            False, uses torch.stft.
-            Defaults to False
+        stft_conv (bool): If True, computes the STFT of pytorch_stft (a conv
+            with a periodic window); if False, the one of torch.stft with a
+            symmetric window. stft_engine picks how it is computed.
+            Defaults to True
         pad_value (float): The value that shorter mels are padded with.
             Defaults to 0
         mag_power (float): The power that the linear spectrogram is raised to
             prior to multiplication with mel basis.
             Defaults to 2 for a power spec
+        log_impl (str): "torch" keeps the log in torch (traceable, no host
+            copy); "numpy" goes through np.log for ARM64 builds whose
+            torch.log is wrong. None picks "numpy" only on such machines.
+            Defaults to None
+        mel_projection (str): "banded" multiplies every mel filter with
+            only the STFT bins of its band; "dense" with the full
+            [features, n_fft // 2 + 1] filterbank. "banded" gathers a
+            [B, features * width, T] copy of the spectrum first, so
+            measure it with tools/bench_melfb.py before switching.
+            Defaults to "dense"
+        stft_engine (str): "conv" (conv1d with the Fourier basis), "torch"
+            (torch.stft) or "rfft" (torch.fft.rfft of unfolded frames);
+            they give the same spectrum. "auto" times them per device,
+            batch size and signal length, keeps the fastest that matches
+            the stft_conv one and caches the choice. None uses "conv" if
+            stft_conv else "torch".
+            Defaults to None
     """
 
     def __init__(
@@ -253,6 +271,9 @@ class AudioToMelSpectrogramPreprocessor(AudioPreprocessor):
             stft_conv=True,
             pad_value=0,
             mag_power=2.,
+            log_impl=None,
+            mel_projection="dense",
+            stft_engine=None,
             **kwargs
     ):
         if window_size and n_window_size:
@@ -288,6 +309,9 @@ class AudioToMelSpectrogramPreprocessor(AudioPreprocessor):
             stft_conv=stft_conv,
             pad_value=pad_value,
             mag_power=mag_power,
+            log_impl=log_impl,
+            mel_projection=mel_projection,
+            stft_engine=stft_engine,
             logger=None
         )
         # self.featurizer.to(self._device)
@@ -0,0 +1,122 @@
+"""
+Greedy-CTC word error rate of a model over a manifest.
+
+This is the AudioToTextDataLayer -> AudioToMelSpectrogramPreprocessor ->
+model loop of the ``evaluate()`` functions in ``quartznet.py`` and
+``compile_model.py``, packaged so that calibration, quantization and
+precision checks can share it. Unlike those, every utterance of a batch is
+decoded (up to its own output length, so padding never turns into text)
+and the time spent in the model is measured separately from data loading
+and featurization.
+"""
+__all__ = ['VOCAB',
+           'evaluate',
+           'feature_batches']
+
+import time
+
+import torch
+
+from .audio_preprocessing import AudioToMelSpectrogramPreprocessor
+from .common import (post_process_predictions, post_process_transcripts,
+                     word_error_rate)
+from .data_layer import AudioToTextDataLayer
+
+VOCAB = [" ", "a", "b", "c", "d", "e", "f", "g", "h", "i", "j", "k", "l",
+         "m", "n", "o", "p", "q", "r", "s", "t", "u", "v", "w", "x", "y", "z",
+         "'"]
+
+
+@torch.no_grad()
+def feature_batches(manifest, batch_size=32, subset_len=None,
+                    sample_rate=16000):
+    """Yields the featurized batches of a manifest.
+
+    Args:
+        manifest (str): Manifest JSON (one utterance per line).
+        batch_size (int): Utterances per batch.
+        subset_len (int): Stop after this many utterances (all if None).
+
+    Yields:
+        (features [B, 64, T], feature lengths [B], transcripts [B, L],
+        transcript lengths [B])
+    """
+    data_layer = AudioToTextDataLayer(
+        manifest_filepath=manifest,
+        sample_rate=sample_rate,
+        labels=VOCAB,
+        batch_size=batch_size,
+        shuffle=False,
+        drop_last=False)
+    preprocessor = AudioToMelSpectrogramPreprocessor(sample_rate=sample_rate)
+    seen = 0
+    for batch in data_layer.data_iterator:
+        audio_signal, audio_length, transcript, transcript_length = batch
+        if subset_len is not None:
+            keep = subset_len - seen
+            if keep <= 0:
+                break
+            audio_signal = audio_signal[:keep]
+            audio_length = audio_length[:keep]
+            transcript = transcript[:keep]
+            transcript_length = transcript_length[:keep]
+        seen += audio_signal.shape[0]
+        features = preprocessor.get_features(audio_signal, audio_length)
+        lengths = preprocessor.get_seq_len(audio_length.float())
+        yield features, lengths, transcript, transcript_length
+
+
+@torch.no_grad()
+def evaluate(model, manifest, batch_size=32, subset_len=None,
+             pass_lengths=False, batches=None, keep_outputs=False):
+    """Greedy-decodes a manifest with `model` and scores it.
+
+    Args:
+        model: Callable mapping [B, 64, T] features (plus lengths if
+            `pass_lengths`) to [B, T', 29] log-probs, logits or
+            probabilities, or to [B, T'] greedy class ids.
+        manifest, batch_size, subset_len: See feature_batches().
+        pass_lengths (bool): Call model(features, lengths), for length
+            aware models such as encoder.QuartzNet.
+        batches: Pre-computed feature_batches() output to use instead of
+            reading the manifest.
+        keep_outputs (bool): Also return the model output of every
+            utterance, cut to its output length, as 'outputs'.
+
+    Returns:
+        dict with 'wer', 'hypotheses', 'references', 'model_seconds' (time
+        spent in the model) and 'audio_seconds'.
+    """
+    if batches is None:
+        batches = feature_batches(manifest, batch_size, subset_len)
+    hypotheses, references, outputs = [], [], []
+    model_seconds, frames = 0., 0
+    for features, lengths, transcript, transcript_length in batches:
+        t = time.perf_counter()
+        if pass_lengths:
+            out = model(features, lengths)
+        else:
+            out = model(features)
+        model_seconds += time.perf_counter() - t
+        # Output frames of each utterance, at the model's output rate.
+        out_lengths = torch.ceil(
+            lengths.float() * out.shape[1] / features.shape[-1]).long()
+        predictions = out if not out.is_floating_point() \
+            else out.argmax(dim=-1)
+        for i, n in enumerate(out_lengths.tolist()):
+            hypotheses += post_process_predictions(
+                [predictions[i, :n].unsqueeze(0)], VOCAB)
+            if keep_outputs:
+                outputs.append(out[i, :n])
+        references += post_process_transcripts(
+            [transcript], [transcript_length], VOCAB)
+        frames += int(lengths.sum())
+    result = {'wer': word_error_rate(hypotheses=hypotheses,
+                                     references=references),
+              'hypotheses': hypotheses,
+              'references': references,
+              'model_seconds': model_seconds,
+              'audio_seconds': frames / 100.}
+    if keep_outputs:
+        result['outputs'] = outputs
+    return result
@@ -0,0 +1,232 @@
+"""
+Memory-mapped cache of featurized manifests, and duration-stratified
+subsets.
+
+Calibration, fast finetuning and evaluation runs go over the same
+utterances again and again, and decoding WAVs and computing mel features
+costs more than running the model on them. ``cached_feature_batches()``
+featurizes a manifest once, one utterance at a time, into
+``features-<key>.npy`` (all frames of all utterances, [frames, 64]
+float32) and ``features-<key>.json`` (per-utterance offsets, lengths and
+transcripts) in cache/features. Later runs memory-map the array and
+only batch and pad, one batch at a time as they are iterated.
+
+The key is a digest of the manifest lines used and of the featurizer
+configuration (window, filterbank, normalization, padding...), so editing
+the manifest or the featurizer never picks up stale features.
+
+``stratified_subset()`` picks ``subset_len`` utterances spread evenly over
+the duration range of a manifest instead of its first lines, which in
+LibriSpeech-style manifests all come from a handful of speakers.
+"""
+__all__ = ['CACHE_DIR',
+           'FeatureBatches',
+           'cached_feature_batches',
+           'featurizer_config',
+           'stratified_subset']
+
+import hashlib
+import json
+import os
+import random
+
+import numpy as np
+import torch
+
+from .audio_preprocessing import AudioToMelSpectrogramPreprocessor
+from .data_layer import AudioToTextDataLayer
+from .evaluation import VOCAB
+
+# A subdirectory of engine.CACHE_DIR: ArtifactCache only evicts the files
+# directly in its root, so it never counts or deletes cached features.
+CACHE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache',
+    'features')
+
+
+def stratified_subset(lines, subset_len, strata=10, seed=0):
+    """Indices of `subset_len` manifest lines, stratified by duration.
+
+    The lines are sorted by duration and cut into `strata` bins of equal
+    count; every bin contributes in proportion to its size (largest
+    remainder), drawn with a fixed seed.
+
+    Args:
+        lines (list): Manifest lines (JSON strings with a 'duration').
+        subset_len (int): Utterances to keep; all if None or not smaller
+            than the manifest.
+
+    Returns:
+        Sorted list of line indices, so the subset keeps manifest order.
+    """
+    if subset_len is None or subset_len >= len(lines):
+        return list(range(len(lines)))
+    durations = [json.loads(line)['duration'] for line in lines]
+    order = sorted(range(len(lines)), key=lambda i: (durations[i], i))
+    strata = max(1, min(strata, subset_len))
+    bins = [order[len(order) * k // strata:len(order) * (k + 1) // strata]
+            for k in range(strata)]
+    quotas = [subset_len * len(b) / len(order) for b in bins]
+    counts = [int(q) for q in quotas]
+    by_remainder = sorted(range(strata), key=lambda k: counts[k] - quotas[k])
+    for k in by_remainder[:subset_len - sum(counts)]:
+        counts[k] += 1
+    rng = random.Random(seed)
+    chosen = []
+    for b, n in zip(bins, counts):
+        chosen += rng.sample(b, n)
+    return sorted(chosen)
+
+
+def featurizer_config(preprocessor):
+    """Everything about an AudioToMelSpectrogramPreprocessor that changes
+    its output, as a JSON-serializable dict."""
+    featurizer = preprocessor.featurizer
+    digest = hashlib.sha1()
+    for name, buf in sorted(featurizer.state_dict().items()):
+        digest.update(name.encode())
+        digest.update(buf.detach().float().contiguous().numpy().tobytes())
+    return {'n_fft': featurizer.n_fft,
+            'win_length': featurizer.win_length,
+            'hop_length': featurizer.hop_length,
+            'nfilt': featurizer.nfilt,
+            'preemph': featurizer.preemph,
+            'stft_conv': featurizer.stft_conv,
+            'stft_engine': featurizer.stft_engine,
+            'mag_power': featurizer.mag_power,
+            'log': featurizer.log,
+            'log_zero_guard_type': featurizer.log_zero_guard_type,
+            'log_impl': featurizer.log_impl,
+            'mel_projection': featurizer.mel_projection,
+            'log_zero_guard_value': float(
+                featurizer.log_zero_guard_value(torch.zeros(1))),
+            'frame_splicing': featurizer.frame_splicing,
+            'normalize': featurizer.normalize,
+            'pad_value': featurizer.pad_value,
+            'buffers': digest.hexdigest()}
+
+
+class FeatureBatches(object):
+    """Re-iterable batches over a memory-mapped feature cache.
+
+    Only the batch being read is copied out of the map and padded, so
+    iterating costs one batch of memory however large the cache is.
+    """
+    def __init__(self, frames, utterances, batch_size):
+        self.frames = frames
+        self.utterances = utterances
+        self.batch_size = batch_size
+
+    def __len__(self):
+        return -(-len(self.utterances) // self.batch_size)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        start = index * self.batch_size
+        batch = self.utterances[start:start + self.batch_size]
+        width = max(u['frames'] for u in batch)
+        words = max(len(u['transcript']) for u in batch)
+        features = np.zeros((len(batch), self.frames.shape[1], width),
+                            np.float32)
+        for i, u in enumerate(batch):
+            features[i, :, :u['frames']] = \
+                self.frames[u['offset']:u['offset'] + u['frames']].T
+        transcript = torch.tensor([u['transcript'] + [0] * (
+            words - len(u['transcript'])) for u in batch], dtype=torch.long)
+        return (torch.from_numpy(features),
+                torch.tensor([u['length'] for u in batch], dtype=torch.long),
+                transcript,
+                torch.tensor([len(u['transcript']) for u in batch],
+                             dtype=torch.long))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+@torch.no_grad()
+def _build(lines, prefix, preprocessor, sample_rate):
+    """Featurizes manifest `lines` into prefix.npy and prefix.json."""
+    tmp = '%s.%d' % (prefix, os.getpid())
+    with open(tmp + '.manifest', 'w') as f:
+        f.writelines(line + '\n' for line in lines)
+    data_layer = AudioToTextDataLayer(
+        manifest_filepath=tmp + '.manifest',
+        sample_rate=sample_rate,
+        labels=VOCAB,
+        batch_size=1,
+        shuffle=False,
+        drop_last=False)
+    chunks, utterances, offset = [], [], 0
+    try:
+        for audio_signal, audio_length, transcript, transcript_length in \
+                data_layer.data_iterator:
+            features = preprocessor.get_features(audio_signal, audio_length)
+            length = preprocessor.get_seq_len(audio_length.float())
+            chunks.append(features[0].t().numpy().astype(np.float32))
+            n = int(transcript_length[0])
+            utterances.append({'offset': offset,
+                               'frames': features.shape[-1],
+                               'length': int(length[0]),
+                               'transcript': transcript[0, :n].tolist()})
+            offset += features.shape[-1]
+        with open(tmp + '.npy', 'wb') as f:
+            np.save(f, np.concatenate(chunks) if chunks
+                    else np.zeros((0, preprocessor.featurizer.nfilt),
+                                  np.float32))
+        with open(tmp + '.json', 'w') as f:
+            json.dump(utterances, f)
+        # Index last; an entry is complete when both files exist.
+        os.replace(tmp + '.npy', prefix + '.npy')
+        os.replace(tmp + '.json', prefix + '.json')
+    finally:
+        for ext in ('.manifest', '.npy', '.json'):
+            if os.path.exists(tmp + ext):
+                os.remove(tmp + ext)
+
+
+def cached_feature_batches(manifest, batch_size=32, subset_len=None,
+                           sample_rate=16000, cache_dir=CACHE_DIR,
+                           strata=10, seed=0):
+    """feature_batches() from a memory-mapped feature cache.
+
+    Features are computed on the first call for a given manifest subset
+    and featurizer configuration, one utterance at a time, so they do not
+    depend on what else was in the batch.
+
+    Args:
+        manifest (str): Manifest JSON (one utterance per line).
+        batch_size (int): Utterances per batch.
+        subset_len (int): Number of utterances, chosen by
+            stratified_subset() (all if None).
+        cache_dir (str): Where features-<key>.npy/.json are kept.
+        strata, seed: See stratified_subset().
+
+    Returns:
+        FeatureBatches of (features [B, 64, T], feature lengths [B],
+        transcripts [B, L], transcript lengths [B]) in manifest order.
+    """
+    with open(manifest) as f:
+        lines = [line.strip() for line in f if line.strip()]
+    lines = [lines[i] for i in
+             stratified_subset(lines, subset_len, strata, seed)]
+    preprocessor = AudioToMelSpectrogramPreprocessor(sample_rate=sample_rate)
+    digest = hashlib.sha1()
+    digest.update(json.dumps(featurizer_config(preprocessor),
+                             sort_keys=True).encode())
+    digest.update(str(sample_rate).encode())
+    for line in lines:
+        digest.update(line.encode() + b'\n')
+    prefix = os.path.join(cache_dir, 'features-' + digest.hexdigest()[:16])
+    if not (os.path.exists(prefix + '.json')
+            and os.path.exists(prefix + '.npy')):
+        os.makedirs(cache_dir, exist_ok=True)
+        _build(lines, prefix, preprocessor, sample_rate)
+
+    with open(prefix + '.json') as f:
+        utterances = json.load(f)
+    return FeatureBatches(np.load(prefix + '.npy', mmap_mode='r'),
+                          utterances, batch_size)
@@ -23,41 +23,234 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import functools
 import math
+import platform
+import time
 import librosa
 import torch
 import torch.nn as nn
 import numpy as np
 from .perturb import AudioAugmentor
 from .segment import AudioSegment
-from torch_stft import STFT
 
 CONSTANT = 1e-5
+LOG_IMPLS = ("torch", "numpy")
+MEL_PROJECTIONS = ("banded", "dense")
+STFT_ENGINES = ("conv", "torch", "rfft")
+LEGACY_STFT_KEYS = ("window", "stft.forward_basis", "stft.inverse_basis")
+TORCH_WINDOWS = {
+    'hann': torch.hann_window,
+    'hamming': torch.hamming_window,
+    'blackman': torch.blackman_window,
+    'bartlett': torch.bartlett_window,
+    'none': None,
+}
+
+
+@functools.lru_cache(maxsize=None)
+def torch_log_is_accurate():
+    """Checks torch.log against np.log on float32 values spanning the
+    range of mel energies (down to the 2**-24 zero guard).
+
+    Some ARM64 builds return wrong torch.log results; everywhere else this
+    holds and the log stays in torch.
+    """
+    x = torch.logspace(-30, 10, 4001, dtype=torch.float32)
+    expected = torch.from_numpy(np.log(x.numpy()))
+    return bool(torch.allclose(torch.log(x), expected, rtol=1e-5,
+                               atol=1e-6))
+
+
+def default_log_impl():
+    """"torch" unless this is an ARM64 machine whose torch.log is off."""
+    if platform.machine().lower() in ("aarch64", "arm64") \
+            and not torch_log_is_accurate():
+        return "numpy"
+    return "torch"
+
+
+@functools.lru_cache(maxsize=None)
+def mel_filterbank(sample_rate, n_fft, nfilt, lowfreq, highfreq):
+    """[nfilt, n_fft // 2 + 1] librosa mel filterbank.
+
+    Built once per configuration; featurizers register a clone of it.
+    """
+    return torch.tensor(
+        librosa.filters.mel(sample_rate, n_fft, n_mels=nfilt,
+                            fmin=lowfreq, fmax=highfreq),
+        dtype=torch.float)
+
+
+@functools.lru_cache(maxsize=None)
+def banded_filterbank(sample_rate, n_fft, nfilt, lowfreq, highfreq):
+    """Banded form of mel_filterbank(): every filter keeps the `width`
+    coefficients starting at its first non-zero bin, where `width` is the
+    widest band of the bank.
+
+    Returns:
+        (index [nfilt * width] long, the STFT bins each filter reads,
+        weights [nfilt, width] float, their coefficients)
+    """
+    fb = mel_filterbank(sample_rate, n_fft, nfilt, lowfreq, highfreq)
+    bins = torch.arange(fb.shape[1])
+    nonzero = fb != 0
+    starts = torch.where(nonzero, bins, fb.shape[1]).min(dim=1).values
+    stops = torch.where(nonzero, bins + 1, 0).max(dim=1).values
+    width = max(int((stops - starts).max()), 1)
+    # Keeps every window inside the spectrum; a shifted window still
+    # covers its band, and empty filters read zeros.
+    starts = starts.clamp(max=fb.shape[1] - width)
+    index = starts.unsqueeze(1) + torch.arange(width)
+    return index.flatten(), fb.gather(1, index)
+
+
+def banded_projection(x, index, weights):
+    """Projects a [B, F, T] power spectrum onto a banded filterbank.
+
+    Only the `width` bins of every filter are read, instead of all F bins
+    of the dense [nfilt, F] matmul.
+    """
+    nfilt, width = weights.shape
+    bands = x.index_select(1, index).view(x.shape[0], nfilt, width,
+                                          x.shape[-1])
+    return torch.einsum("bmwt,mw->bmt", bands, weights)
+
+
+@functools.lru_cache(maxsize=None)
+def stft_window(window, win_length, n_fft, periodic):
+    """[n_fft] analysis window: `win_length` samples of `window` centred
+    in n_fft, as torch.stft and the conv basis both apply it.
+
+    The conv STFT has always used the periodic window (scipy's
+    fftbins=True) and the torch.stft path the symmetric one, so
+    `periodic` follows stft_conv and keeps either featurization as it was.
+    """
+    window_fn = TORCH_WINDOWS.get(window, None)
+    if window_fn is None:
+        window_tensor = torch.ones(win_length)
+    else:
+        window_tensor = window_fn(win_length, periodic=periodic)
+    left = (n_fft - win_length) // 2
+    return nn.functional.pad(window_tensor.float(),
+                             (left, n_fft - win_length - left))
+
+
+@functools.lru_cache(maxsize=None)
+def stft_basis(window, win_length, n_fft, periodic):
+    """[2 * (n_fft // 2 + 1), 1, n_fft] conv1d weight of the windowed
+    real and imaginary Fourier rows, built in float64 like torch_stft."""
+    fourier = torch.fft.rfft(torch.eye(n_fft, dtype=torch.float64)).t()
+    basis = torch.cat([fourier.real, fourier.imag]).float()
+    return (basis * stft_window(window, win_length, n_fft,
+                                periodic)).unsqueeze(1)
+
+
+def power_spectrum(x, engine, window, hop_length, basis=None, center=True):
+    """|STFT|^2 [B, n_fft // 2 + 1, T] of [B, N] signals, with frames
+    centred by n_fft // 2 samples of reflect padding on both sides (or
+    starting at sample 0 with center=False).
+
+    Args:
+        engine: "conv" (a strided conv1d with `basis`, see stft_basis),
+            "torch" (torch.stft) or "rfft" (torch.fft.rfft of unfolded
+            frames). All three compute the same transform.
+        window: [n_fft] padded window from stft_window.
+    """
+    n_fft = window.shape[0]
+    if engine == "torch":
+        x = torch.stft(x, n_fft=n_fft, hop_length=hop_length,
+                       center=center, window=window, return_complex=False)
+        return x.pow(2).sum(-1)
+    x = x.unsqueeze(1)
+    if center:
+        x = nn.functional.pad(x, (n_fft // 2, n_fft // 2), mode="reflect")
+    if engine == "conv":
+        x = nn.functional.conv1d(x, basis, stride=hop_length)
+        real, imag = x.chunk(2, dim=1)
+        return real.pow(2) + imag.pow(2)
+    frames = x.squeeze(1).unfold(-1, n_fft, hop_length) * window
+    x = torch.view_as_real(torch.fft.rfft(frames, dim=-1))
+    return x.pow(2).sum(-1).transpose(1, 2)
+
+
+@functools.lru_cache(maxsize=None)
+def fastest_stft_engine(window, win_length, n_fft, periodic, hop_length,
+                        device, batch, samples, reference, repeat=3):
+    """The fastest of STFT_ENGINES on `device` for [batch, samples]
+    signals whose power spectrum matches the `reference` engine.
+
+    Every engine runs on the same random signal; those that are not
+    within rtol 1e-3 (and 1e-5 of the peak power) of the reference are
+    dropped, the rest are timed (median of `repeat` after a warm-up).
+    The choice is cached per configuration, device and shape, so it is
+    measured once per process.
+    """
+    device = torch.device(device)
+    window_tensor = stft_window(window, win_length, n_fft,
+                                periodic).to(device)
+    basis = stft_basis(window, win_length, n_fft, periodic).to(device)
+    generator = torch.Generator().manual_seed(0)
+    x = torch.randn(batch, samples, generator=generator).to(device)
+
+    def run(engine):
+        return power_spectrum(x, engine, window_tensor, hop_length, basis)
+
+    def now():
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        return time.perf_counter()
+
+    with torch.no_grad():
+        expected = run(reference)
+        atol = 1e-5 * float(expected.abs().max())
+        best, best_time = reference, None
+        for engine in STFT_ENGINES:
+            try:
+                out = run(engine)
+            except RuntimeError:
+                continue
+            if out.shape != expected.shape or not torch.allclose(
+                    out, expected, rtol=1e-3, atol=atol):
+                continue
+            times = []
+            for _ in range(repeat):
+                start = now()
+                run(engine)
+                times.append(now() - start)
+            elapsed = sorted(times)[len(times) // 2]
+            if best_time is None or elapsed < best_time:
+                best, best_time = engine, elapsed
+    return best
 
 
 def normalize_batch(x, seq_len, normalize_type):
+    """Normalizes [B, C, T] features to zero mean and unit (unbiased) std
+    over the first seq_len[i] frames of every utterance, per feature row
+    ("per_feature") or over all of them ("all_features").
+
+    Masked reductions over the whole batch instead of a Python loop per
+    utterance, so the cost does not grow with the batch in Python and the
+    function traces into a single graph. The variance sums centred
+    squares (two passes, like torch.std) rather than E[x^2] - E[x]^2,
+    which would cancel badly on log-mel values.
+    """
+    if normalize_type not in ("per_feature", "all_features"):
+        return x
+    valid = (torch.arange(x.shape[-1], device=x.device).unsqueeze(0)
+             < seq_len.unsqueeze(1)).unsqueeze(1)
     if normalize_type == "per_feature":
-        x_mean = torch.zeros((seq_len.shape[0], x.shape[1]), dtype=x.dtype,
-                             device=x.device)
-        x_std = torch.zeros((seq_len.shape[0], x.shape[1]), dtype=x.dtype,
-                            device=x.device)
-        for i in range(x.shape[0]):
-            x_mean[i, :] = x[i, :, :seq_len[i]].mean(dim=1)
-            x_std[i, :] = x[i, :, :seq_len[i]].std(dim=1)
-        # make sure x_std is not zero
-        x_std += CONSTANT
-        return (x - x_mean.unsqueeze(2)) / x_std.unsqueeze(2)
-    elif normalize_type == "all_features":
-        x_mean = torch.zeros(seq_len.shape, dtype=x.dtype, device=x.device)
-        x_std = torch.zeros(seq_len.shape, dtype=x.dtype, device=x.device)
-        for i in range(x.shape[0]):
-            x_mean[i] = x[i, :, :seq_len[i].item()].mean()
-            x_std[i] = x[i, :, :seq_len[i].item()].std()
-        # make sure x_std is not zero
-        x_std += CONSTANT
-        return (x - x_mean.view(-1, 1, 1)) / x_std.view(-1, 1, 1)
+        dims = (2,)
+        count = seq_len.to(x.dtype).view(-1, 1, 1)
     else:
-        return x
+        dims = (1, 2)
+        count = (seq_len * x.shape[1]).to(x.dtype).view(-1, 1, 1)
+    x_mean = x.masked_fill(~valid, 0.).sum(dims, keepdim=True) / count
+    centred = (x - x_mean).masked_fill(~valid, 0.)
+    x_std = torch.sqrt(centred.pow(2).sum(dims, keepdim=True) / (count - 1))
+    # make sure x_std is not zero
+    x_std += CONSTANT
+    return (x - x_mean) / x_std
 
 
 def splice_frames(x, frame_splicing):
@@ -146,6 +339,9 @@ class FilterbankFeatures(nn.Module):
             stft_conv=False,
             pad_value=0,
             mag_power=2.,
+            log_impl=None,
+            mel_projection="dense",
+            stft_engine=None,
             logger=None
     ):
         super(FilterbankFeatures, self).__init__()
@@ -166,43 +362,34 @@ class FilterbankFeatures(nn.Module):
         self.n_fft = n_fft or 2 ** math.ceil(math.log2(self.win_length))
         self.stft_conv = stft_conv
 
-        if stft_conv:
-            if logger:
-                logger.info("STFT using conv")
-            else:
-                print("STFT using conv")
-
-            # Create helper class to patch forward func for use with AMP
-            class STFTPatch(STFT):
-                def __init__(self, *params, **kw_params):
-                    super(STFTPatch, self).__init__(*params, **kw_params)
-
-                def forward(self, input_data):
-                    return super(STFTPatch, self).transform(input_data)[0]
-
-            self.stft = STFTPatch(self.n_fft, self.hop_length,
-                                  self.win_length, window)
-
+        # stft_conv picks the reference transform (and its window, see
+        # stft_window); stft_engine how it is computed.
+        reference = "conv" if stft_conv else "torch"
+        if stft_engine is None:
+            stft_engine = reference
+        if stft_engine not in STFT_ENGINES + ("auto",):
+            raise ValueError(
+                f"{self} received {stft_engine} for the stft_engine "
+                f"parameter. It must be one of {STFT_ENGINES}, 'auto' or "
+                f"None.")
+        if logger:
+            logger.info(f"STFT using {stft_engine}")
+        else:
+            print(f"STFT using {stft_engine}")
+        self.stft_engine = stft_engine
+        self.stft_reference = reference
+        self.window_name = window
+        window_config = (window, self.win_length, self.n_fft, stft_conv)
+        # Clones of the cached tensors, derived from the config and so not
+        # saved; see _load_from_state_dict for older checkpoints.
+        self.register_buffer("window", stft_window(*window_config).clone(),
+                             persistent=False)
+        if stft_engine in ("conv", "auto"):
+            self.register_buffer("stft_basis",
+                                 stft_basis(*window_config).clone(),
+                                 persistent=False)
         else:
-            print("STFT using torch")
-            torch_windows = {
-                'hann': torch.hann_window,
-                'hamming': torch.hamming_window,
-                'blackman': torch.blackman_window,
-                'bartlett': torch.bartlett_window,
-                'none': None,
-            }
-            window_fn = torch_windows.get(window, None)
-            window_tensor = window_fn(self.win_length,
-                                      periodic=False) if window_fn else None
-            self.register_buffer("window", window_tensor)
-            self.stft = lambda x: torch.stft(
-                            x, n_fft=self.n_fft,
-                            hop_length=self.hop_length,
-                            win_length=self.win_length,
-                            center=True,
-                            window=self.window.to(dtype=torch.float),
-                            return_complex=False)
+            self.register_buffer("stft_basis", None, persistent=False)
 
         self.normalize = normalize
         self.log = log
@@ -213,13 +400,22 @@ class FilterbankFeatures(nn.Module):
         self.pad_to = pad_to
         highfreq = highfreq or sample_rate / 2
 
-        filterbanks = torch.tensor(
-            librosa.filters.mel(sample_rate, self.n_fft, n_mels=nfilt,
-                                fmin=lowfreq, fmax=highfreq),
-            dtype=torch.float).unsqueeze(0)
-        # self.fb = filterbanks
+        if mel_projection not in MEL_PROJECTIONS:
+            raise ValueError(
+                f"{self} received {mel_projection} for the mel_projection "
+                f"parameter. It must be one of {MEL_PROJECTIONS}.")
+        self.mel_projection = mel_projection
+        filterbank = (sample_rate, self.n_fft, nfilt, lowfreq, highfreq)
         # self.window = window_tensor
-        self.register_buffer("fb", filterbanks)
+        # Clones, so that load_state_dict or an in-place op on one
+        # featurizer never reaches the cached banks of the others. The
+        # banded form is derived from fb and stays out of the state_dict.
+        self.register_buffer("fb",
+                             mel_filterbank(*filterbank).unsqueeze(0).clone())
+        fb_index, fb_weights = banded_filterbank(*filterbank)
+        self.register_buffer("fb_index", fb_index.clone(), persistent=False)
+        self.register_buffer("fb_weights", fb_weights.clone(),
+                             persistent=False)
 
         # Calculate maximum sequence length
         max_length = self.get_seq_len(
@@ -250,54 +446,101 @@ class FilterbankFeatures(nn.Module):
                     f"log_zero_guard_type parameter. It must be either a "
                     f"number, 'tiny', or 'eps'")
         self.log_zero_guard_type = log_zero_guard_type
+        if log_impl is None:
+            log_impl = default_log_impl()
+        if log_impl not in LOG_IMPLS:
+            raise ValueError(
+                f"{self} received {log_impl} for the log_impl parameter. It "
+                f"must be one of {LOG_IMPLS} or None.")
+        self.log_impl = log_impl
 
     def get_seq_len(self, seq_len):
         return torch.ceil(seq_len / self.hop_length).to(dtype=torch.long)
 
+    def stft_engine_for(self, x):
+        """The STFT engine used for [B, N] signals `x`: the configured one,
+        or with "auto" the fastest matching one for x's device, batch size
+        and length (rounded up to a power of two)."""
+        if self.stft_engine != "auto":
+            return self.stft_engine
+        samples = max(2 ** math.ceil(math.log2(x.shape[-1])), self.n_fft)
+        return fastest_stft_engine(
+            self.window_name, self.win_length, self.n_fft, self.stft_conv,
+            self.hop_length, str(x.device), x.shape[0], samples,
+            self.stft_reference)
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # Checkpoints from before the STFT engines saved the torch.stft
+        # window or the torch_stft bases; both are rebuilt from the config.
+        for key in LEGACY_STFT_KEYS:
+            state_dict.pop(prefix + key, None)
+        super(FilterbankFeatures, self)._load_from_state_dict(
+            state_dict, prefix, *args, **kwargs)
+        # Keeps the banded filterbank in step with a loaded fb.
+        with torch.no_grad():
+            self.fb_weights.copy_(self.fb[0].gather(
+                1, self.fb_index.view(self.fb_weights.shape[0], -1)))
+
     @property
     def filter_banks(self):
         return self.fb
 
-    @torch.no_grad()
-    def forward(self, x, seq_len):
-        seq_len = self.get_seq_len(seq_len.float())
-
-        # dither
-        # Removed 2022-01-19
-        # if self.dither > 0:
-        #     x += self.dither * torch.randn_like(x)
-
-        # do preemphasis
-        if self.preemph is not None:
-            x = torch.cat(
-                (x[:, 0].unsqueeze(1), x[:, 1:] - self.preemph * x[:, :-1]),
-                dim=1)
-
-        x = self.stft(x)
+    def frame_features(self, x, center=True):
+        """Pre-emphasized [B, N] signals -> [B, nfilt * frame_splicing, T]
+        log-mel frames, before normalization and padding.
 
+        Every step is local to its frame, so StreamingFeatures runs it on
+        chunks; center=False frames the signal as given, without the
+        reflect padding of forward().
+        """
         # get power spectrum
-        if self.mag_power != 1.:
-            x = x.pow(self.mag_power)
-        if not self.stft_conv:
-            x = x.sum(-1)
+        x = power_spectrum(x, self.stft_engine_for(x), self.window,
+                           self.hop_length, self.stft_basis, center)
+        if self.mag_power != 2.:
+            x = x.pow(self.mag_power / 2.)
 
         # dot with filterbank energies
-        x = torch.matmul(self.fb.to(x.dtype), x)
+        if self.mel_projection == "banded":
+            x = banded_projection(x, self.fb_index,
+                                  self.fb_weights.to(x.dtype))
+        else:
+            x = torch.matmul(self.fb.to(x.dtype), x)
 
         # log features if required
         if self.log:
             if self.log_zero_guard_type == "add":
-                # Use numpy to go through the torch.log uncorrectness problem on ARM64
-                x = np.log(x + self.log_zero_guard_value(x))
-                # x = torch.log(x + self.log_zero_guard_value(x))
+                x = x + self.log_zero_guard_value(x)
             elif self.log_zero_guard_type == "clamp":
-                x = torch.log(torch.clamp(x, min=self.log_zero_guard_value(x)))
+                x = torch.clamp(x, min=self.log_zero_guard_value(x))
             else:
                 raise ValueError("log_zero_guard_type was not understood")
+            if self.log_impl == "numpy":
+                # Goes around the torch.log uncorrectness problem on ARM64
+                x = torch.from_numpy(np.log(x.cpu().numpy())).to(x.device)
+            else:
+                x = torch.log(x)
 
         # frame splicing if required
         if self.frame_splicing > 1:
             x = splice_frames(x, self.frame_splicing)
+        return x
+
+    @torch.no_grad()
+    def forward(self, x, seq_len):
+        seq_len = self.get_seq_len(seq_len.float())
+
+        # dither
+        # Removed 2022-01-19
+        # if self.dither > 0:
+        #     x += self.dither * torch.randn_like(x)
+
+        # do preemphasis
+        if self.preemph is not None:
+            x = torch.cat(
+                (x[:, 0].unsqueeze(1), x[:, 1:] - self.preemph * x[:, :-1]),
+                dim=1)
+
+        x = self.frame_features(x)
 
         # normalize if required
         if self.normalize:
@@ -324,3 +567,154 @@ class FilterbankFeatures(nn.Module):
                 x = nn.functional.pad(x, (0, pad_to - pad_amt),
                                       value=self.pad_value)
         return x
+
+
+STREAM_NORMALIZATIONS = ("running", "window", None)
+
+
+def _moments(x, dims):
+    """(count, mean, sum of squared deviations) of x over `dims`."""
+    count = 1
+    for d in dims:
+        count *= x.shape[d]
+    mean = x.mean(dims, keepdim=True)
+    return count, mean, (x - mean).pow(2).sum(dims, keepdim=True)
+
+
+class StreamingFeatures(object):
+    """Stateful chunk-by-chunk FilterbankFeatures for live audio.
+
+    Feed [B, n] PCM chunks of any length to step() and call flush() at the
+    end of the stream; both return the [B, features, n'] frames finished
+    by that call. Between calls only the pre-emphasis sample, the last
+    n_fft - hop_length samples of STFT overlap and the normalization
+    statistics are kept, so every chunk costs the same however long the
+    stream is. The frames of a stream are those of forward() on the whole
+    signal: the first waits for n_fft // 2 + 1 samples to build the left
+    reflect padding, flush() builds the right one, and there are
+    ceil(samples / hop_length) of them with no pad_to padding.
+
+    Without normalization the frames equal the offline log-mel features up
+    to float summation order. normalize_batch needs the whole utterance,
+    so the featurizer's normalize type is instead applied with statistics
+    updated by every chunk before it is normalized:
+
+    - "running": over all frames so far. Early frames are normalized with
+      statistics of the first fraction of a second and differ most from
+      offline; the last chunk uses exactly the offline statistics.
+    - "window": over the last `stats_frames` frames, which follows
+      changes in level and channel but never converges to offline on
+      utterances longer than the window.
+
+    tools/bench_stream_features.py measures the difference, and the WER
+    change it causes, on the bundled recordings.
+
+    Args:
+        featurizer: FilterbankFeatures (buffers are shared, not copied).
+        normalization (str): "running", "window" or None.
+        stats_frames (int): Frames of the "window" statistics.
+    """
+    def __init__(self, featurizer, normalization="running", stats_frames=400):
+        if normalization not in STREAM_NORMALIZATIONS:
+            raise ValueError(
+                f"{self} received {normalization} for the normalization "
+                f"parameter. It must be one of {STREAM_NORMALIZATIONS}.")
+        if normalization == "window" and stats_frames < 2:
+            raise ValueError(
+                f"{self} got stats_frames={stats_frames}; the window needs "
+                f"at least 2 frames.")
+        self.featurizer = featurizer
+        self.normalization = normalization
+        self.stats_frames = stats_frames
+        self.pad = featurizer.n_fft // 2
+        self.reset()
+
+    def reset(self):
+        self.last = None  # previous raw sample, for pre-emphasis
+        self.tail = None  # last pad + 1 pre-emphasized samples
+        self.buffer = None  # padded signal from frame `emitted` on
+        self.received = 0
+        self.emitted = 0
+        self.count = 0
+        self.mean = None
+        self.m2 = None
+        self.history = None
+
+    def _preemphasize(self, x):
+        preemph = self.featurizer.preemph
+        previous = x[:, :1] * 0. if self.last is None else self.last
+        self.last = x[:, -1:]
+        if preemph is None:
+            return x
+        return x - preemph * torch.cat((previous, x[:, :-1]), dim=1)
+
+    def _frames(self, last):
+        """Features of frames emitted..last-1 from the buffer."""
+        f = self.featurizer
+        if last <= self.emitted:
+            return self.buffer.new_empty(
+                self.buffer.shape[0], f.nfilt * f.frame_splicing, 0)
+        stop = (last - self.emitted - 1) * f.hop_length + f.n_fft
+        x = f.frame_features(self.buffer[:, :stop], center=False)
+        self.buffer = self.buffer[:, (last - self.emitted) * f.hop_length:]
+        self.emitted = last
+        return self._normalize(x)
+
+    def _normalize(self, x):
+        normalize_type = self.featurizer.normalize
+        if self.normalization is None or x.shape[-1] == 0 \
+                or normalize_type not in ("per_feature", "all_features"):
+            return x
+        dims = (2,) if normalize_type == "per_feature" else (1, 2)
+        if self.normalization == "window":
+            self.history = x if self.history is None else torch.cat(
+                (self.history, x), dim=-1)[:, :, -self.stats_frames:]
+            count, mean, m2 = _moments(self.history, dims)
+        elif self.mean is None:
+            count, mean, m2 = _moments(x, dims)
+        else:
+            # Chan et al.'s pairwise update of the running moments.
+            n, chunk_mean, chunk_m2 = _moments(x, dims)
+            count = self.count + n
+            delta = chunk_mean - self.mean
+            mean = self.mean + delta * n / count
+            m2 = self.m2 + chunk_m2 + delta.pow(2) * self.count * n / count
+        self.count, self.mean, self.m2 = count, mean, m2
+        # Unbiased like normalize_batch.
+        std = torch.sqrt(m2 / max(count - 1, 1)) + CONSTANT
+        return (x - mean) / std
+
+    @torch.no_grad()
+    def step(self, x):
+        """Appends [B, n] samples; returns the frames they complete."""
+        f = self.featurizer
+        empty = x.new_empty(x.shape[0], f.nfilt * f.frame_splicing, 0)
+        if x.shape[-1] == 0:
+            return empty
+        x = self._preemphasize(x)
+        self.received += x.shape[-1]
+        self.tail = x if self.tail is None else torch.cat((self.tail, x), 1)
+        if self.buffer is None:
+            # Frame 0 needs the reflect padding, i.e. samples 1..pad.
+            if self.received <= self.pad:
+                return empty
+            x = torch.cat((self.tail[:, 1:self.pad + 1].flip(-1),
+                           self.tail), dim=1)
+            self.buffer = x[:, :0]
+        self.buffer = torch.cat((self.buffer, x), dim=1)
+        self.tail = self.tail[:, -(self.pad + 1):]
+        padded = self.pad + self.received
+        return self._frames(max((padded - f.n_fft) // f.hop_length + 1, 0))
+
+    @torch.no_grad()
+    def flush(self):
+        """Ends the stream and returns the remaining frames; reset() before
+        starting a new one."""
+        f = self.featurizer
+        if self.buffer is None:
+            raise RuntimeError(
+                f"flush() after {self.received} samples; reflect padding "
+                f"needs more than n_fft // 2 = {self.pad}.")
+        self.buffer = torch.cat(
+            (self.buffer, self.tail[:, -(self.pad + 1):-1].flip(-1)), dim=1)
+        return self._frames(math.ceil(self.received / f.hop_length))
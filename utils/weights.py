@@ -0,0 +1,247 @@
+"""
+Packed weight archive for the exported QuartzNet variables.
+
+The onnx-pytorch export ships every tensor as its own ``.npy`` file under
+``variables/``. Opening and parsing 265 files on every ``Model()`` dominates
+cold start, so the tensors can be packed once into a single archive::
+
+    magic (8 bytes) | index length (uint64, little endian) | JSON index
+    | zero padding | tensor blobs, each aligned to ALIGNMENT bytes
+
+The archive is memory-mapped at load time and every tensor is a zero-copy
+view into the mapping, so pages are faulted in lazily and shared through
+the page cache between processes.
+
+For multi-process serving one process can publish the archive into shared
+memory (a file on the ``/dev/shm`` tmpfs) and every replica attaches to it
+read-only, so the weights are resident exactly once per host.
+"""
+__all__ = ['ARCHIVE_PATH',
+           'VARIABLES_DIR',
+           'attach_shared',
+           'load_archive',
+           'load_npy_dir',
+           'load_variables',
+           'pack_variables',
+           'publish_shared',
+           'read_index',
+           'release_shared',
+           'shared_path',
+           'skip_init',
+           'tensors_from_buffer']
+
+import contextlib
+import glob
+import json
+import mmap
+import os
+import struct
+import tempfile
+import warnings
+
+import numpy as np
+import torch
+
+MAGIC = b"QNETW001"
+ALIGNMENT = 64
+_HEADER = struct.Struct("<8sQ")
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VARIABLES_DIR = os.path.join(_ROOT, "variables")
+ARCHIVE_PATH = os.path.join(_ROOT, "variables.qnw")
+SHARED_DIR = "/dev/shm" if os.path.isdir("/dev/shm") \
+    else tempfile.gettempdir()
+
+
+def _align(offset, alignment=ALIGNMENT):
+    return offset + (-offset % alignment)
+
+
+def load_npy_dir(path=VARIABLES_DIR):
+    """Loads every ``<name>.npy`` file of ``path`` into a dict of tensors."""
+    variables = {}
+    for b in sorted(glob.glob(os.path.join(path, "*.npy"))):
+        variables[os.path.basename(b)[:-4]] = torch.from_numpy(np.load(b))
+    return variables
+
+
+def pack_variables(variables=VARIABLES_DIR, path=ARCHIVE_PATH):
+    """Writes tensors into a packed archive.
+
+    Args:
+        variables (str or dict): Directory of ``.npy`` files or a dict
+            mapping names to tensors / arrays.
+            Defaults to the bundled ``variables/`` directory.
+        path (str): Destination archive.
+            Defaults to ``variables.qnw`` next to ``variables/``.
+
+    Returns:
+        (dict) the JSON index that was written.
+    """
+    if isinstance(variables, str):
+        variables = load_npy_dir(variables)
+    arrays = []
+    for name, v in variables.items():
+        if isinstance(v, torch.Tensor):
+            v = v.detach().cpu().numpy()
+        arrays.append((name, np.ascontiguousarray(v)))
+
+    entries = []
+    offset = 0
+    for name, a in arrays:
+        offset = _align(offset)
+        entries.append({"name": name, "dtype": a.dtype.str,
+                        "shape": list(a.shape), "offset": offset,
+                        "nbytes": a.nbytes})
+        offset += a.nbytes
+
+    # Blob offsets are stored relative to the data section so the index
+    # length does not depend on itself.
+    index = json.dumps({"alignment": ALIGNMENT,
+                        "tensors": entries}).encode("utf-8")
+    data_start = _align(_HEADER.size + len(index))
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, len(index)))
+        f.write(index)
+        for entry, (_, a) in zip(entries, arrays):
+            f.seek(data_start + entry["offset"])
+            f.write(a.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+    return {"alignment": ALIGNMENT, "tensors": entries}
+
+
+def read_index(buf):
+    """Parses the header of an archive held in ``buf``.
+
+    Returns:
+        (index, data_start) where index is the decoded JSON index.
+    """
+    magic, index_len = _HEADER.unpack_from(buf, 0)
+    if magic != MAGIC:
+        raise ValueError(
+            f"Not a packed weight archive (bad magic {magic!r}).")
+    index = json.loads(bytes(buf[_HEADER.size:_HEADER.size + index_len]))
+    return index, _align(_HEADER.size + index_len, index["alignment"])
+
+
+def tensors_from_buffer(buf):
+    """Creates zero-copy tensors for every entry of an archive buffer."""
+    index, data_start = read_index(buf)
+    variables = {}
+    for entry in index["tensors"]:
+        a = np.frombuffer(buf, dtype=np.dtype(entry["dtype"]),
+                          count=int(np.prod(entry["shape"], dtype=np.int64)),
+                          offset=data_start + entry["offset"])
+        variables[entry["name"]] = torch.from_numpy(a.reshape(entry["shape"]))
+    return variables
+
+
+def load_archive(path=ARCHIVE_PATH):
+    """Memory-maps a packed archive and returns a dict of tensor views.
+
+    The mapping is private copy-on-write: untouched pages are shared with
+    the page cache (and every other process mapping the same file) and an
+    accidental in-place update never reaches the file on disk.
+    """
+    with open(path, "rb") as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    # The numpy views keep the mmap object alive for as long as any tensor
+    # still references it.
+    return tensors_from_buffer(buf)
+
+
+@contextlib.contextmanager
+def skip_init(*module_types):
+    """Disables ``reset_parameters`` of ``module_types`` inside the block.
+
+    Used while building modules whose weights are rebound to loaded
+    variables right away: the placeholder parameters stay uninitialised
+    (their pages are never touched) instead of being filled randomly.
+
+    The method is patched on the class, so for the duration of the block
+    it is disabled process-wide: a module of the same type built in
+    another thread meanwhile also keeps garbage weights. Do not build
+    such modules concurrently with a model that uses this.
+    """
+    saved = [(t, t.__dict__.get("reset_parameters")) for t in module_types]
+    for t in module_types:
+        t.reset_parameters = lambda self: None
+    try:
+        yield
+    finally:
+        for t, fn in saved:
+            if fn is None:
+                del t.reset_parameters
+            else:
+                t.reset_parameters = fn
+
+
+def load_variables(weights=None):
+    """Resolves the ``weights`` argument of ``Model`` to a dict of tensors.
+
+    Args:
+        weights (None, str or dict): ``None`` uses ``variables.qnw`` when it
+            has been packed and falls back to ``variables/`` otherwise. A
+            directory is read as ``.npy`` files, any other path as a packed
+            archive. A dict is returned unchanged.
+    """
+    if weights is None:
+        weights = ARCHIVE_PATH if os.path.exists(ARCHIVE_PATH) \
+            else VARIABLES_DIR
+    if isinstance(weights, dict):
+        return weights
+    if os.path.isdir(weights):
+        return load_npy_dir(weights)
+    return load_archive(weights)
+
+
+def shared_path(name):
+    """Location of the shared weight segment called ``name``."""
+    return os.path.join(SHARED_DIR, name + ".qnw")
+
+
+def publish_shared(name, weights=None):
+    """Publishes weights into a shared-memory segment.
+
+    Args:
+        name (str): Segment name replicas pass to ``attach_shared``.
+        weights: Anything ``load_variables`` accepts.
+            Defaults to the bundled weights.
+
+    Returns:
+        (str) path of the segment.
+    """
+    path = shared_path(name)
+    pack_variables(load_variables(weights), path)
+    return path
+
+
+def attach_shared(name):
+    """Maps a published segment and returns read-only tensor views.
+
+    The mapping is shared and read-only: every replica reads the same
+    physical pages and any attempt to write through a view faults instead
+    of silently diverging from the other processes. Pass the result as the
+    ``weights`` of ``Model``.
+    """
+    with open(shared_path(name), "rb") as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    with warnings.catch_warnings():
+        # torch warns that the numpy views are not writable, which is the
+        # whole point here.
+        warnings.simplefilter("ignore", UserWarning)
+        return tensors_from_buffer(buf)
+
+
+def release_shared(name):
+    """Removes a published segment.
+
+    Replicas that are already attached keep their mapping until they exit.
+    """
+    try:
+        os.remove(shared_path(name))
+    except FileNotFoundError:
+        pass